@@ -361,6 +361,10 @@ def parse_options():
         help=_(
             "Install the packages referenced by a local xml instead of the default ones"),
         nargs='?')
+    parser.add_argument(
+        "-r", "--record-events",
+        help=_("Store all installation events in a file (to replay them later)"),
+        nargs='?')
     parser.add_argument(
         "-s", "--log-server",
         help=_("Choose to which log server send Cnchi logs."
@@ -27,9 +27,26 @@
 #  along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
 
 
-""" Configuration module for Cnchi """
+""" Configuration module for Cnchi
 
+    Settings are shared by all Cnchi processes. They are stored (pickled)
+    in a shared memory block along with a version number that is increased
+    each time a setting changes. Each process keeps its own unpickled copy
+    and only reads the shared block again when the version has changed, so
+    reading a setting does not need to copy the whole dict between
+    processes. """
+
+import copy
+import logging
 import multiprocessing
+import pickle
+
+# Size of the shared memory block that stores all settings (pickled)
+SETTINGS_SIZE = 1024 * 1024
+
+# Settings that can still change while Cnchi is installing
+# (snapshots read them from the shared settings every time)
+LIVE_KEYS = ('rankmirrors_result', 'cache_pkgs_md5_check_failed')
 
 
 class Settings(object):
@@ -38,10 +55,19 @@ class Settings(object):
     def __init__(self):
         """ Initialize default configuration """
 
-        # Creates a one element size queue
-        self.settings = multiprocessing.Queue(1)
+        self.lock = multiprocessing.Lock()
+        # Notified each time a setting changes
+        self.changed = multiprocessing.Condition(self.lock)
+        # Increased each time a setting changes
+        self.version = multiprocessing.RawValue('L', 0)
+        self.data_size = multiprocessing.RawValue('L', 0)
+        self.data = multiprocessing.RawArray('c', SETTINGS_SIZE)
 
-        self.settings.put({
+        # This process' copy of the settings (and its version)
+        self.local_settings = {}
+        self.local_version = -1
+
+        self._write_settings({
             'alternate_package_list': '',
             'auto_device': '/dev/sda',
             'bootloader': 'grub2',
@@ -60,6 +86,7 @@ class Settings(object):
             'desktops': [],
             'enable_alongside': True,
             'encrypt_home': False,
+            'events_log': '',
             'f2fs': False,
             'feature_aur': False,
             'feature_bluetooth': False,
@@ -90,6 +117,8 @@ class Settings(object):
             'luks_root_password': '',
             'luks_root_volume': '',
             'luks_root_device': '',
+            'max_download_bandwidth': 0,
+            'max_downloads': 4,
             'network_manager': 'NetworkManager',
             'partition_mode': 'automatic',
             'proxies': None,
@@ -127,35 +156,124 @@ class Settings(object):
             'zfs_pool_name': 'antergos',
             'zfs_pool_id': 0})
 
-    def _get_settings(self):
-        """ Get a copy of our settings """
-        settings = self.settings.get()
-        copy = settings.copy()
-        self.settings.put(settings)
-        return copy
-
-    def _update_settings(self, new_settings):
-        """ Updates global settings """
-        settings = self.settings.get()
-        try:
-            settings.update(new_settings)
-        finally:
-            self.settings.put(settings)
+    def _write_settings(self, settings):
+        """ Stores settings in shared memory (lock must be held) """
+        data = pickle.dumps(settings, pickle.HIGHEST_PROTOCOL)
+        if len(data) > SETTINGS_SIZE:
+            raise ValueError(
+                "Settings do not fit in shared memory ({0} bytes)".format(len(data)))
+        self.data[:len(data)] = data
+        self.data_size.value = len(data)
+        self.version.value += 1
+        self.local_settings = settings
+        self.local_version = self.version.value
+
+    def _read_settings(self):
+        """ Updates this process' copy of the settings if they have
+            changed (lock must be held) """
+        if self.local_version != self.version.value:
+            data = self.data[:self.data_size.value]
+            self.local_settings = pickle.loads(data)
+            self.local_version = self.version.value
+        return self.local_settings
+
+    def get_version(self):
+        """ Returns settings version (it changes each time a setting does) """
+        return self.version.value
+
+    def get(self, key):
+        """ Get one setting value """
+        if self.local_version != self.version.value:
+            with self.lock:
+                self._read_settings()
+        value = self.local_settings.get(key, None)
+        if isinstance(value, (list, dict, set)):
+            # Do not let the caller modify our copy
+            value = copy.deepcopy(value)
+        return value
+
+    def get_all(self):
+        """ Returns a copy of all settings """
+        with self.lock:
+            return copy.deepcopy(self._read_settings())
+
+    def snapshot(self, live_keys=LIVE_KEYS):
+        """ Returns a read only copy of the current settings """
+        return SettingsSnapshot(self, live_keys)
+
+    def wait_for_change(self, version, timeout=None):
+        """ Waits until settings version is not version anymore (or timeout
+            seconds have passed). Returns the current settings version """
+        with self.lock:
+            self.changed.wait_for(
+                lambda: self.version.value != version, timeout)
+            return self.version.value
+
+    def set(self, key, value):
+        """ Set one setting's value. Returns False if it can't be stored
+            (shared memory is full), the previous value is kept then """
+        with self.lock:
+            settings = dict(self._read_settings())
+            current = settings.get(key, 'keyerror')
+            exists = current != 'keyerror'
+
+            if exists and current and isinstance(current, list) and not isinstance(value, list):
+                settings[key] = current + [value]
+            else:
+                settings[key] = value
+
+            try:
+                self._write_settings(settings)
+            except ValueError as err:
+                # Shared memory can't grow, keep the previous value
+                logging.error("Can't set '%s' setting: %s", key, err)
+                return False
+            self.changed.notify_all()
+            return True
+
+
+class SettingsSnapshot(object):
+    """ Copy of all settings taken at one point in time, for processes that
+        read settings in hot loops (settings can be read as attributes:
+        snapshot.locale). Keys in live_keys are subscribed to: they are
+        always read from the shared settings. set() changes the shared
+        settings too. """
+
+    def __init__(self, settings, live_keys=LIVE_KEYS):
+        object.__setattr__(self, '_settings', settings)
+        object.__setattr__(self, '_live_keys', frozenset(live_keys))
+        object.__setattr__(self, '_values', settings.get_all())
+
+    def __getattr__(self, key):
+        if key.startswith('_') or key not in self._values:
+            raise AttributeError(key)
+        return self.get(key)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Settings snapshot is read only, use set()")
 
     def get(self, key):
         """ Get one setting value """
-        settings = self._get_settings()
-        return settings.get(key, None)
+        if key in self._live_keys:
+            return self._settings.get(key)
+        value = self._values.get(key, None)
+        if isinstance(value, (list, dict, set)):
+            value = copy.deepcopy(value)
+        return value
 
     def set(self, key, value):
-        """ Set one setting's value """
-        settings = self._get_settings()
-        current = settings.get(key, 'keyerror')
-        exists = current != 'keyerror'
+        """ Set one setting's value (in this snapshot and in the
+            shared settings). Returns False if it can't be stored """
+        if not self._settings.set(key, value):
+            return False
+        if key not in self._live_keys:
+            self._values[key] = self._settings.get(key)
+        return True
 
-        if exists and current and isinstance(current, list) and not isinstance(value, list):
-            settings[key].append(value)
-        else:
-            settings[key] = value
+    def get_version(self):
+        """ Returns shared settings version """
+        return self._settings.get_version()
 
-        self._update_settings(settings)
+    def wait_for_change(self, version, timeout=None):
+        """ Waits until shared settings version is not version anymore """
+        return self._settings.wait_for_change(version, timeout)
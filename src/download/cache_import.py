@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# cache_import.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Copies packages between cache directories as cheaply as possible
+
+    These methods are tried in order:
+        hardlink: no data is copied at all (same filesystem only)
+        reflink: copy on write clone (btrfs, xfs... same filesystem only)
+        kernel copy: copy_file_range or sendfile, data does not go through
+                     user space
+        copy: plain old copy """
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import threading
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# Biggest chunk copied by a single copy_file_range/sendfile call
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+
+# Errors that mean "this method can't be used here, try the next one"
+UNSUPPORTED_ERRORS = [
+    errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY,
+    errno.EINVAL, errno.ENOSYS, errno.EBADF, errno.EMLINK]
+
+# Methods that have already failed between two devices
+# (so we do not try them again for every package)
+_UNSUPPORTED = set()
+_UNSUPPORTED_LOCK = threading.Lock()
+
+
+def hardlink_file(src, dst):
+    """ Creates dst as a hard link of src """
+    os.link(src, dst)
+
+
+def reflink_file(src, dst):
+    """ Clones src into dst (copy on write) """
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    shutil.copymode(src, dst)
+
+
+def kernel_copy_file(src, dst):
+    """ Copies src into dst without moving data through user space """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        size = os.fstat(src_file.fileno()).st_size
+        offset = 0
+        while offset < size:
+            count = min(KERNEL_COPY_CHUNK, size - offset)
+            if copy_file_range:
+                try:
+                    copied = copy_file_range(
+                        src_file.fileno(), dst_file.fileno(), count,
+                        offset, offset)
+                except OSError as os_error:
+                    # Older kernels can't use copy_file_range between
+                    # different filesystems, sendfile can
+                    if offset > 0 or os_error.errno not in UNSUPPORTED_ERRORS:
+                        raise
+                    copy_file_range = None
+                    continue
+            else:
+                copied = os.sendfile(
+                    dst_file.fileno(), src_file.fileno(), offset, count)
+            if copied == 0:
+                break
+            offset += copied
+    if offset < size:
+        raise OSError(errno.EIO, "Short copy", src)
+    shutil.copymode(src, dst)
+
+
+def plain_copy_file(src, dst):
+    """ Copies src into dst the usual way """
+    shutil.copy(src, dst)
+
+
+COPY_METHODS = [
+    ('hardlink', hardlink_file),
+    ('reflink', reflink_file),
+    ('kernel copy', kernel_copy_file),
+    ('copy', plain_copy_file)]
+
+
+def import_file(src, dst):
+    """ Copies src to dst using the cheapest available method.
+        dst is replaced atomically (it never exists half copied).
+        Returns the name of the method used. Raises OSError if the file
+        can't be copied at all """
+    tmp_dst = dst + '.cnchi-tmp'
+    devices = (
+        os.stat(src).st_dev,
+        os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+
+    for name, copy_method in COPY_METHODS:
+        if (name, devices) in _UNSUPPORTED:
+            continue
+        try:
+            if os.path.lexists(tmp_dst):
+                os.remove(tmp_dst)
+            copy_method(src, tmp_dst)
+            os.replace(tmp_dst, dst)
+            return name
+        except OSError as os_error:
+            if os.path.lexists(tmp_dst):
+                os.remove(tmp_dst)
+            if name == 'copy' or os_error.errno not in UNSUPPORTED_ERRORS:
+                raise
+            logging.debug(
+                "Can't use %s to copy %s to %s (%s). "
+                "It won't be used again between these devices.",
+                name, src, dst, os_error)
+            with _UNSUPPORTED_LOCK:
+                _UNSUPPORTED.add((name, devices))
+
+    return None
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# cache_index.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Index of already verified packages in a cache directory
+
+    Each cache directory (pacman cache, xz_cache directories) has a small
+    json file with the size, modification time, inode and checksums of the
+    packages Cnchi has already hashed. As long as a file does not change,
+    its checksum is taken from the index instead of reading the whole file
+    again (next install from the same cache, for instance).
+
+    The index is stored inside its cache directory, so it travels with
+    removable media (the same xz_cache stick used to install many computers).
+    The pacman cache of the target system is the exception: its index is
+    stored in INDEX_DIR, so it does not end up in the installed system. """
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# Read files in big blocks when computing their checksums
+HASH_BUFFER_SIZE = 1024 * 1024
+
+INDEX_NAME = '.cnchi-verified-index.json'
+INDEX_DIR = '/var/cache/cnchi/verified'
+INDEX_VERSION = 1
+
+# Cache directories whose index is stored in INDEX_DIR
+_OUTSIDE_DIRS = set(['/install/var/cache/pacman/pkg'])
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def update_hash(file_hash, file_name):
+    """ Feeds file contents to a hashlib object """
+    buf = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buf)
+    with open(file_name, "rb", buffering=0) as myfile:
+        size = myfile.readinto(buf)
+        while size:
+            file_hash.update(view[:size])
+            size = myfile.readinto(buf)
+    return file_hash
+
+
+def compute_hash(file_name, hash_type='sha256'):
+    """ Reads file_name and returns its hash """
+    return update_hash(hashlib.new(hash_type), file_name).hexdigest()
+
+
+def get_index_path(directory, index_dir=None):
+    """ Returns the path of the index file of a cache directory
+        (inside it, unless index_dir is given) """
+    if index_dir is None:
+        return os.path.join(directory, INDEX_NAME)
+    name = hashlib.sha1(os.path.abspath(directory).encode()).hexdigest()
+    return os.path.join(index_dir, name + '.json')
+
+
+def keep_index_outside(directory):
+    """ Stores the index of directory in INDEX_DIR instead of inside it
+        (for caches that will be part of the installed system) """
+    with _INDEXES_LOCK:
+        _OUTSIDE_DIRS.add(os.path.abspath(directory))
+
+
+class VerifiedIndex(object):
+    """ Checksums of the files of one cache directory """
+
+    def __init__(self, directory, index_dir=None):
+        self.directory = directory
+        self.path = get_index_path(directory, index_dir)
+        self.entries = {}
+        self.modified = False
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """ Loads index from disk (if it exists) """
+        try:
+            with open(self.path) as index_file:
+                data = json.load(index_file)
+            if data.get('version') == INDEX_VERSION:
+                self.entries = data.get('files', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as err:
+            logging.debug("Ignoring cache index %s: %s", self.path, err)
+
+    def save(self):
+        """ Writes index to disk (only if there are changes) """
+        with self.lock:
+            if not self.modified:
+                return
+            data = {'version': INDEX_VERSION, 'files': self.entries}
+            tmp_path = self.path + '.tmp'
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmp_path, 'w') as index_file:
+                    json.dump(data, index_file)
+                os.replace(tmp_path, self.path)
+                self.modified = False
+            except OSError as err:
+                # Read only cache? The index is still valid for this session
+                logging.debug("Can't write cache index %s: %s", self.path, err)
+
+    @staticmethod
+    def _get_stat(path):
+        """ Returns the stat info we use to detect a file change """
+        stat = os.stat(path)
+        return {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'inode': stat.st_ino,
+            'dev': stat.st_dev}
+
+    @staticmethod
+    def _is_unchanged(entry, stat):
+        """ Checks if a file is the same one that was indexed. Inode numbers
+            are only compared in the same device (removable media may be
+            mounted with different inode numbers on another computer) """
+        if entry.get('size') != stat['size'] or entry.get('mtime') != stat['mtime']:
+            return False
+        if entry.get('dev') == stat['dev'] and entry.get('inode') != stat['inode']:
+            return False
+        return True
+
+    def get_hash(self, path, hash_type='sha256'):
+        """ Returns the hash of path, from the index if the file
+            has not been modified since it was indexed """
+        name = os.path.basename(path)
+        stat = self._get_stat(path)
+
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry and self._is_unchanged(entry, stat):
+                digest = entry.get('hashes', {}).get(hash_type)
+                if digest:
+                    return digest
+
+        digest = compute_hash(path, hash_type)
+        self.add_hash(path, hash_type, digest, stat)
+        return digest
+
+    def add_hash(self, path, hash_type, digest, stat=None):
+        """ Stores the (already computed) hash of path """
+        name = os.path.basename(path)
+        if stat is None:
+            stat = self._get_stat(path)
+
+        with self.lock:
+            entry = self.entries.get(name)
+            if not entry or not self._is_unchanged(entry, stat):
+                # New or modified file, forget old hashes
+                entry = dict(stat)
+                entry['hashes'] = {}
+                self.entries[name] = entry
+            entry['dev'] = stat['dev']
+            entry['inode'] = stat['inode']
+            entry['hashes'][hash_type] = digest
+            self.modified = True
+
+
+def get_index(directory):
+    """ Returns the index of a cache directory """
+    directory = os.path.abspath(directory)
+    with _INDEXES_LOCK:
+        if directory not in _INDEXES:
+            index_dir = INDEX_DIR if directory in _OUTSIDE_DIRS else None
+            _INDEXES[directory] = VerifiedIndex(directory, index_dir)
+        return _INDEXES[directory]
+
+
+def get_file_hash(path, hash_type='sha256'):
+    """ Returns the hash of a file, using its directory index """
+    return get_index(os.path.dirname(path)).get_hash(path, hash_type)
+
+
+def add_file_hash(path, hash_type, digest):
+    """ Stores the hash of a file that has just been verified """
+    try:
+        get_index(os.path.dirname(path)).add_hash(path, hash_type, digest)
+    except OSError as err:
+        logging.debug("Can't add %s to its cache index: %s", path, err)
+
+
+def save_indexes():
+    """ Writes all modified indexes to disk """
+    with _INDEXES_LOCK:
+        indexes = list(_INDEXES.values())
+    for index in indexes:
+        index.save()
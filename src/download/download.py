@@ -30,11 +30,13 @@
 
 import os
 import logging
-import queue
 
-import pacman.pac as pac
+import pacman.session as pac_session
 import download.metalink as ml
 import download.download_requests as download_requests
+from download.mirror_health import get_host
+
+import events
 
 import misc.extra as misc
 
@@ -45,6 +47,20 @@ except NameError as err:
     def _(message):
         return message
 
+# Sort position of mirrors that are not in the rankmirrors result
+UNRANKED = 9999
+
+
+def get_mirror_ranks(ranked_urls):
+    """ Returns a dict host -> position of its first mirror url
+        in the ranked mirror list """
+    ranks = {}
+    for position, url in enumerate(ranked_urls or []):
+        if url:
+            ranks.setdefault(get_host(url), position)
+    return ranks
+
+
 class DownloadPackages(object):
     """ Class to download packages. This class tries to previously download
         all necessary packages for  Antergos installation using requests. """
@@ -73,13 +89,19 @@ class DownloadPackages(object):
         # Create pacman cache dir (it's ok if it already exists)
         os.makedirs(self.pacman_cache_dir, mode=0o755, exist_ok=True)
 
-        # Stores last issued event for each event type
-        # (to prevent repeating events)
-        self.last_event = {}
+        # Sends events to the GUI (without repeating them
+        # and limiting the rate of progress events)
+        if self.callback_queue is not None:
+            self.publisher = events.get_publisher(self.callback_queue)
+        else:
+            self.publisher = None
 
-        # List of packages' metalinks
+        # Download plan (dict of metalink.DownloadElement objects)
         self.metalinks = None
 
+        # Position of each mirror host in the rankmirrors result
+        self.mirror_ranks = None
+
     def start(self, metalinks=None):
         """ Begin download """
         if metalinks:
@@ -100,7 +122,9 @@ class DownloadPackages(object):
             self.pacman_cache_dir,
             self.xz_cache_dirs,
             self.callback_queue,
-            proxies)
+            proxies,
+            max_downloads=self.settings.get('max_downloads'),
+            max_bandwidth=self.settings.get('max_download_bandwidth'))
 
         if not download.start(self.metalinks):
             # When we can't download (even one package), we stop right here
@@ -110,13 +134,12 @@ class DownloadPackages(object):
     def url_sort_helper(self, url):
         """ helper method for sorting mirror urls """
         if not url:
-            return 9999
-        # Use the mirrorlist we created earlier to determine a url's priority
-        ranked = self.settings.get('rankmirrors_result')
+            return UNRANKED
+        if self.mirror_ranks is None:
+            self.mirror_ranks = get_mirror_ranks(
+                self.settings.get('rankmirrors_result'))
         # Use the first part of the URL to find its position in the ranked mirror list
-        partial = '/'.join(url.split('/')[:3])
-        position = [i for i, s in enumerate(ranked) if partial in s] or [9999]
-        return position[0]
+        return self.mirror_ranks.get(get_host(url), UNRANKED)
 
     @misc.raise_privileges
     def create_metalinks_list(self):
@@ -125,17 +148,14 @@ class DownloadPackages(object):
         self.queue_event('percent', '0')
         self.queue_event(
             'info', _('Creating the list of packages to download...'))
-        processed_packages = 0
-        total_packages = len(self.package_names)
 
         self.metalinks = {}
 
         try:
-            pacman = pac.Pac(
+            # Reuse the alpm session opened when packages were selected
+            pacman = pac_session.get_pac(
                 conf_path=self.pacman_conf_file,
                 callback_queue=self.callback_queue)
-            if pacman is None:
-                return None
         except Exception as ex:
             self.metalinks = None
             template = "Can't initialize pyalpm. " \
@@ -145,39 +165,31 @@ class DownloadPackages(object):
             return None
 
         try:
-            for package_name in self.package_names:
-                metalink = ml.create(pacman, package_name,
-                                     self.pacman_conf_file)
-                if metalink is None:
-                    txt = "Error creating metalink for package %s. Installation will stop"
-                    logging.error(txt, package_name)
-                    txt = _("Error creating metalink for package {0}. "
-                            "Installation will stop").format(package_name)
-                    raise misc.InstallError(txt)
-
-                # Get metalink info
-                metalink_info = ml.get_info(metalink)
-
-                # Update downloads list with the new info from
-                # the processed metalink
-                for key in metalink_info:
-                    if key not in self.metalinks:
-                        self.metalinks[key] = metalink_info[key]
-                        urls = metalink_info[key]['urls']
-                        if self.settings:
-                            # Sort urls based on the rankmirrors mirrorlist
-                            sorted_urls = sorted(
-                                urls,
-                                key=self.url_sort_helper)
-                            self.metalinks[key]['urls'] = sorted_urls
-                        else:
-                            # When testing, settings is not available
-                            self.metalinks[key]['urls'] = urls
-
-                # Show progress to the user
-                processed_packages += 1
-                percent = round(float(processed_packages / total_packages), 2)
-                self.queue_event('percent', str(percent))
+            # All packages are resolved at once, so dependencies shared
+            # by many of them are only looked up one time
+            plan = ml.create(pacman, self.package_names,
+                             self.pacman_conf_file)
+            if plan is None:
+                txt = "Error creating metalink for packages %s. Installation will stop"
+                logging.error(txt, ", ".join(self.package_names))
+                txt = _("Error creating the list of packages to download. "
+                        "Installation will stop")
+                raise misc.InstallError(txt)
+
+            self.queue_event('percent', '0.5')
+
+            self.metalinks = plan
+            if self.settings:
+                # Sort urls based on the rankmirrors mirrorlist
+                # (when testing, settings is not available)
+                self.mirror_ranks = get_mirror_ranks(
+                    self.settings.get('rankmirrors_result'))
+                for element in self.metalinks.values():
+                    element.urls = sorted(
+                        element.urls,
+                        key=self.url_sort_helper)
+
+            self.queue_event('percent', '1')
         except Exception as ex:
             template = "Can't create download set. " \
                 "An exception of type {0} occured. Arguments:\n{1!r}"
@@ -186,16 +198,6 @@ class DownloadPackages(object):
             self.metalinks = None
             return None
 
-        try:
-            pacman.release()
-            del pacman
-        except Exception as ex:
-            self.metalinks = None
-            template = "Can't release pyalpm. An exception of type {0} occured. Arguments:\n{1!r}"
-            message = template.format(type(ex).__name__, ex.args)
-            logging.error(message)
-            return None
-
         # Overwrite last event (to clean up the last message)
         self.queue_event('info', "")
 
@@ -207,18 +209,7 @@ class DownloadPackages(object):
                 logging.debug("%s:%s", event_type, event_text)
             return
 
-        if event_type in self.last_event:
-            if self.last_event[event_type] == event_text:
-                # do not repeat same event
-                return
-
-        self.last_event[event_type] = event_text
-
-        try:
-            # Add the event
-            self.callback_queue.put_nowait((event_type, event_text))
-        except queue.Full:
-            pass
+        self.publisher.publish(event_type, event_text)
 
 
 def test():
@@ -31,16 +31,23 @@
 
 import os
 import logging
-import queue
-import shutil
 import time
 import hashlib
 import socket
 import io
+import json
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 
+from download.mirror_health import MirrorHealth
+import download.cache_index as cache_index
+import download.cache_import as cache_import
+import mirror_cache
+import events
+from events import N_
+
 # When testing, no _() is available
 try:
     _("")
@@ -48,46 +55,237 @@ except NameError as err:
     def _(message):
         return message
 
-def get_md5(file_name):
-    """ Gets md5 hash from a file """
-    md5_hash = hashlib.md5()
-    with open(file_name, "rb") as myfile:
-        for line in myfile:
-            md5_hash.update(line)
-    return md5_hash.hexdigest()
+# Default number of packages downloaded at the same time
+MAX_DOWNLOADS = 4
+
+# How many times all mirrors of a package are tried before giving up
+MAX_MIRROR_PASSES = 2
+
+# Partially downloaded files are stored with this suffix along with a
+# small json journal (.part.json) that allows to resume them later
+PART_SUFFIX = '.part'
+JOURNAL_SUFFIX = '.json'
+
+# Update the journal of a partial download each time this amount
+# of bytes has been written
+JOURNAL_INTERVAL = 4 * 1024 * 1024
+
+# Packages bigger than this are split in byte ranges that are downloaded
+# at the same time from different mirrors (at most MAX_SEGMENTS ranges,
+# none of them smaller than MIN_SEGMENT_SIZE)
+SEGMENT_THRESHOLD = 20 * 1024 * 1024
+MAX_SEGMENTS = 4
+MIN_SEGMENT_SIZE = 5 * 1024 * 1024
+
+# Threads shared by all segmented downloads (the download thread of a
+# segmented package fetches its first segment, these ones fetch the rest)
+SEGMENT_WORKERS = MAX_SEGMENTS
+
+
+def get_element_checksum(element):
+    """ Returns the hash type and the hash of a download element
+        sha256 is preferred, md5 is only used if there is no sha256 """
+    for hash_type in ['sha256', 'md5']:
+        if getattr(element, hash_type):
+            return hash_type, getattr(element, hash_type)
+    return None, None
+
+
+def read_part_journal(part_path):
+    """ Reads the journal of a partially downloaded file
+        Returns None if there is no (valid) journal """
+    try:
+        with open(part_path + JOURNAL_SUFFIX) as journal_file:
+            return json.load(journal_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_part_journal(part_path, journal):
+    """ Stores the journal of a partially downloaded file
+        journal: {'url', 'etag', 'last_modified', 'size', 'bytes_done'} """
+    try:
+        with open(part_path + JOURNAL_SUFFIX, 'w') as journal_file:
+            json.dump(journal, journal_file)
+    except OSError as os_error:
+        logging.debug(
+            "Can't write download journal of %s: %s", part_path, os_error)
+
+
+def resume_segmented_part(part_path, journal):
+    """ Turns a partial segmented download into a single stream one, so it
+        can be resumed by a normal download. Data is kept from the start
+        of the file up to the first byte that has not been downloaded yet.
+        Returns the new journal """
+    offset = 0
+    for start, end, bytes_done in sorted(journal['segments']):
+        if start != offset:
+            break
+        offset = start + bytes_done
+        if bytes_done <= end - start:
+            # Segment is not complete
+            break
+
+    with open(part_path, 'r+b') as xz_file:
+        xz_file.truncate(offset)
+
+    journal = {
+        'url': None,
+        'etag': None,
+        'last_modified': None,
+        'size': journal.get('size'),
+        'bytes_done': offset}
+    write_part_journal(part_path, journal)
+    return journal
+
+
+def remove_part(part_path):
+    """ Removes a partial download and its journal """
+    for path in [part_path, part_path + JOURNAL_SUFFIX]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as os_error:
+            logging.debug("Can't remove %s: %s", path, os_error)
+
 
+def is_range_at(response, position):
+    """ Checks if response is a partial content one that starts at position """
+    content_range = response.headers.get('Content-Range', '')
+    return (response.status_code == requests.codes.partial_content and
+            content_range.startswith('bytes {0}-'.format(position)))
 
-class CopyToCache(threading.Thread):
-    ''' Class thread to copy a xz file to the user's
-        provided cache directory '''
+
+class CopyToCache(object):
+    ''' Copies downloaded xz files to the user's provided cache
+        directories using a small pool of threads '''
 
     PACMAN_ISO_CACHE = "/var/cache/pacman/pkg"
 
-    def __init__(self, origin, xz_cache_dirs):
-        threading.Thread.__init__(self)
-        self.origin = origin
-        self.xz_cache_dirs = xz_cache_dirs
+    # Copies run at the same time (they compete for the same disks)
+    MAX_WORKERS = 2
 
-    def run(self):
-        basename = os.path.basename(self.origin)
+    def __init__(self, xz_cache_dirs):
+        # Avoid using the ISO itself
+        self.xz_cache_dirs = [
+            xz_cache_dir for xz_cache_dir in xz_cache_dirs
+            if xz_cache_dir != CopyToCache.PACMAN_ISO_CACHE]
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def add(self, origin):
+        """ Queues origin to be copied to all cache directories """
+        if not self.xz_cache_dirs:
+            return
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=CopyToCache.MAX_WORKERS)
+            self.executor.submit(self.copy, origin)
+
+    def copy(self, origin):
+        """ Copies origin to all cache directories """
+        basename = os.path.basename(origin)
         for xz_cache_dir in self.xz_cache_dirs:
-            # Avoid using the ISO itself
-            if xz_cache_dir != CopyToCache.PACMAN_ISO_CACHE:
-                dst = os.path.join(xz_cache_dir, basename)
-                # Try to copy the file, do not worry if it's not possible
-                try:
-                    shutil.copy(self.origin, dst)
-                except (FileNotFoundError, FileExistsError, OSError):
-                    pass
+            dst = os.path.join(xz_cache_dir, basename)
+            # Try to copy the file, do not worry if it's not possible
+            try:
+                cache_import.import_file(origin, dst)
+            except OSError as os_error:
+                logging.debug("Can't copy %s to %s: %s", origin, dst, os_error)
+
+    def wait(self):
+        """ Waits until all queued files have been copied """
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+        if executor:
+            executor.shutdown(wait=True)
+
+
+class BandwidthLimiter(object):
+    """ Token bucket shared by all download threads so that the sum of
+        their transfer rates never exceeds a global bandwidth budget """
+
+    def __init__(self, max_bps=0):
+        """ max_bps is the budget in bytes per second (0 means unlimited) """
+        self.max_bps = max_bps
+        self.allowance = max_bps
+        self.last_check = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def consume(self, num_bytes):
+        """ Waits until num_bytes can be transferred without
+            going over the bandwidth budget """
+        if not self.max_bps:
+            return
+
+        with self.lock:
+            now = time.perf_counter()
+            self.allowance += (now - self.last_check) * self.max_bps
+            self.last_check = now
+            # Do not let idle time build up a burst bigger than one second
+            self.allowance = min(self.allowance, self.max_bps)
+            self.allowance -= num_bytes
+            wait = -self.allowance / self.max_bps
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class DownloadProgress(object):
+    """ Aggregates the progress of all concurrent downloads """
+
+    def __init__(self, total_downloads, total_bytes):
+        self.total_downloads = total_downloads
+        self.total_bytes = total_bytes
+        self.started = 0
+        self.finished = 0
+        self.completed_bytes = 0
+        self.start_time = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def package_started(self):
+        """ Returns the index of the package that starts now """
+        with self.lock:
+            self.started += 1
+            return self.started
+
+    def package_finished(self):
+        """ Returns the fraction of packages already processed """
+        with self.lock:
+            self.finished += 1
+            return round(float(self.finished / self.total_downloads), 2)
+
+    def add_bytes(self, num_bytes):
+        """ Adds downloaded bytes and returns current percent and speed """
+        with self.lock:
+            self.completed_bytes += num_bytes
+            if self.total_bytes > 0:
+                percent = min(
+                    round(float(self.completed_bytes / self.total_bytes), 2),
+                    1.0)
+            else:
+                percent = round(float(self.finished / self.total_downloads), 2)
+            elapsed = time.perf_counter() - self.start_time
+            bps = self.completed_bytes // elapsed if elapsed > 0 else 0
+        return percent, bps
 
 
 class Download(object):
     """ Class to download packages using requests
         This class tries to previously download all necessary packages for
-        Antergos installation using requests """
-
-    def __init__(self, pacman_cache_dir, xz_cache_dirs, callback_queue, proxies=None):
-        """ Initialize Download class. Gets default configuration """
+        Antergos installation using requests. Several packages are
+        downloaded at the same time using a pool of threads """
+
+    def __init__(self, pacman_cache_dir, xz_cache_dirs, callback_queue,
+                 proxies=None, max_downloads=MAX_DOWNLOADS, max_bandwidth=0,
+                 mirror_health=None):
+        """ Initialize Download class. Gets default configuration
+            max_downloads: number of packages downloaded at the same time
+            max_bandwidth: global bandwidth budget in bytes/s (0: unlimited)
+            mirror_health: MirrorHealth object shared by all downloads """
         self.pacman_cache_dir = pacman_cache_dir
         self.xz_cache_dirs = xz_cache_dirs
         self.callback_queue = callback_queue
@@ -96,268 +294,724 @@ class Download(object):
         if self.proxies:
             logging.debug("Will use these proxy settings: %s", self.proxies)
 
+        self.max_downloads = max(1, max_downloads or MAX_DOWNLOADS)
+        self.bandwidth = BandwidthLimiter(max_bandwidth)
+        self.mirror_health = mirror_health or MirrorHealth()
+
         # Check that pacman cache directory exists
         os.makedirs(self.pacman_cache_dir, mode=0o755, exist_ok=True)
+        # Its index must not end up in the installed system
+        cache_index.keep_index_outside(self.pacman_cache_dir)
+
+        # Sends events to the GUI (without repeating them
+        # and limiting the rate of progress events)
+        if self.callback_queue is not None:
+            self.publisher = events.get_publisher(self.callback_queue)
+        else:
+            self.publisher = None
 
-        # Stores last issued event (to prevent repeating events)
-        self.last_event = {}
+        self.copy_to_cache = CopyToCache(self.xz_cache_dirs)
 
-        self.copy_to_cache_threads = []
+        # Each download thread uses its own requests session
+        # (so connections to the same mirror are reused)
+        self.local = threading.local()
+        self.sessions = []
 
-    def is_hash_ok(self, path, element=None, md5hash=None):
-        """ Checks file md5 hash """
+        # Pool that downloads the segments of big packages
+        # (only while start() is running)
+        self.segment_executor = None
+
+        self.progress = None
+        self.abort = threading.Event()
+
+    def is_hash_ok(self, path, element, digest=None):
+        """ Checks file hash (sha256 or md5 if sha256 is not available)
+            If digest is given (it has been computed while downloading
+            the file) path is not read again. Otherwise, the hash is read
+            from the cache directory index if the file has not changed
+            since the last time it was hashed """
         # Note: path must exist!
 
-        if element:
-            # element['hash'] is not always available
-            md5hash = element.get('hash', False)
-            identity = element['identity']
-            filename = element['filename']
-        elif md5hash:
-            identity = path
-            filename = path
-
-        if not md5hash:
-            logging.debug('Checksum unavailable for package: %s', identity)
-            self.queue_event('cache_pkgs_md5_check_failed', identity)
-            # We cannot check md5, let's assume it's ok
+        # element's hash is not always available
+        hash_type, element_hash = get_element_checksum(element)
+
+        if not element_hash:
+            logging.debug(
+                'Checksum unavailable for package: %s', element.identity)
+            self.queue_event('cache_pkgs_md5_check_failed', element.identity)
+            # We cannot check the hash, let's assume it's ok
             return True
 
-        if md5hash != get_md5(path):
-            logging.warning("MD5 hash of file %s does not match!", filename)
+        if digest is None:
+            digest = cache_index.get_file_hash(path, hash_type)
+
+        if element_hash != digest:
+            logging.warning(
+                "%s hash of file %s does not match!",
+                hash_type.upper(),
+                element.filename)
             return False
 
-        # If we reach this point, md5 hash is ok
+        # If we reach this point, hash is ok
         return True
 
+    def get_session(self):
+        """ Returns the requests session of the calling thread """
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self.local.session = session
+            self.sessions.append(session)
+        return session
+
     def start(self, downloads):
         """ Downloads using requests """
-        downloaded = 0
-        total_downloads = len(downloads)
+        elements = list(downloads.values())
+        total_downloads = len(elements)
+
+        if total_downloads == 0:
+            return True
+
+        total_bytes = 0
+        for element in elements:
+            try:
+                total_bytes += int(element.size or 0)
+            except (TypeError, ValueError):
+                pass
+
+        self.progress = DownloadProgress(total_downloads, total_bytes)
+        self.abort.clear()
 
         self.queue_event('downloads_progress_bar', 'show')
         self.queue_event('downloads_percent', '0')
-
-        self.copy_to_cache_threads = []
+        self.queue_event('percent', '0')
 
         logging.debug(
-            "Downloading packages to pacman cache dir '%s'",
-            self.pacman_cache_dir)
-
-        while downloads:
-            needs_to_download = True
-
-            # Get package to download from downloads list
-            _identity, element = downloads.popitem()
-
-            self.queue_event('percent', '0')
-
-            txt = _("Fetching {0} {1} ({2}/{3})...").format(
-                element['identity'],
-                element['version'],
-                downloaded + 1,
-                total_downloads)
-            self.queue_event('info', txt)
-
-            dst_path = os.path.join(self.pacman_cache_dir, element['filename'])
-
-            if os.path.exists(dst_path):
-                # File already exists in destination pacman's cache
-                # (previous install?). We check the file md5 hash.
-                if not self.is_hash_ok(path=dst_path, element=element):
-                    # We're sure it's a wrong hash. Force to download it
-                    needs_to_download = True
-                else:
-                    needs_to_download = False
-                    logging.debug(
-                        "File %s found in %s cache, there is no need to download it",
-                        element['filename'],
-                        self.pacman_cache_dir)
-            else:
-                needs_to_download = True
-                # Check all cache directories
-                for xz_cache_dir in self.xz_cache_dirs:
-                    dst_xz_cache_path = os.path.join(
-                        xz_cache_dir,
-                        element['filename'])
-
-                    if (os.path.exists(dst_xz_cache_path) and
-                            self.is_hash_ok(path=dst_xz_cache_path, element=element)):
-                        # We're lucky, the package is already downloaded
-                        # in the cache the user has given us
-                        # and its md5 checks out (if there is a md5)
-                        try:
-                            shutil.copy(dst_xz_cache_path, dst_path)
-                            needs_to_download = False
-                            logging.debug(
-                                "%s found in %s cache, there is no need to download it",
-                                element['filename'],
-                                xz_cache_dir)
-                            # Get out of the cache for loop, as we managed
-                            # to find the package in this cache directory
-                            break
-                        except OSError as os_error:
-                            needs_to_download = True
-                            logging.debug(
-                                "Error copying %s to %s : %s",
-                                dst_xz_cache_path,
-                                dst_path,
-                                os_error)
-
-            if needs_to_download and not self.download_package(element, dst_path):
-                # None of the mirror urls works.
-                # Stop right here, so the user does not have to wait
-                # to download the other packages.
-                logging.error(
-                    "Can't download %s, even after trying all available mirrors",
-                    element['filename'])
-                return False
-            else:
-                downloaded += 1
-
-            self.queue_event('progress_bar_show_text', '')
+            "Downloading packages to pacman cache dir '%s' (%d at a time)",
+            self.pacman_cache_dir,
+            self.max_downloads)
 
-            downloads_percent = round(float(downloaded / total_downloads), 2)
-            self.queue_event('downloads_percent', str(downloads_percent))
+        all_ok = True
+        self.segment_executor = ThreadPoolExecutor(max_workers=SEGMENT_WORKERS)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_downloads) as executor:
+                futures = [
+                    executor.submit(self.fetch_element, element)
+                    for element in elements]
+                for future in as_completed(futures):
+                    try:
+                        fetched = future.result()
+                    except Exception as err:
+                        # Do not wait for all other downloads to finish
+                        # to report it
+                        logging.error("Error fetching a package: %s", err)
+                        fetched = False
+                    if not fetched:
+                        # None of the mirror urls works.
+                        # Stop right here, so the user does not have to wait
+                        # to download the other packages.
+                        all_ok = False
+                        self.abort.set()
+                        for pending in futures:
+                            pending.cancel()
+                        break
+        finally:
+            self.segment_executor.shutdown(wait=True)
+            self.segment_executor = None
+
+        for session in self.sessions:
+            session.close()
+        self.sessions = []
 
         # Wait until all xz packages are also copied to provided cache (if any)
-        for cache_thread in self.copy_to_cache_threads:
-            cache_thread.join()
+        self.copy_to_cache.wait()
+
+        # Store all computed hashes
+        cache_index.save_indexes()
 
+        # Do not trust the cached mirror ranking next time
+        # if any of its mirrors is not working
+        mirror_cache.invalidate_mirrors(self.mirror_health.get_failed_hosts())
+
+        self.queue_event('progress_bar_show_text', '')
         self.queue_event('downloads_progress_bar', 'hide')
+        return all_ok
+
+    def fetch_element(self, element):
+        """ Gets one package, from a cache directory if possible,
+            downloading it otherwise. Runs in a download thread """
+        if self.abort.is_set():
+            return False
+
+        index = self.progress.package_started()
+        self.queue_message(
+            'info', N_("Fetching {0} {1} ({2}/{3})..."),
+            element.identity,
+            element.version,
+            index,
+            self.progress.total_downloads)
+
+        dst_path = os.path.join(self.pacman_cache_dir, element.filename)
+
+        if os.path.exists(dst_path):
+            # File already exists in destination pacman's cache
+            # (previous install?). We check the file hash.
+            if not self.is_hash_ok(path=dst_path, element=element):
+                # We're sure it's a wrong hash. Force to download it
+                needs_to_download = True
+            else:
+                needs_to_download = False
+                logging.debug(
+                    "File %s found in %s cache, there is no need to download it",
+                    element.filename,
+                    self.pacman_cache_dir)
+        else:
+            needs_to_download = not self.copy_from_xz_cache(element, dst_path)
+
+        if needs_to_download and not self.download_package(element, dst_path):
+            if not self.abort.is_set():
+                logging.error(
+                    "Can't download %s, even after trying all available mirrors",
+                    element.filename)
+            return False
+
+        if not needs_to_download:
+            # Count the package as downloaded
+            self.add_downloaded_bytes(element.size)
+
+        downloads_percent = self.progress.package_finished()
+        self.queue_value('downloads_percent', downloads_percent)
         return True
 
+    def copy_from_xz_cache(self, element, dst_path):
+        """ Looks for the package in all cache directories the user has
+            given us. Returns True if it has been copied to dst_path """
+        for xz_cache_dir in self.xz_cache_dirs:
+            dst_xz_cache_path = os.path.join(
+                xz_cache_dir,
+                element.filename)
+
+            if (os.path.exists(dst_xz_cache_path) and
+                    self.is_hash_ok(path=dst_xz_cache_path, element=element)):
+                # We're lucky, the package is already downloaded
+                # in the cache the user has given us
+                # and its hash checks out (if there is a hash)
+                try:
+                    method = cache_import.import_file(
+                        dst_xz_cache_path, dst_path)
+                    logging.debug(
+                        "%s found in %s cache, there is no need to download it (%s)",
+                        element.filename,
+                        xz_cache_dir,
+                        method)
+                    # Get out of the cache for loop, as we managed
+                    # to find the package in this cache directory
+                    return True
+                except OSError as os_error:
+                    logging.debug(
+                        "Error copying %s to %s : %s",
+                        dst_xz_cache_path,
+                        dst_path,
+                        os_error)
+        return False
+
     def download_package(self, element, dst_path):
-        """ Package wasn't previously downloaded or its md5 was wrong
+        """ Package wasn't previously downloaded or its hash was wrong
             We'll have to download it
             Let's download our file using its url
-            Checks all mirrors if necessary """
+            Checks all mirrors if necessary (healthiest ones first) """
 
         logging.debug(
             "Looking for %s-%s in %d mirrors...",
-            element['identity'],
-            element['version'],
-            len(element['urls']))
-
-        for url in element['urls']:
-            # Let's catch empty values as well as None just to be safe
-            if not url:
-                # Something bad has happened, let's try another mirror
-                download_ok = False
-                logging.debug(
-                    "Package %s-%s has an empty url for this mirror",
-                    element['identity'],
-                    element['version'])
-            else:
-                download_ok = self.download_url(url, dst_path)
+            element.identity,
+            element.version,
+            len(element.urls))
+
+        if self.download_segmented(element, dst_path):
+            self.copy_to_xz_cache(dst_path)
+            return True
 
-            if download_ok:
-                # Copy downloaded xz file to the cache the user has provided, too.
-                copy_to_cache_thread = CopyToCache(dst_path, self.xz_cache_dirs)
-                self.copy_to_cache_threads += [copy_to_cache_thread]
-                copy_to_cache_thread.start()
+        for mirror_pass in range(MAX_MIRROR_PASSES):
+            if mirror_pass > 0:
+                # All mirrors have failed. Give them some time to recover
+                # (a network hiccup?) before trying again
+                self.abort.wait(5)
+
+            # Mirror health may have changed since the last package,
+            # so urls are sorted right before using them
+            for url in self.mirror_health.sort_urls(element.urls):
+                if self.abort.is_set():
+                    return False
+
+                # Let's catch empty values as well as None just to be safe
+                if not url:
+                    # Something bad has happened, let's try another mirror
+                    logging.debug(
+                        "Package %s-%s has an empty url for this mirror",
+                        element.identity,
+                        element.version)
+                    continue
+
+                if self.download_url(url, dst_path, element):
+                    self.copy_to_xz_cache(dst_path)
+                    return True
 
-                # Get out of the for loop, as we managed
-                # to download the package
-                break
-            else:
                 # requests failed to obtain the file. Wrong url?
                 msg = "Can't download %s, Cnchi will try another mirror."
                 logging.debug(msg, url)
-                # delays for 20 seconds
-                time.sleep(20)
 
-        return download_ok
+        return False
+
+    def copy_to_xz_cache(self, dst_path):
+        """ Copy downloaded xz file to the cache the user has provided, too """
+        self.copy_to_cache.add(dst_path)
+
+    @staticmethod
+    def get_segments(part_path, size, num_segments):
+        """ Returns the list of byte ranges [start, end, bytes_done] in which
+            a segmented download is split. Ranges of a previous interrupted
+            download of part_path are reused """
+        journal = read_part_journal(part_path)
+        if (journal and journal.get('size') == size and
+                journal.get('segments') and
+                os.path.exists(part_path) and
+                os.path.getsize(part_path) == size):
+            return journal['segments']
+
+        segment_size = size // num_segments
+        segments = []
+        for index in range(num_segments):
+            start = index * segment_size
+            if index == num_segments - 1:
+                end = size - 1
+            else:
+                end = start + segment_size - 1
+            segments.append([start, end, 0])
+        return segments
+
+    def download_segmented(self, element, dst_path):
+        """ Downloads a big package splitting it in byte ranges which are
+            fetched at the same time from different mirrors and written
+            directly into their place of the .part file.
+            Returns False if the package is not big enough, there are not
+            enough mirrors or the download fails (so caller can fall back
+            to a normal download) """
+        try:
+            size = int(element.size or 0)
+        except (TypeError, ValueError):
+            return False
+
+        if size < SEGMENT_THRESHOLD or self.segment_executor is None:
+            return False
+
+        part_path = dst_path + PART_SUFFIX
+        journal = read_part_journal(part_path)
+        if (journal and not journal.get('segments') and
+                journal.get('bytes_done')):
+            # A previous normal download can be resumed, do not discard it
+            return False
+
+        urls = [url for url in self.mirror_health.sort_urls(element.urls)
+                if url and not self.mirror_health.is_quarantined(url) and
+                self.mirror_health.supports_ranges(url)]
+
+        num_segments = min(MAX_SEGMENTS, len(urls), size // MIN_SEGMENT_SIZE)
+        if num_segments < 2:
+            return False
+
+        segments = self.get_segments(part_path, size, num_segments)
+        journal = {'size': size, 'segments': segments}
+        journal_lock = threading.Lock()
+
+        already_done = sum(segment[2] for segment in segments)
+        if already_done:
+            logging.debug(
+                "Resuming segmented download of %s (%d bytes already done)",
+                element.filename, already_done)
+            self.add_downloaded_bytes(already_done)
+        else:
+            logging.debug(
+                "Downloading %s in %d segments from different mirrors",
+                element.filename, len(segments))
 
-    def download_url(self, url, dst_path, md5hash=""):
-        """ Downloads file from url to dst_path and checks its md5 hash """
-        percent = 0
-        completed_length = 0
-        start = time.perf_counter()
         try:
-            # By default, get waits five minutes before
-            # issuing a timeout, which is too much.
-            if self.proxies:
-                req = requests.get(
+            # Preallocate the whole file so every segment can be written
+            # in its place as soon as it arrives
+            mode = 'r+b' if already_done else 'wb'
+            with open(part_path, mode) as xz_file:
+                xz_file.truncate(size)
+        except OSError as os_error:
+            logging.debug("Can't create %s: %s", part_path, os_error)
+            self.add_downloaded_bytes(-already_done)
+            return False
+
+        write_part_journal(part_path, journal)
+
+        # Segments share a bounded pool (and its requests sessions) with
+        # the segments of other packages. This thread downloads the first one
+        futures = [
+            self.segment_executor.submit(
+                self.download_segment, part_path, journal, journal_lock,
+                index, urls[index:] + urls[:index])
+            for index in range(1, len(segments))]
+        results = [
+            self.download_segment(part_path, journal, journal_lock, 0, urls)]
+        results.extend(future.result() for future in futures)
+        segments_ok = all(results)
+
+        with journal_lock:
+            write_part_journal(part_path, journal)
+            done = sum(segment[2] for segment in segments)
+
+        if not segments_ok:
+            # Whatever we have got can be resumed later
+            # (a normal download resumes it, see get_resume_info)
+            self.add_downloaded_bytes(-done)
+            return False
+
+        # Segments arrive out of order, so the whole file has to be read
+        hash_type, _element_hash = get_element_checksum(element)
+        digest = None
+        if hash_type:
+            digest = cache_index.compute_hash(part_path, hash_type)
+            if not self.is_hash_ok(path=part_path, element=element, digest=digest):
+                # Wrong hash! Force to download it again
+                remove_part(part_path)
+                self.add_downloaded_bytes(-done)
+                return False
+
+        try:
+            os.replace(part_path, dst_path)
+        except OSError as os_error:
+            logging.debug(
+                "Can't move %s to %s: %s", part_path, dst_path, os_error)
+            self.add_downloaded_bytes(-done)
+            return False
+        remove_part(part_path)
+
+        if digest:
+            cache_index.add_file_hash(dst_path, hash_type, digest)
+        return True
+
+    def download_segment(self, part_path, journal, journal_lock, index, urls):
+        """ Downloads one byte range of a segmented download, trying all
+            given mirrors until one of them works. Runs in its own thread """
+        segment = journal['segments'][index]
+        start, end = segment[0], segment[1]
+
+        for url in urls:
+            if segment[2] > end - start:
+                # Segment is complete
+                return True
+
+            if self.abort.is_set():
+                return False
+
+            if not self.mirror_health.supports_ranges(url):
+                # Found out by another segment
+                continue
+
+            position = start + segment[2]
+            headers = {'Range': 'bytes={0}-{1}'.format(position, end)}
+            completed_length = 0
+            time0 = time.perf_counter()
+            try:
+                req = self.get_session().get(
                     url,
                     stream=True,
                     timeout=30,
+                    headers=headers,
                     proxies=self.proxies)
+                latency = time.perf_counter() - time0
+
+                if not is_range_at(req, position):
+                    # This mirror does not support byte ranges. It may
+                    # be fine for normal downloads, so it is not a failure
+                    logging.debug(
+                        "Mirror %s can't serve byte ranges (status code %d)",
+                        url, req.status_code)
+                    req.close()
+                    if req.status_code in (requests.codes.ok,
+                                           requests.codes.partial_content):
+                        self.mirror_health.record_no_ranges(url)
+                    else:
+                        self.mirror_health.record_failure(url)
+                    continue
+
+                with open(part_path, 'r+b') as xz_file:
+                    xz_file.seek(position)
+                    last_journal = 0
+                    for data in req.iter_content(io.DEFAULT_BUFFER_SIZE):
+                        if not data:
+                            break
+                        if self.abort.is_set():
+                            req.close()
+                            return False
+                        # Do not write past our range
+                        data = data[:end - start + 1 - segment[2]]
+                        self.bandwidth.consume(len(data))
+                        xz_file.write(data)
+                        completed_length += len(data)
+                        with journal_lock:
+                            segment[2] += len(data)
+                            if completed_length - last_journal >= JOURNAL_INTERVAL:
+                                write_part_journal(part_path, journal)
+                                last_journal = completed_length
+                        self.add_downloaded_bytes(len(data))
+                        if segment[2] > end - start:
+                            break
+            except (socket.timeout,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError) as connection_error:
+                logging.debug(connection_error)
+                self.mirror_health.record_failure(url)
+                continue
+
+            if segment[2] > end - start:
+                self.mirror_health.record_success(
+                    url, latency, completed_length, time.perf_counter() - time0)
+                return True
+
+            # Connection closed before sending the whole range
+            self.mirror_health.record_failure(url)
+
+        return segment[2] > end - start
+
+    @staticmethod
+    def get_resume_info(url, part_path):
+        """ Returns the offset where an interrupted download of part_path
+            should be resumed and the http headers needed to do it """
+        journal = read_part_journal(part_path)
+        if journal is None or not os.path.exists(part_path):
+            # Without a journal we do not know where the data comes from
+            return 0, {}
+
+        if journal.get('segments'):
+            # Keep the data of the segments downloaded so far
+            # (up to the first gap)
+            try:
+                journal = resume_segmented_part(part_path, journal)
+            except OSError as os_error:
+                logging.debug("Can't resume %s: %s", part_path, os_error)
+                return 0, {}
+
+        offset = os.path.getsize(part_path)
+        if offset == 0:
+            return 0, {}
+
+        headers = {'Range': 'bytes={0}-'.format(offset)}
+        # If the file has changed in the mirror we want it from the start.
+        # Other mirrors have their own validators, in that case we trust
+        # the final checksum test.
+        if journal.get('url') == url:
+            validator = journal.get('etag') or journal.get('last_modified')
+            if validator:
+                headers['If-Range'] = validator
+        return offset, headers
+
+    def download_url(self, url, dst_path, element):
+        """ Downloads file from url to dst_path and checks its hash
+            Data is written to a .part file that is only moved to dst_path
+            once it is complete (and its hash is ok). If a previous
+            download was interrupted, it is resumed with a Range request.
+            The hash is computed while the data arrives, so the file does
+            not have to be read again """
+        part_path = dst_path + PART_SUFFIX
+        offset, headers = self.get_resume_info(url, part_path)
+        if offset:
+            logging.debug(
+                "Resuming download of %s from byte %d",
+                os.path.basename(dst_path), offset)
+            self.add_downloaded_bytes(offset)
+
+        hash_type, _element_hash = get_element_checksum(element)
+        file_hash = None
+
+        journal = None
+        completed_length = 0
+        start = time.perf_counter()
+        try:
+            # By default, get waits five minutes before
+            # issuing a timeout, which is too much.
+            req = self.get_session().get(
+                url,
+                stream=True,
+                timeout=30,
+                headers=headers,
+                proxies=self.proxies)
+            latency = time.perf_counter() - start
+
+            if (offset and req.status_code == requests.codes.partial_content and
+                    not is_range_at(req, offset)):
+                # We would append data that does not belong there
+                logging.debug(
+                    "Mirror sent a wrong range for %s, downloading it again", url)
+                req.close()
+                self.add_downloaded_bytes(-offset)
+                offset = 0
+                req = self.get_session().get(
+                    url, stream=True, timeout=30, proxies=self.proxies)
+                latency = time.perf_counter() - start
+
+            if offset and req.status_code == requests.codes.partial_content:
+                mode = 'ab'
+                if hash_type:
+                    # Hash what we already have
+                    file_hash = cache_index.update_hash(
+                        hashlib.new(hash_type), part_path)
+            elif req.status_code == requests.codes.ok:
+                if offset:
+                    # Server ignored our range request (or the file has
+                    # changed), so we have to start from scratch
+                    logging.debug("Can't resume %s, downloading it again", url)
+                    self.add_downloaded_bytes(-offset)
+                    offset = 0
+                mode = 'wb'
+                if hash_type:
+                    file_hash = hashlib.new(hash_type)
+            elif (offset and req.status_code ==
+                  requests.codes.requested_range_not_satisfiable):
+                # Our partial file is already complete
+                # (we'll know for sure when checking its hash)
+                req.close()
+                mode = None
             else:
-                req = requests.get(
-                    url,
-                    stream=True,
-                    timeout=30)
+                logging.debug(
+                    "Mirror returned status code %d for %s",
+                    req.status_code, url)
+                self.mirror_health.record_failure(url)
+                return False
 
-            if req.status_code == requests.codes.ok:
-                # Get total file length
+            if mode:
                 try:
-                    total_length = int(req.headers.get('content-length'))
+                    total_length = offset + int(req.headers.get('content-length'))
                 except TypeError:
                     total_length = 0
-                    logging.debug(
-                        "Metalink for package %s has no size info", url)
 
-                with open(dst_path, 'wb') as xz_file:
+                journal = {
+                    'url': url,
+                    'etag': req.headers.get('ETag'),
+                    'last_modified': req.headers.get('Last-Modified'),
+                    'size': total_length,
+                    'bytes_done': offset}
+                write_part_journal(part_path, journal)
+
+                with open(part_path, mode) as xz_file:
+                    last_journal = 0
                     for data in req.iter_content(io.DEFAULT_BUFFER_SIZE):
                         if not data:
                             break
+                        if self.abort.is_set():
+                            # Another package failed, do not bother
+                            # (what we have got so far can be resumed later)
+                            req.close()
+                            journal['bytes_done'] = offset + completed_length
+                            write_part_journal(part_path, journal)
+                            self.add_downloaded_bytes(-offset - completed_length)
+                            return False
+                        self.bandwidth.consume(len(data))
                         xz_file.write(data)
+                        if file_hash:
+                            file_hash.update(data)
                         completed_length += len(data)
-                        old_percent = percent
-                        if total_length > 0:
-                            percent = float(completed_length / total_length)
-                            percent = round(percent, 2)
-                        else:
-                            percent += 0.1
-                        if old_percent != percent:
-                            self.queue_event('percent', percent)
-                        bps = completed_length // (time.perf_counter() - start)
-                        msg = self.format_progress_message(percent, bps)
-                        self.queue_event('progress_bar_show_text', msg)
-
-                # Check hash of downloaded package
-                if md5hash and not self.is_hash_ok(path=dst_path, md5hash=md5hash):
-                    # Wrong md5! Force to download it again
-                    return False
+                        self.add_downloaded_bytes(len(data))
+                        if completed_length - last_journal >= JOURNAL_INTERVAL:
+                            journal['bytes_done'] = offset + completed_length
+                            write_part_journal(part_path, journal)
+                            last_journal = completed_length
         except (socket.timeout,
                 requests.exceptions.Timeout,
                 requests.exceptions.ConnectionError,
                 requests.exceptions.ChunkedEncodingError) as connection_error:
             logging.debug(connection_error)
+            if journal:
+                # Keep the partial file, next try will resume it
+                journal['bytes_done'] = offset + completed_length
+                write_part_journal(part_path, journal)
+            self.add_downloaded_bytes(-offset - completed_length)
+            self.mirror_health.record_failure(url)
             return False
 
+        # Check hash of downloaded package
+        if file_hash:
+            digest = file_hash.hexdigest()
+        elif hash_type:
+            # Partial file was already complete, we did not download anything
+            digest = cache_index.compute_hash(part_path, hash_type)
+        else:
+            digest = None
+        if hash_type and not self.is_hash_ok(
+                path=part_path, element=element, digest=digest):
+            # Wrong hash! Force to download it again
+            remove_part(part_path)
+            self.add_downloaded_bytes(-offset - completed_length)
+            self.mirror_health.record_failure(url)
+            return False
+
+        try:
+            os.replace(part_path, dst_path)
+        except OSError as os_error:
+            logging.debug(
+                "Can't move %s to %s: %s", part_path, dst_path, os_error)
+            self.add_downloaded_bytes(-offset - completed_length)
+            return False
+        remove_part(part_path)
+
+        if digest:
+            # Next time this file won't have to be hashed again
+            cache_index.add_file_hash(dst_path, hash_type, digest)
+
+        self.mirror_health.record_success(
+            url, latency, completed_length, time.perf_counter() - start)
         return True
 
-    def format_progress_message(self, percent, bps):
-        """ Formats speed message information """
+    def add_downloaded_bytes(self, num_bytes):
+        """ Updates the aggregated progress of all downloads """
+        try:
+            num_bytes = int(num_bytes)
+        except (TypeError, ValueError):
+            return
+        percent, bps = self.progress.add_bytes(num_bytes)
+        self.queue_value('percent', percent)
+        msg, args = self.get_progress_message(percent, bps)
+        self.queue_message('progress_bar_show_text', msg, *args)
+
+    @staticmethod
+    def get_progress_message(percent, bps):
+        """ Returns speed message information (and its format
+            arguments). The GUI formats it """
         if bps >= (1024 * 1024):
-            mbps = bps / (1024 * 1024)
-            msg = "{0}%   {1:.2f} Mbps".format(int(percent * 100), mbps)
+            msg = "{0}%   {1:.2f} Mbps"
+            bps /= 1024 * 1024
         elif bps >= 1024:
-            kbps = bps / 1024
-            msg = "{0}%   {1:.2f} Kbps".format(int(percent * 100), kbps)
+            msg = "{0}%   {1:.2f} Kbps"
+            bps /= 1024
         else:
-            msg = "{0}%   {1:.2f} bps".format(int(percent * 100), bps)
-        return msg
+            msg = "{0}%   {1:.2f} bps"
+        # Round speed so repeated messages can be detected
+        return msg, (int(percent * 100), round(bps, 2))
 
     def queue_event(self, event_type, event_text=None):
-        """ Adds an event to Cnchi event queue """
+        """ Adds an event to Cnchi event queue (thread safe) """
 
         if self.callback_queue is None:
-            if event_type != "percent":
+            if event_type not in ["percent", "progress_bar_show_text"]:
                 logging.debug("%s: %s", event_type, event_text)
             return
 
-        if event_type in self.last_event:
-            if self.last_event[event_type] == event_text:
-                # do not repeat same event
-                return
+        self.publisher.publish(event_type, event_text)
 
-        self.last_event[event_type] = event_text
+    def queue_value(self, event_type, value):
+        """ Adds a progress event to Cnchi event queue (thread safe) """
+        if self.callback_queue is not None:
+            self.publisher.publish_value(event_type, value)
 
-        try:
-            # Add the event
-            self.callback_queue.put_nowait((event_type, event_text))
-        except queue.Full:
-            pass
+    def queue_message(self, event_type, message, *args):
+        """ Adds an event to Cnchi event queue. The message will be
+            translated (and formatted with args) by the GUI (thread safe) """
+        if self.callback_queue is None:
+            if event_type != "progress_bar_show_text":
+                logging.debug("%s: %s", event_type, message.format(*args))
+            return
+        self.publisher.publish_message(event_type, message, *args)
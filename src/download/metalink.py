@@ -31,10 +31,8 @@
 """ Operations with metalinks """
 
 import logging
-import tempfile
 import os
 
-import hashlib
 import re
 import argparse
 
@@ -48,74 +46,131 @@ except ImportError:
 
 import pyalpm
 
+import download.cache_index as cache_index
+
 MAX_URLS = 15
 
 
+class DownloadElement(object):
+    """ A file to download (a package, a package signature or a database)
+        with all the information the downloader needs """
+
+    __slots__ = ['filename', 'identity', 'size', 'version', 'description',
+                 'sha256', 'md5', 'urls']
+
+    def __init__(self, filename, identity=None, size=0, version=None,
+                 description=None, sha256=None, md5=None, urls=None):
+        self.filename = filename
+        self.identity = identity or filename
+        self.size = size
+        self.version = version or ''
+        self.description = description
+        self.sha256 = sha256
+        self.md5 = md5
+        self.urls = list(urls)[:MAX_URLS] if urls else []
+
+    def __repr__(self):
+        return 'DownloadElement({0!r})'.format(self.filename)
+
+    @classmethod
+    def from_pkg(cls, pkg, urls):
+        """ Creates a download element from a pyalpm sync package """
+        return cls(
+            filename=pkg.filename,
+            identity=pkg.name,
+            size=pkg.size,
+            version=pkg.version,
+            description=pkg.desc,
+            sha256=pkg.sha256sum,
+            md5=pkg.md5sum,
+            urls=urls)
+
+
+def download_queue_to_plan(download_queue):
+    """ Converts a download_queue object to a download plan
+        (a dict of DownloadElement objects with their identity as key) """
+    plan = {}
+
+    for database, sigs in download_queue.dbs:
+        name = database.name + '.db'
+        urls = [os.path.join(url, name) for url in database.servers]
+        plan[name] = DownloadElement(name, urls=urls)
+        if sigs:
+            plan[name + '.sig'] = DownloadElement(
+                name + '.sig', urls=[url + '.sig' for url in urls])
+
+    for pkg, urls, sigs in download_queue.sync_pkgs:
+        urls = list(urls)
+        plan[pkg.name] = DownloadElement.from_pkg(pkg, urls)
+        if sigs:
+            name = pkg.filename + '.sig'
+            plan[name] = DownloadElement(
+                name, urls=[url + '.sig' for url in urls])
+
+    return plan
+
+
 def get_info(metalink):
-    """ Reads metalink xml info and returns it """
+    """ Reads metalink xml info and returns it as a download plan """
 
     # tag = "{urn:ietf:params:xml:ns:metalink}"
 
-    temp_file = tempfile.NamedTemporaryFile(delete=False)
-    temp_file.write(str(metalink).encode('UTF-8'))
-    temp_file.close()
-
     metalink_info = {}
-    element = {}
-
-    for event, elem in eTree.iterparse(temp_file.name, events=('start', 'end')):
-        if event == "start":
-            if elem.tag.endswith("file"):
-                element['filename'] = elem.attrib['name']
-            elif elem.tag.endswith("identity"):
-                element['identity'] = elem.text
-            elif elem.tag.endswith("size"):
-                element['size'] = elem.text
-            elif elem.tag.endswith("version"):
-                element['version'] = elem.text
-            elif elem.tag.endswith("description"):
-                element['description'] = elem.text
-            elif elem.tag.endswith("hash"):
-                element['hash'] = elem.text
-            elif elem.tag.endswith("url"):
-                try:
-                    element['urls'].append(elem.text)
-                except KeyError:
-                    element['urls'] = [elem.text]
-        if event == "end":
-            if elem.tag.endswith("file"):
-                # Limit to MAX_URLS for file
-                if len(element['urls']) > MAX_URLS:
-                    element['urls'] = element['urls'][:MAX_URLS]
-                key = element['identity']
-                metalink_info[key] = element.copy()
-                element.clear()
-                elem.clear()
-
-    if os.path.exists(temp_file.name):
-        os.remove(temp_file.name)
-
-    return metalink_info
-
-
-def create(alpm, package_name, pacman_conf_file):
-    """ Creates a metalink to download package_name and its dependencies """
+    element = None
+
+    root = eTree.fromstring(str(metalink).encode('UTF-8'))
+    for elem in root.iter():
+        if elem.tag.endswith("file"):
+            element = DownloadElement(elem.attrib['name'])
+            metalink_info[element.filename] = element
+        elif element is None:
+            continue
+        elif elem.tag.endswith("identity"):
+            element.identity = elem.text
+        elif elem.tag.endswith("size"):
+            element.size = int(elem.text)
+        elif elem.tag.endswith("version"):
+            element.version = elem.text
+        elif elem.tag.endswith("description"):
+            element.description = elem.text
+        elif elem.tag.endswith("hash"):
+            # Store each hash by its type ('sha256', 'md5')
+            if elem.attrib.get('type', 'md5') == 'sha256':
+                element.sha256 = elem.text
+            else:
+                element.md5 = elem.text
+        elif elem.tag.endswith("url"):
+            # Limit to MAX_URLS for file
+            if len(element.urls) < MAX_URLS:
+                element.urls.append(elem.text)
+
+    # Use identities as keys (as download_queue_to_plan does)
+    return {element.identity: element for element in metalink_info.values()}
+
+
+def create(alpm, package_names, pacman_conf_file):
+    """ Creates a download plan to download package_names (one package name
+        or a list of them) and all their dependencies, resolved together
+        (use plan_to_metalink to get a metalink from it) """
+
+    if isinstance(package_names, str):
+        package_names = [package_names]
 
     # options = ["--conf", pacman_conf_file, "--noconfirm", "--all-deps", "--needed"]
     options = ["--conf", pacman_conf_file, "--noconfirm", "--all-deps"]
 
-    if package_name is "databases":
+    if "databases" in package_names:
         options.append("--refresh")
-    else:
-        options.append(package_name)
+    options.extend(name for name in package_names if name != "databases")
 
     try:
         download_queue, not_found, missing_deps = build_download_queue(
             alpm, args=options)
     except Exception as ex:
-        template = "Unable to create download queue for package {0}. " \
+        template = "Unable to create download queue for packages {0}. " \
             "An exception of type {1} occured. Arguments:\n{2!r}"
-        message = template.format(package_name, type(ex).__name__, ex.args)
+        message = template.format(
+            ", ".join(package_names), type(ex).__name__, ex.args)
         logging.error(message)
         return None
 
@@ -133,9 +188,7 @@ def create(alpm, package_name, pacman_conf_file):
         logging.error(msg)
         return None
 
-    metalink = download_queue_to_metalink(download_queue)
-
-    return metalink
+    return download_queue_to_plan(download_queue)
 
 
 # From here comes modified code from pm2ml
@@ -156,6 +209,16 @@ def download_queue_to_metalink(download_queue):
     return metalink
 
 
+def plan_to_metalink(plan):
+    """ Converts a download plan to a metalink (only needed to export it) """
+    metalink = Metalink()
+
+    for element in plan.values():
+        metalink.add_element(element)
+
+    return metalink
+
+
 class Metalink(object):
     """ Metalink class """
 
@@ -207,6 +270,28 @@ class Metalink(object):
         if sigs:
             self.add_file(pkg.filename + '.sig', (u + '.sig' for u in urls))
 
+    def add_element(self, element):
+        """ Add a download plan element """
+        file_ = self.doc.createElement("file")
+        file_.setAttribute("name", element.filename)
+        self.files.appendChild(file_)
+        for tag, value, attrs in (
+                ('identity', element.identity, ()),
+                ('size', element.size, ()),
+                ('version', element.version, ()),
+                ('description', element.description, ()),
+                ('hash', element.sha256, (('type', 'sha256'),)),
+                ('hash', element.md5, (('type', 'md5'),))):
+            if value is None:
+                continue
+            tag = self.doc.createElement(tag)
+            file_.appendChild(tag)
+            val = self.doc.createTextNode(str(value))
+            tag.appendChild(val)
+            for key, val in attrs:
+                tag.setAttribute(key, val)
+        self.add_urls(file_, element.urls)
+
     def add_file(self, name, urls):
         """Add a signature file."""
         file_ = self.doc.createElement("file")
@@ -323,7 +408,7 @@ def parse_args(args):
 
 def build_download_queue(alpm, args=None):
     """ Function to build a download queue.
-        Needs a pkgname in args """
+        Needs one or more pkgnames in args """
 
     pargs = parse_args(args)
 
@@ -335,67 +420,58 @@ def build_download_queue(alpm, args=None):
     missing_deps = list()
     found = set()
 
-    antdb = [db for db in handle.get_syncdbs() if db.name == 'antergos']
-    antdb = antdb[0]
-
-    one_repo_groups_names = ['cinnamon', 'mate', 'mate-extra']
-    one_repo_groups = []
-    for one_repo_group_name in one_repo_groups_names:
-        grp = antdb.read_grp(one_repo_group_name)
-        if not grp:
-            grp = ['None', []]
-            #logging.warning(
-            #    "Error reading group '%s' from the antergos repo db",
-            #    one_repo_group_name)
-        one_repo_groups.append(grp)
-
-    one_repo_pkgs = {
-        pkg for one_repo_group in one_repo_groups
-        for pkg in one_repo_group[1] if one_repo_group}
+    # Lookups are cached by the alpm session, so packages and groups
+    # requested again (in another call) are not searched again
+    package_cache = alpm.get_package_cache()
 
     for pkg in requested:
-        other_grp = PkgSet()
-        for db in handle.get_syncdbs():
-            if pkg in one_repo_pkgs and db.name != 'antergos':
-                # pkg should be sourced from the antergos repo only.
-                db = antdb
-
-            syncpkg = db.get_pkg(pkg)
-
-            if syncpkg:
-                other.add(syncpkg)
-                break
-            else:
-                syncgrp = db.read_grp(pkg)
-                if syncgrp:
-                    found.add(pkg)
-                    other_grp |= PkgSet(syncgrp[1])
-                    break
+        syncpkg = package_cache.get_pkg(pkg)
+        if syncpkg:
+            other.add(syncpkg)
         else:
-            other |= other_grp
+            syncgrp = package_cache.get_group(pkg)
+            if syncgrp:
+                found.add(pkg)
+                other |= PkgSet(syncgrp)
 
     # foreign_names = requested - set(x.name for x in other)
 
-    # Resolve dependencies.
+    # Resolve dependencies of all requested packages in one walk.
+    # Many packages share dependencies (glibc...), so each dependency
+    # string is only resolved once.
     if other and not pargs.nodeps:
         queue = deque(other)
         local_cache = handle.get_localdb().pkgcache
-        syncdbs = handle.get_syncdbs()
-        seen = set(queue)
+        provider_index = alpm.get_provider_index()
+        seen = set(pkg.name for pkg in queue)
+        providers = {}
+
+        def find_provider(dep):
+            """ Returns the sync package that satisfies dep, False if dep
+                is already installed and None if it can't be satisfied """
+            if dep not in providers:
+                if pargs.alldeps or pyalpm.find_satisfier(local_cache, dep) is None:
+                    # Looks in all sync databases (in order)
+                    providers[dep] = provider_index.find_satisfier(dep)
+                else:
+                    providers[dep] = False
+            return providers[dep]
+
         while queue:
             pkg = queue.popleft()
             for dep in pkg.depends:
-                if pyalpm.find_satisfier(local_cache, dep) is None or pargs.alldeps:
-                    for db in syncdbs:
-                        prov = pyalpm.find_satisfier(db.pkgcache, dep)
-                        if prov is not None:
-                            other.add(prov)
-                            if prov.name not in seen:
-                                seen.add(prov.name)
-                                queue.append(prov)
-                            break
-                    else:
-                        missing_deps.append(dep)
+                prov = find_provider(dep)
+                if prov:
+                    if prov.name not in seen:
+                        other.add(prov)
+                        seen.add(prov.name)
+                        queue.append(prov)
+                elif prov is None and dep not in missing_deps:
+                    missing_deps.append(dep)
+
+        logging.debug(
+            "%d dependencies resolved for %d requested packages",
+            len(providers), len(requested))
 
     found |= set(other.pkgs)
     not_found = requested - found
@@ -429,16 +505,10 @@ def build_download_queue(alpm, args=None):
 
 
 def get_checksum(path, typ):
-    """ Returns checksum of a file """
-    new_hash = hashlib.new(typ)
-    block_size = new_hash.block_size
+    """ Returns checksum of a file (files that have not changed since they
+        were last hashed are not read again, see cache_index) """
     try:
-        with open(path, 'rb') as myfile:
-            buf = myfile.read(block_size)
-            while buf:
-                new_hash.update(buf)
-                buf = myfile.read(block_size)
-        return new_hash.hexdigest()
+        return cache_index.get_file_hash(path, typ)
     except FileNotFoundError:
         return -1
     except IOError as io_error:
@@ -446,19 +516,25 @@ def get_checksum(path, typ):
 
 
 def check_cache(conf, pkgs):
-    """ Checks package checksum in cache """
-    for pkg in pkgs:
-        for cache in conf.options['CacheDir']:
-            fpath = os.path.join(cache, pkg.filename)
-            for checksum in ('sha256', 'md5'):
-                real_checksum = get_checksum(fpath, checksum)
-                correct_checksum = getattr(pkg, checksum + 'sum')
+    """ Checks package checksum in cache (sha256 only, md5 is
+        only used if the package has no sha256 checksum) """
+    try:
+        for pkg in pkgs:
+            for cache in conf.options['CacheDir']:
+                fpath = os.path.join(cache, pkg.filename)
+                if pkg.sha256sum:
+                    correct_checksum = pkg.sha256sum
+                    real_checksum = get_checksum(fpath, 'sha256')
+                else:
+                    correct_checksum = pkg.md5sum
+                    real_checksum = get_checksum(fpath, 'md5')
                 if real_checksum is None or real_checksum != correct_checksum:
                     yield pkg
                     break
-            else:
-                continue
-            break
+    finally:
+        # Keep the checksums computed so far, even if the caller
+        # does not read all packages (or an exception stops it)
+        cache_index.save_indexes()
 
 
 def needs_sig(siglevel, insistence, prefix):
@@ -505,12 +581,12 @@ def test_module():
 
         for index in range(1, 10000):
             print(index, "Creating metalink...")
-            meta4 = create(
+            plan = create(
                 alpm=pacman,
-                package_name="gnome",
+                package_names=["gnome"],
                 pacman_conf_file="/etc/pacman.conf")
-            print(get_info(meta4))
-            meta4 = None
+            print(get_info(plan_to_metalink(plan)))
+            plan = None
             objects = gc.collect()
             print("Unreachable objects: ", objects)
             print("Remaining garbage: ", pprint.pprint(gc.garbage))
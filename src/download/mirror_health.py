@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mirror_health.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Keeps track of how well each mirror behaves during a download session """
+
+import logging
+import threading
+import time
+
+
+def get_host(url):
+    """ Returns the scheme and host part of an url
+        (http://mirror.example.com/arch/... -> http://mirror.example.com) """
+    return '/'.join(url.split('/')[:3])
+
+
+class MirrorStats(object):
+    """ Stores health information of one mirror host """
+
+    __slots__ = ['latency', 'throughput', 'failures', 'successes',
+                 'quarantined_until']
+
+    def __init__(self):
+        # Exponential moving averages (None until first measure)
+        self.latency = None
+        self.throughput = None
+        # Consecutive failures
+        self.failures = 0
+        self.successes = 0
+        self.quarantined_until = 0
+
+
+class MirrorHealth(object):
+    """ Records latency, throughput and failures of all mirror hosts used
+        in a download session. Failing hosts are quarantined (with an
+        exponential backoff) and moved to the end of the url lists """
+
+    # Weight of the last measure in the moving averages
+    SMOOTHING = 0.3
+
+    # Quarantine time after the first failure, doubled after each failure
+    BACKOFF_BASE = 2
+    BACKOFF_MAX = 300
+
+    def __init__(self):
+        self.stats = {}
+        # Hosts that do not support byte ranges (they are healthy, but
+        # they can't be used to download segments)
+        self.no_ranges = set()
+        self.lock = threading.Lock()
+
+    def _get_stats(self, url):
+        """ Returns stats of the url's host (lock must be held) """
+        host = get_host(url)
+        if host not in self.stats:
+            self.stats[host] = MirrorStats()
+        return self.stats[host]
+
+    def _average(self, old_value, new_value):
+        """ Updates an exponential moving average """
+        if old_value is None:
+            return new_value
+        return old_value + MirrorHealth.SMOOTHING * (new_value - old_value)
+
+    def record_success(self, url, latency, num_bytes, elapsed):
+        """ Stores a successful download from url """
+        with self.lock:
+            stats = self._get_stats(url)
+            stats.latency = self._average(stats.latency, latency)
+            if elapsed > 0 and num_bytes > 0:
+                stats.throughput = self._average(
+                    stats.throughput, num_bytes / elapsed)
+            stats.failures = 0
+            stats.successes += 1
+            stats.quarantined_until = 0
+
+    def record_failure(self, url):
+        """ Stores a failed download from url and quarantines its host """
+        with self.lock:
+            stats = self._get_stats(url)
+            stats.failures += 1
+            backoff = min(
+                MirrorHealth.BACKOFF_BASE * 2 ** (stats.failures - 1),
+                MirrorHealth.BACKOFF_MAX)
+            stats.quarantined_until = time.monotonic() + backoff
+        logging.debug(
+            "Mirror %s failed %d time(s) in a row, "
+            "it won't be used in the next %d seconds",
+            get_host(url), stats.failures, backoff)
+
+    def record_no_ranges(self, url):
+        """ Stores that url's host can't serve byte ranges
+            (this is not a failure) """
+        with self.lock:
+            self.no_ranges.add(get_host(url))
+
+    def supports_ranges(self, url):
+        """ Checks if url's host may be used to download segments """
+        with self.lock:
+            return get_host(url) not in self.no_ranges
+
+    def is_quarantined(self, url):
+        """ Checks if url's host is in quarantine """
+        with self.lock:
+            stats = self.stats.get(get_host(url))
+            return (stats is not None and
+                    stats.quarantined_until > time.monotonic())
+
+    def get_failed_hosts(self):
+        """ Returns hosts whose last download has failed """
+        with self.lock:
+            return [host for host, stats in self.stats.items()
+                    if stats.failures > 0]
+
+    def sort_urls(self, urls):
+        """ Returns urls ordered by mirror health. Healthy hosts go first
+            (the fastest known ones before the untested ones, which keep
+            their original order), then hosts that have failed before and
+            finally the quarantined ones """
+        now = time.monotonic()
+
+        def health_key(item):
+            """ Sort helper """
+            index, url = item
+            stats = self.stats.get(get_host(url)) if url else None
+            if stats is None:
+                return (0, 0, index)
+            if stats.quarantined_until > now:
+                return (2, stats.quarantined_until, index)
+            if stats.failures:
+                return (1, stats.failures, index)
+            return (0, -(stats.throughput or 0), index)
+
+        with self.lock:
+            return [url for _index, url in
+                    sorted(enumerate(urls), key=health_key)]
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# events.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Events sent by the installer processes to the GUI
+
+    An event is a small tuple: (type, value, text, args)
+        type: EventType number
+        value: number (progress events) or None
+        text: message or None
+        args: None if text is ready to be shown. Otherwise text is an
+              untranslated message that the GUI translates and formats
+              with args (so workers do not have to)
+
+    Old style events (name, text) are still accepted by the GUI. """
+
+import enum
+import json
+import multiprocessing
+import multiprocessing.queues
+import os
+import queue
+import threading
+import time
+
+
+def N_(message):
+    """ Marks a message to be translated later (by the GUI) """
+    return message
+
+
+class EventType(enum.IntEnum):
+    """ Types of the events sent to the GUI """
+    PERCENT = 1
+    DOWNLOADS_PERCENT = 2
+    PROGRESS_BAR_SHOW_TEXT = 3
+    PROGRESS_BAR = 4
+    DOWNLOADS_PROGRESS_BAR = 5
+    PULSE = 6
+    INFO = 7
+    ERROR = 8
+    FINISHED = 9
+    CACHE_PKGS_MD5_CHECK_FAILED = 10
+
+
+# Events whose payload is a number
+VALUE_EVENTS = (EventType.PERCENT, EventType.DOWNLOADS_PERCENT)
+
+# Events that are sent, at most, this number of times per second
+# (the last value is always sent)
+MAX_EVENT_RATE = 10
+
+# Events that just update a progress bar, superseded values can be dropped
+RATE_LIMITED_EVENTS = (
+    EventType.PERCENT, EventType.DOWNLOADS_PERCENT,
+    EventType.PROGRESS_BAR_SHOW_TEXT)
+
+_PUBLISHERS = {}
+_PUBLISHERS_LOCK = threading.Lock()
+
+
+class CallbackQueue(multiprocessing.queues.JoinableQueue):
+    """ JoinableQueue that also writes a byte to a pipe each time an event
+        is queued, so the GUI main loop can watch the pipe (and wake up
+        as soon as there are events) instead of polling the queue.
+
+        Wake ups are only a hint: if the pipe is full the byte is not
+        written (the reader has plenty of wake ups to read yet), so the
+        reader must read all queued events each time it wakes up. """
+
+    def __init__(self, maxsize=0, ctx=None):
+        super().__init__(maxsize, ctx=ctx or multiprocessing.get_context())
+        # Connections (unlike plain fds) can be sent to spawned processes
+        self._wakeup_reader, self._wakeup_writer = multiprocessing.Pipe(
+            duplex=False)
+        os.set_blocking(self._wakeup_reader.fileno(), False)
+        os.set_blocking(self._wakeup_writer.fileno(), False)
+
+    def __getstate__(self):
+        return (super().__getstate__(),
+                self._wakeup_reader, self._wakeup_writer)
+
+    def __setstate__(self, state):
+        queue_state, self._wakeup_reader, self._wakeup_writer = state
+        super().__setstate__(queue_state)
+
+    def put(self, obj, block=True, timeout=None):
+        """ Queues obj and wakes up the reader """
+        super().put(obj, block, timeout)
+        try:
+            os.write(self._wakeup_writer.fileno(), b'\0')
+        except BlockingIOError:
+            # Pipe is full. The reader has plenty of wake ups to read yet
+            pass
+
+    def get_wakeup_fd(self):
+        """ Returns the file descriptor to watch for new events """
+        return self._wakeup_reader.fileno()
+
+    def take_wakeups(self):
+        """ Reads all pending wake ups. Returns how many events have been
+            queued since last call (their data may still be on its way
+            through the queue pipe). As wake ups can be dropped, there may
+            be more events than that """
+        count = 0
+        try:
+            data = os.read(self._wakeup_reader.fileno(), 4096)
+            while data:
+                count += len(data)
+                data = os.read(self._wakeup_reader.fileno(), 4096)
+        except BlockingIOError:
+            pass
+        return count
+
+
+def get_event_type(event_type):
+    """ Returns the EventType of an event name ('percent'...) or None """
+    if isinstance(event_type, EventType):
+        return event_type
+    try:
+        return EventType[event_type.upper()]
+    except (KeyError, AttributeError):
+        return None
+
+
+def make_event(event_type, event_text=None, value=None, args=None):
+    """ Returns a typed event. Events of unknown types are
+        returned as old style events """
+    typed = get_event_type(event_type)
+    if typed is None:
+        return (event_type, event_text)
+    if typed in VALUE_EVENTS and value is None and event_text is not None:
+        try:
+            value = float(event_text)
+            event_text = None
+        except (TypeError, ValueError):
+            pass
+    return (int(typed), value, event_text, args)
+
+
+def decode_event(event, translate=None):
+    """ Returns an event as a (name, text or value) tuple, translating and
+        formatting its message if needed (runs in the GUI) """
+    if isinstance(event[0], str):
+        return event
+    event_type, value, text, args = event
+    name = EventType(event_type).name.lower()
+    if value is not None:
+        return (name, value)
+    if args is not None and text:
+        if translate:
+            text = translate(text)
+        if args:
+            text = text.format(*args)
+    return (name, text)
+
+
+class EventRecorder(object):
+    """ Stores events (with the time they were received) in a json lines
+        file, so they can be replayed later with replay_events """
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.monotonic()
+        # Line buffered, events are not lost if Cnchi crashes
+        self.events_file = open(path, 'w', buffering=1)
+
+    def record(self, event):
+        """ Writes one event """
+        line = json.dumps([round(time.monotonic() - self.start, 4)] + list(event))
+        self.events_file.write(line + "\n")
+
+    def close(self):
+        """ Closes events file """
+        self.events_file.close()
+
+
+def replay_events(path, callback_queue, speed=1.0):
+    """ Sends the events stored by an EventRecorder to callback_queue
+        (keeping their timing, speed times faster). Returns how many
+        events have been sent """
+    start = time.monotonic()
+    count = 0
+    with open(path) as events_file:
+        for line in events_file:
+            data = json.loads(line)
+            timestamp, event = data[0], data[1:]
+            if speed:
+                wait = start + timestamp / speed - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            if len(event) == 4 and event[3] is not None:
+                event[3] = tuple(event[3])
+            callback_queue.put_nowait(tuple(event))
+            count += 1
+    return count
+
+
+class EventPublisher(object):
+    """ Sends events to a callback queue. Repeated events are not sent, and
+        progress events are sent at most max_rate times per second: when
+        they come faster, only the last value is kept and sent later """
+
+    def __init__(self, callback_queue, max_rate=MAX_EVENT_RATE,
+                 rate_limited=RATE_LIMITED_EVENTS):
+        self.callback_queue = callback_queue
+        self.interval = 1.0 / max_rate if max_rate else 0
+        self.rate_limited = frozenset(int(event_type) for event_type in rate_limited)
+        # Last value sent and time it was sent, by event type
+        self.last_event = {}
+        self.last_sent = {}
+        # Values waiting to be sent, by event type
+        self.pending = {}
+        self.timer = None
+        self.lock = threading.RLock()
+
+    def publish(self, event_type, event_text=""):
+        """ Sends (or delays) an event. event_type can be an EventType or
+            its name ('percent'...) """
+        self._publish(make_event(event_type, event_text))
+
+    def publish_value(self, event_type, value):
+        """ Sends (or delays) a progress event """
+        self._publish(make_event(event_type, value=value))
+
+    def publish_message(self, event_type, message, *args):
+        """ Sends (or delays) an event with a message that will be
+            translated (and formatted with args) by the GUI """
+        self._publish(make_event(event_type, message, args=args))
+
+    def _publish(self, event):
+        """ Sends (or delays) an event """
+        event_type = event[0]
+        with self.lock:
+            if event_type in self.pending:
+                self.pending[event_type] = event
+                return
+
+            if self.last_event.get(event_type, None) == event:
+                # do not repeat same event
+                return
+
+            if event_type in self.rate_limited:
+                wait = self.last_sent.get(event_type, 0) + self.interval - time.monotonic()
+                if wait > 0:
+                    # Too soon, send it later (if it is not superseded)
+                    self.pending[event_type] = event
+                    self._start_timer(wait)
+                    return
+            else:
+                # Keep event order (pending progress goes first)
+                self._send_pending()
+
+            self._send(event)
+
+    def flush(self):
+        """ Sends all delayed events now """
+        with self.lock:
+            self._send_pending()
+
+    def _send(self, event):
+        """ Puts event in the queue (lock must be held) """
+        self.last_event[event[0]] = event
+        self.last_sent[event[0]] = time.monotonic()
+        try:
+            self.callback_queue.put_nowait(event)
+        except queue.Full:
+            pass
+
+    def _send_pending(self):
+        """ Sends all delayed events (lock must be held) """
+        pending = self.pending
+        self.pending = {}
+        for event_type, event in pending.items():
+            if self.last_event.get(event_type, None) != event:
+                self._send(event)
+
+    def _start_timer(self, wait):
+        """ Sends delayed events after wait seconds (lock must be held) """
+        if self.timer is None:
+            self.timer = threading.Timer(wait, self._on_timer)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _on_timer(self):
+        """ Timer callback """
+        with self.lock:
+            self.timer = None
+            self._send_pending()
+
+
+def get_publisher(callback_queue):
+    """ Returns the event publisher of callback_queue, shared by all
+        objects of this process that send events to it """
+    key = (os.getpid(), id(callback_queue))
+    with _PUBLISHERS_LOCK:
+        if key not in _PUBLISHERS:
+            _PUBLISHERS[key] = EventPublisher(callback_queue)
+        return _PUBLISHERS[key]
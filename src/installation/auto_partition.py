@@ -31,7 +31,8 @@
 import os
 import logging
 import math
-import queue
+
+import events
 
 from misc.extra import InstallError
 from misc.run_cmd import call, popen
@@ -261,7 +262,6 @@ class AutoPartition(object):
 
         # Will use these queue to show progress info to the user
         self.callback_queue = callback_queue
-        self.last_event = {}
         self.percent = 0
 
         if os.path.exists("/sys/firmware/efi"):
@@ -281,18 +281,10 @@ class AutoPartition(object):
                 logging.debug("%s:%s", event_type, event_text)
             return
 
-        if event_type in self.last_event:
-            if self.last_event[event_type] == event_text:
-                # do not repeat same event
-                return
-
-        self.last_event[event_type] = event_text
-
-        try:
-            # Add the event
-            self.callback_queue.put_nowait((event_type, event_text))
-        except queue.Full:
-            pass
+        # Repeated events are not sent (and progress events keep their
+        # order with the ones of other objects of this process)
+        events.get_publisher(self.callback_queue).publish(
+            event_type, event_text)
 
     def mkfs(self, device, fs_type, mount_point, label_name, fs_options="", btrfs_devices=""):
         """ We have two main cases: "swap" and everything else. """
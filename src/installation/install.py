@@ -27,12 +27,14 @@
 import glob
 import logging
 import os
-import queue
 import shutil
 import sys
 
 from mako.template import Template
 
+import events
+from events import N_
+
 from download import download
 
 from installation import auto_partition
@@ -45,6 +47,8 @@ from misc.extra import InstallError
 from misc.run_cmd import call
 
 import pacman.pac as pac
+import pacman.session as pac_session
+import pacman.sync_db as sync_db
 
 import hardware.hardware as hardware
 
@@ -108,12 +112,18 @@ class Installation(object):
         sys.exit(0)
 
     def queue_event(self, event_type, event_text=""):
-        """ Enqueue a new event """
+        """ Enqueue a new event (through the shared publisher, so it
+            keeps its order with delayed progress events) """
+        if self.callback_queue:
+            events.get_publisher(self.callback_queue).publish(
+                event_type, event_text)
+
+    def queue_message(self, event_type, message, *args):
+        """ Enqueue an event whose message will be translated (and
+            formatted with args) by the GUI """
         if self.callback_queue:
-            try:
-                self.callback_queue.put_nowait((event_type, event_text))
-            except queue.Full:
-                pass
+            events.get_publisher(self.callback_queue).publish_message(
+                event_type, message, *args)
 
     def mount_partitions(self):
         """ Do not call this in automatic mode as AutoPartition class mounts
@@ -231,8 +241,8 @@ class Installation(object):
         if not os.environ.get('CNCHI_RUNNING', False):
             os.environ['CNCHI_RUNNING'] = 'True'
 
-        msg = _("Installing using the '{0}' method").format(self.method)
-        self.queue_event('info', msg)
+        self.queue_message(
+            'info', N_("Installing using the '{0}' method"), self.method)
 
         # Mount needed partitions (in automatic it's already done)
         if self.method in ['alongside', 'advanced', 'zfs']:
@@ -339,7 +349,7 @@ class Installation(object):
         self.running = False
 
         # Installation finished successfully
-        self.queue_event('finished', _("Installation finished"))
+        self.queue_message('finished', N_("Installation finished"))
         self.error = False
         return True
 
@@ -389,13 +399,20 @@ class Installation(object):
 
         self.create_pacman_conf_file()
 
-        msg = _("Updating package manager security. Please wait...")
-        self.queue_event('info', msg)
+        self.queue_message(
+            'info', N_("Updating package manager security. Please wait..."))
         self.prepare_pacman_keyring()
 
+        # Copy the databases refreshed when the package list was created
+        seeded = []
+        if (pac_session.is_refreshed("/etc/pacman.conf") and
+                not pac_session.is_refreshed("/tmp/pacman.conf")):
+            seeded = sync_db.seed_sync_dbs("/etc/pacman.conf", "/tmp/pacman.conf")
+
         # Init pyalpm
         try:
-            self.pacman = pac.Pac("/tmp/pacman.conf", self.callback_queue)
+            self.pacman = pac_session.get_pac(
+                "/tmp/pacman.conf", self.callback_queue)
         except Exception as ex:
             self.pacman = None
             template = ("Can't initialize pyalpm. "
@@ -404,6 +421,14 @@ class Installation(object):
             logging.error(message)
             raise InstallError(message)
 
+        if self.pacman.databases_refreshed:
+            # Installation is being retried
+            return
+
+        if seeded and set(self.pacman.get_config().repos) <= set(seeded):
+            logging.debug("Sync databases are up to date, no need to refresh them")
+            return
+
         # Refresh pacman databases
         if not self.pacman.refresh():
             logging.error("Can't refresh pacman databases.")
@@ -483,7 +508,7 @@ class Installation(object):
                             except Exception as err:
                                 logging.error(err)
 
-                self.pacman.refresh()
+                self.pacman.refresh(force=True)
 
                 result = self.pacman.install(pkgs=self.packages)
 
@@ -498,7 +523,7 @@ class Installation(object):
                         line = 'Server = http://repo.antergos.info/$repo/$arch'
                     new_pacman_conf.write(line)
 
-            self.pacman.refresh()
+            self.pacman.refresh(force=True)
 
             result = self.pacman.install(pkgs=self.packages)
 
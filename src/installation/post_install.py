@@ -27,11 +27,12 @@
 import crypt
 import logging
 import os
-import queue
 import shutil
 import time
 
 import desktop_info
+import events
+from events import N_
 
 from installation import mkinitcpio
 from installation import systemd_networkd
@@ -94,12 +95,18 @@ class PostInstallation(object):
 
 
     def queue_event(self, event_type, event_text=""):
-        """ Enqueue a new event """
+        """ Enqueue a new event (through the shared publisher, so it
+            keeps its order with delayed progress events) """
         if self.callback_queue:
-            try:
-                self.callback_queue.put_nowait((event_type, event_text))
-            except queue.Full:
-                pass
+            events.get_publisher(self.callback_queue).publish(
+                event_type, event_text)
+
+    def queue_message(self, event_type, message, *args):
+        """ Enqueue an event whose message will be translated (and
+            formatted with args) by the GUI """
+        if self.callback_queue:
+            events.get_publisher(self.callback_queue).publish_message(
+                event_type, message, *args)
 
     def copy_logs(self):
         """ Copy Cnchi logs to new installation """
@@ -261,8 +268,7 @@ class PostInstallation(object):
 
     def setup_display_manager(self):
         """ Configures LightDM desktop manager, including autologin. """
-        txt = _("Configuring LightDM desktop manager...")
-        self.queue_event('info', txt)
+        self.queue_message('info', N_("Configuring LightDM desktop manager..."))
 
         if self.desktop in desktop_info.SESSIONS:
             session = desktop_info.SESSIONS[self.desktop]
@@ -537,7 +543,7 @@ class PostInstallation(object):
 
         ## Encrypt user's home directory if requested
         if self.settings.get('encrypt_home'):
-            self.queue_event('info', _("Encrypting user home dir..."))
+            self.queue_message('info', N_("Encrypting user home dir..."))
             gocryptfs.setup(username, "users", DEST_DIR, password)
             logging.debug("User home dir encrypted")
 
@@ -560,7 +566,7 @@ class PostInstallation(object):
 
     def rebuild_zfs_modules(self):
         """ Sometimes dkms tries to build the zfs module before spl. """
-        self.queue_event('info', _("Building zfs modules..."))
+        self.queue_message('info', N_("Building zfs modules..."))
         zfs_version = self.get_installed_zfs_version()
         spl_module = 'spl/{}'.format(zfs_version)
         zfs_module = 'zfs/{}'.format(zfs_version)
@@ -628,7 +634,7 @@ class PostInstallation(object):
             populate pacman keyring, setup systemd services, ... """
 
         self.queue_event('pulse', 'start')
-        self.queue_event('info', _("Configuring your new system"))
+        self.queue_message('info', N_("Configuring your new system"))
 
         auto_fstab = PostFstab(
             self.method, self.mount_devices, self.fs_devices, self.ssd, self.settings)
@@ -731,7 +737,7 @@ class PostInstallation(object):
 
         # Generate locales
         locale = self.settings.get("locale")
-        self.queue_event('info', _("Generating locales..."))
+        self.queue_message('info', N_("Generating locales..."))
         self.uncomment_locale_gen(locale)
         chroot_call(['locale-gen'])
         locale_conf_path = os.path.join(DEST_DIR, "etc/locale.conf")
@@ -743,16 +749,16 @@ class PostInstallation(object):
         # with open(environment_path, "w") as environment:
         #    environment.write('LANG={0}\n'.format(locale))
 
-        self.queue_event('info', _("Adjusting hardware clock..."))
+        self.queue_message('info', N_("Adjusting hardware clock..."))
         self.auto_timesetting()
 
-        self.queue_event('info', _("Configuring keymap..."))
+        self.queue_message('info', N_("Configuring keymap..."))
         self.set_keymap()
 
         # Install configs for root
         chroot_call(['cp', '-av', '/etc/skel/.', '/root/'])
 
-        self.queue_event('info', _("Configuring hardware..."))
+        self.queue_message('info', N_("Configuring hardware..."))
 
         # Copy generated xorg.conf to target
         if os.path.exists("/etc/X11/xorg.conf"):
@@ -787,7 +793,7 @@ class PostInstallation(object):
         # It should work out of the box most of the time.
         # This way we don't have to fix deprecated hooks.
         # NOTE: With LUKS or LVM maybe we'll have to fix deprecated hooks.
-        self.queue_event('info', _("Configuring System Startup..."))
+        self.queue_message('info', N_("Configuring System Startup..."))
         mkinitcpio.run(DEST_DIR, self.settings, self.mount_devices, self.blvm)
 
         # Patch user-dirs-update-gtk.desktop
@@ -806,7 +812,7 @@ class PostInstallation(object):
         # Install boot loader (always after running mkinitcpio)
         if self.settings.get('bootloader_install'):
             try:
-                self.queue_event('info', _("Installing bootloader..."))
+                self.queue_message('info', N_("Installing bootloader..."))
                 boot_loader = loader.Bootloader(
                     DEST_DIR,
                     self.settings,
@@ -34,14 +34,17 @@ import subprocess
 import traceback
 import logging
 import sys
-import queue
 
 import pyalpm
 
+import events
+from events import N_
 import misc.extra as misc
 
 from download import download
 
+import pacman.session as pac_session
+
 from installation import select_packages as pack
 
 # When testing, no _() is available
@@ -94,14 +97,18 @@ class Process(multiprocessing.Process):
         """ Calculates download package list and then calls run_format and
         run_install. Takes care of the exceptions, too. """
 
+        # Settings do not change anymore (but for a few keys that are
+        # still read from the shared settings), use a local copy
+        self.settings = self.settings.snapshot()
+
         try:
             # Before formatting, let's try to calculate package download list
             # this way, if something fails (a missing package, mostly) we have
             # not formatted anything yet.
             self.create_metalinks_list()
 
-            self.queue_event(
-                'info', _("Getting your disk(s) ready for Antergos..."))
+            self.queue_message(
+                'info', N_("Getting your disk(s) ready for Antergos..."))
             with misc.raised_privileges() as __:
                 self.install_screen.run_format()
 
@@ -111,7 +118,7 @@ class Process(multiprocessing.Process):
                 part_file.write("# users to reboot before retry\n")
                 part_file.write("# formatting their hard disk(s)\n")
 
-            self.queue_event('info', _("Installation will start now!"))
+            self.queue_message('info', N_("Installation will start now!"))
             with misc.raised_privileges() as __:
                 self.install_screen.run_install(
                     self.pkg.packages, self.down.metalinks)
@@ -143,6 +150,12 @@ class Process(multiprocessing.Process):
             for line in trace:
                 logging.error(line.rstrip())
             self.queue_fatal_event(install_error)
+        finally:
+            # Close all alpm sessions opened by this process
+            pac_session.release_all()
+            if self.callback_queue is not None:
+                # Do not lose delayed progress events
+                events.get_publisher(self.callback_queue).flush()
 
     def queue_fatal_event(self, txt):
         """ Enqueues a fatal event and exits process """
@@ -150,11 +163,19 @@ class Process(multiprocessing.Process):
         sys.exit(0)
 
     def queue_event(self, event_type, event_text=""):
-        """ Enqueue an event """
+        """ Enqueue an event (through the shared publisher, so it keeps its
+            order with delayed progress events) """
         if self.callback_queue is not None:
-            try:
-                self.callback_queue.put_nowait((event_type, event_text))
-            except queue.Full:
-                pass
+            events.get_publisher(self.callback_queue).publish(
+                event_type, event_text)
         else:
             print("{0}: {1}".format(event_type, event_text))
+
+    def queue_message(self, event_type, message, *args):
+        """ Enqueue an event whose message will be translated (and
+            formatted with args) by the GUI """
+        if self.callback_queue is not None:
+            events.get_publisher(self.callback_queue).publish_message(
+                event_type, message, *args)
+        else:
+            print("{0}: {1}".format(event_type, message.format(*args)))
@@ -26,7 +26,6 @@
 
 import logging
 import os
-import queue
 import sys
 import requests
 from requests.exceptions import RequestException
@@ -37,9 +36,11 @@ except ImportError as err:
     import xml.etree.ElementTree as eTree
 
 import desktop_info
+import events
+from events import N_
 import info
 
-import pacman.pac as pac
+import pacman.session as pac_session
 import misc.extra as misc
 from misc.extra import InstallError
 
@@ -67,6 +68,8 @@ class SelectPackages(object):
             'alternate_package_list')
         self.desktop = self.settings.get('desktop')
         self.zfs = self.settings.get('zfs')
+        # Language of the lang attribute of packages.xml nodes ('es'...)
+        self.lang = (self.settings.get('locale') or '').split('.')[0][:2]
 
         # Packages to be removed
         self.conflicts = []
@@ -84,15 +87,23 @@ class SelectPackages(object):
         sys.exit(0)
 
     def queue_event(self, event_type, event_text=""):
-        """ Enqueue event """
+        """ Enqueue event (through the shared publisher, so it keeps its
+            order with delayed progress events) """
         if self.callback_queue is not None:
-            try:
-                self.callback_queue.put_nowait((event_type, event_text))
-            except queue.Full:
-                pass
+            events.get_publisher(self.callback_queue).publish(
+                event_type, event_text)
         else:
             print("{0}: {1}".format(event_type, event_text))
 
+    def queue_message(self, event_type, message, *args):
+        """ Enqueue an event whose message will be translated (and
+            formatted with args) by the GUI """
+        if self.callback_queue is not None:
+            events.get_publisher(self.callback_queue).publish_message(
+                event_type, message, *args)
+        else:
+            print("{0}: {1}".format(event_type, message.format(*args)))
+
     def create_package_list(self):
         """ Create package list """
 
@@ -117,10 +128,11 @@ class SelectPackages(object):
 
     @misc.raise_privileges
     def refresh_pacman_databases(self):
-        """ Updates pacman databases """
+        """ Updates pacman databases. The alpm session is kept open, so the
+            download list can be created later without loading them again """
         # Init pyalpm
         try:
-            pacman = pac.Pac("/etc/pacman.conf", self.callback_queue)
+            pacman = pac_session.get_pac("/etc/pacman.conf", self.callback_queue)
         except Exception as ex:
             template = "Can't initialize pyalpm. " \
                 "An exception of type {0} occured. Arguments:\n{1!r}"
@@ -128,22 +140,12 @@ class SelectPackages(object):
             logging.error(message)
             raise InstallError(message)
 
-        # Refresh pacman databases
-        if not pacman.refresh():
+        # Refresh pacman databases (only once per session)
+        if not pacman.databases_refreshed and not pacman.refresh():
             logging.error("Can't refresh pacman databases.")
             txt = _("Can't refresh pacman databases.")
             raise InstallError(txt)
 
-        try:
-            pacman.release()
-            del pacman
-        except Exception as ex:
-            template = "Can't release pyalpm. " \
-                "An exception of type {0} occured. Arguments:\n{1!r}"
-            message = template.format(type(ex).__name__, ex.args)
-            logging.error(message)
-            raise InstallError(message)
-
     def add_package(self, pkg):
         """ Adds xml node text to our package list
             returns TRUE if the package is added """
@@ -154,8 +156,7 @@ class SelectPackages(object):
             return False
 
         lang = pkg.attrib.get('lang')
-        locale = self.settings.get("locale").split('.')[0][:2]
-        if lang and lang != locale:
+        if lang and lang != self.lang:
             return False
 
         lib = pkg.attrib.get('lib')
@@ -194,7 +195,7 @@ class SelectPackages(object):
             # The list of packages is retrieved from an online XML to let us
             # control the pkgname in case of any modification
 
-            self.queue_event('info', _("Getting package list..."))
+            self.queue_message('info', N_("Getting package list..."))
 
             try:
                 url = SelectPackages.PKGLIST_URL
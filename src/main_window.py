@@ -30,10 +30,10 @@
 """ Main Cnchi Window """
 
 import os
-import multiprocessing
 import logging
 
 import config
+import events
 import desktop_info
 import info
 import misc.extra as misc
@@ -208,11 +208,14 @@ class MainWindow(Gtk.ApplicationWindow):
 
         # Create a queue. Will be used to report pacman messages
         # (pacman/pac.py) to the main thread (installation/process.py)
-        self.callback_queue = multiprocessing.JoinableQueue()
+        self.callback_queue = events.CallbackQueue()
 
         # This list will have all processes (rankmirrors, autotimezone...)
         self.process_list = []
 
+        if cmd_line.record_events:
+            self.settings.set('events_log', cmd_line.record_events)
+
         if cmd_line.packagelist:
             self.settings.set('alternate_package_list', cmd_line.packagelist)
             logging.info(
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mirror_cache.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Stores mirror status and ranking results between Cnchi runs
+
+    Ranking mirrors takes time, so if Cnchi is run again (after a failed
+    installation, for instance) the last ranking is used while it is fresh.
+    Rankings are stored per country, and a ranking is discarded when one of
+    its mirrors fails while downloading packages. """
+
+import json
+import logging
+import os
+import time
+
+import misc.extra as misc
+
+from download.mirror_health import get_host
+
+CACHE_PATH = "/var/cache/cnchi/mirrors.json"
+CACHE_VERSION = 1
+
+# Archlinux mirror status data is reused during one hour
+STATUS_TTL = 60 * 60
+
+# Rankings newer than this are used without ranking mirrors again
+RANKING_TTL = 6 * 60 * 60
+
+# Older rankings (but not older than this) are used while mirrors are
+# ranked again, so there are good mirrorlists as soon as possible
+RANKING_MAX_AGE = 48 * 60 * 60
+
+
+class MirrorCache(object):
+    """ Mirror status and ranking results stored in a json file """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.data = {}
+        self.load()
+
+    def load(self):
+        """ Loads cache from disk (if it exists) """
+        self.data = {'version': CACHE_VERSION, 'status': None,
+                     'rankings': {}, 'failures': {}}
+        try:
+            with open(self.path) as cache_file:
+                data = json.load(cache_file)
+            if data.get('version') == CACHE_VERSION:
+                self.data.update(data)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as err:
+            logging.debug("Ignoring mirror cache %s: %s", self.path, err)
+
+    def save(self):
+        """ Writes cache to disk (atomically) """
+        tmp_path = self.path + '.tmp'
+        with misc.raised_privileges() as __:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmp_path, 'w') as cache_file:
+                    json.dump(self.data, cache_file)
+                os.replace(tmp_path, self.path)
+            except OSError as err:
+                logging.debug("Can't write mirror cache %s: %s", self.path, err)
+
+    def get_status(self):
+        """ Returns mirror status data if it is fresh, None otherwise """
+        status = self.data.get('status')
+        if status and time.time() - status.get('timestamp', 0) < STATUS_TTL:
+            return status.get('data')
+        return None
+
+    def set_status(self, data):
+        """ Stores mirror status data """
+        self.data['status'] = {'timestamp': time.time(), 'data': data}
+        self.save()
+
+    def _has_failed(self, ranking):
+        """ Checks if a mirror of the ranking has failed after it was made """
+        failures = self.data.get('failures', {})
+        for url in ranking.get('arch', []) + ranking.get('antergos', []):
+            if failures.get(get_host(url), 0) > ranking['timestamp']:
+                return True
+        return False
+
+    def get_ranking(self, key, max_age=RANKING_TTL):
+        """ Returns the ranking stored for key (a country code) if it is
+            newer than max_age seconds and none of its mirrors has failed
+            since then. Returns None otherwise. A ranking is a dict with
+            'arch' (Arch mirror urls), 'antergos' and 'antergos_failed'
+            (Antergos server lines) and 'timestamp' keys """
+        ranking = self.data.get('rankings', {}).get(key or 'unknown')
+        if not ranking or time.time() - ranking.get('timestamp', 0) >= max_age:
+            return None
+        if self._has_failed(ranking):
+            logging.debug("A mirror has failed, cached ranking is discarded")
+            return None
+        return ranking
+
+    def set_ranking(self, key, arch, antergos, antergos_failed):
+        """ Stores a new ranking for key (a country code) """
+        self.data['rankings'][key or 'unknown'] = {
+            'timestamp': time.time(),
+            'arch': arch,
+            'antergos': antergos,
+            'antergos_failed': antergos_failed}
+        self.save()
+
+    def add_failures(self, urls):
+        """ Records that these mirrors have failed (now) """
+        now = time.time()
+        for url in urls:
+            self.data['failures'][get_host(url)] = now
+        self.save()
+
+
+def invalidate_mirrors(urls, path=CACHE_PATH):
+    """ Discards cached rankings that include any of these (failed) urls """
+    urls = list(urls)
+    if urls and os.path.exists(path):
+        MirrorCache(path).add_failures(urls)
+
+
+def test_module():
+    """ Helper function to test this module """
+    cache = MirrorCache("/tmp/cnchi-mirrors-test.json")
+    cache.set_ranking("ES", ["http://mirror.example.com/archlinux/"], [], [])
+    print(cache.get_ranking("ES"))
+    invalidate_mirrors(
+        ["http://mirror.example.com/archlinux/core/os/x86_64/foo.pkg.tar.xz"],
+        cache.path)
+    print(MirrorCache(cache.path).get_ranking("ES"))
+
+
+if __name__ == '__main__':
+    test_module()
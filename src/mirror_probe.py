@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# mirror_probe.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Measures how fast mirrors are
+
+    Each probe records the time until the mirror first answers, the time to
+    the first byte of the response and the download rate of the test file.
+    All mirrors are probed concurrently by a bounded pool of threads.
+
+    Latency probes (HEAD requests) are cheap, so they can be used to discard
+    slow mirrors before measuring the download rate of the remaining ones. """
+
+import logging
+import os
+import tarfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+# Seconds to wait for a mirror to connect or answer
+PROBE_TIMEOUT = 5
+
+# Mirrors probed at the same time
+PROBE_WORKERS = 8
+
+PROBE_CHUNK_SIZE = 64 * 1024
+
+SYNC_DB_DIR = "/var/lib/pacman/sync"
+
+
+def get_package_filename(repo, pkg_name, sync_dir=SYNC_DB_DIR):
+    """ Returns the file name of pkg_name in the repo sync database
+        (from its desc entry) or None if it can't be found """
+    db_path = os.path.join(sync_dir, repo + ".db")
+    try:
+        with tarfile.open(db_path) as sync_db:
+            for member in sync_db:
+                if not (member.isfile() and member.name.endswith("/desc") and
+                        member.name.startswith(pkg_name + "-")):
+                    continue
+                desc = sync_db.extractfile(member).read().decode()
+                fields = {}
+                key = None
+                for line in desc.splitlines():
+                    if line.startswith("%") and line.endswith("%"):
+                        key = line.strip("%")
+                    elif key and line and key not in fields:
+                        fields[key] = line
+                if fields.get("NAME") == pkg_name:
+                    return fields.get("FILENAME")
+    except (OSError, tarfile.TarError, UnicodeDecodeError) as err:
+        logging.debug("Can't read %s sync database: %s", repo, err)
+    return None
+
+
+def get_probe_subpath(arch="x86_64"):
+    """ Returns the path (relative to an Arch mirror root) of the file used
+        to test mirror speed. cryptsetup is a small package that every
+        mirror has; its current name is read from the core sync database """
+    filename = get_package_filename("core", "cryptsetup")
+    if filename:
+        logging.debug(
+            "%s will be used to test mirror speed", filename)
+        return "core/os/{0}/{1}".format(arch, filename)
+    return "core/os/{0}/core.db.tar.gz".format(arch)
+
+
+class ProbeResult(object):
+    """ Timings of one mirror probe (all of them in seconds) """
+
+    __slots__ = ['url', 'connect_time', 'ttfb', 'size', 'elapsed', 'error']
+
+    def __init__(self, url):
+        self.url = url
+        self.connect_time = None
+        self.ttfb = None
+        self.size = 0
+        self.elapsed = None
+        self.error = None
+
+    @property
+    def ok(self):
+        """ True if the probe has finished without errors """
+        return self.error is None
+
+    @property
+    def rate(self):
+        """ Download rate (bytes per second), 0 if the probe failed """
+        if not self.ok or not self.elapsed or not self.size:
+            return 0
+        return self.size / self.elapsed
+
+
+def probe_url(url, timeout=PROBE_TIMEOUT, method="GET"):
+    """ Downloads url measuring the time until the server first answers
+        (connect_time), the time to the first byte of the final response
+        (after following redirects) and the transfer rate.
+        Returns a ProbeResult. If method is HEAD only the first two are
+        measured (nothing is downloaded).
+        Proxy environment variables are honored """
+    result = ProbeResult(url)
+
+    def on_response(response, *_args, **_kwargs):
+        """ Called for each response (redirections too) """
+        if result.connect_time is None:
+            result.connect_time = response.elapsed.total_seconds()
+
+    time0 = time.monotonic()
+    try:
+        with requests.request(
+                method, url, headers={"User-Agent": "Mozilla/5.0"},
+                timeout=timeout, allow_redirects=True, stream=True,
+                hooks={'response': on_response}) as response:
+            result.ttfb = time.monotonic() - time0
+            if response.status_code != 200:
+                result.error = "HTTP {0}".format(response.status_code)
+                return result
+            if method == "HEAD":
+                return result
+
+            for data in response.iter_content(PROBE_CHUNK_SIZE):
+                result.size += len(data)
+            result.elapsed = time.monotonic() - time0
+    except (requests.RequestException, OSError) as err:
+        result.error = str(err) or err.__class__.__name__
+    return result
+
+
+def probe_latency(url, timeout=PROBE_TIMEOUT):
+    """ Measures connection time and time to first byte of url """
+    return probe_url(url, timeout, method="HEAD")
+
+
+def sort_by_latency(results):
+    """ Returns the urls that answered, lowest time to first byte first """
+    answered = [result for result in results.values() if result.ok]
+    answered.sort(key=lambda result: result.ttfb)
+    return [result.url for result in answered]
+
+
+class MirrorProber(object):
+    """ Probes a list of urls concurrently """
+
+    def __init__(self, max_workers=PROBE_WORKERS, timeout=PROBE_TIMEOUT,
+                 progress_callback=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # Called with the fraction of urls already probed
+        self.progress_callback = progress_callback
+
+    def probe(self, urls, probe_function=probe_url):
+        """ Probes all urls and returns a dict url -> ProbeResult.
+            Progress is reported each time a probe finishes (no polling) """
+        urls = list(urls)
+        results = {}
+        if not urls:
+            return results
+
+        num_workers = min(self.max_workers, len(urls))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = {
+                executor.submit(probe_function, url, self.timeout): url
+                for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    results[url] = future.result()
+                except Exception as err:
+                    # Do not let a bad mirror stop the whole ranking
+                    logging.debug("Error probing %s: %s", url, err)
+                    results[url] = ProbeResult(url)
+                    results[url].error = str(err)
+                if self.progress_callback:
+                    self.progress_callback(len(results) / len(urls))
+        return results
+
+
+def log_results(results):
+    """ Logs the probe results (fastest first) """
+    if not results:
+        return
+    url_len = max(len(url) for url in results)
+    fmt = "%-{0}s  %10s  %10s  %14s".format(url_len)
+    logging.debug(fmt, "Server", "Connect", "TTFB", "Rate")
+    fmt = "%-{0}s  %8.3f s  %8.3f s  %8.2f KiB/s".format(url_len)
+    nan = float('NaN')
+    for result in sorted(results.values(), key=lambda res: -res.rate):
+        logging.debug(
+            fmt, result.url,
+            result.connect_time if result.connect_time is not None else nan,
+            result.ttfb if result.ttfb is not None else nan,
+            result.rate / 1024.0)
+
+
+def test_module():
+    """ Helper function to test this module """
+    logging.basicConfig(level=logging.DEBUG)
+    subpath = get_probe_subpath()
+    urls = [
+        "http://mirrors.kernel.org/archlinux/" + subpath,
+        "http://mirror.rackspace.com/archlinux/" + subpath]
+    prober = MirrorProber(progress_callback=print)
+    print(sort_by_latency(prober.probe(urls, probe_latency)))
+    log_results(prober.probe(urls))
+
+
+if __name__ == '__main__':
+    test_module()
@@ -35,7 +35,6 @@ import sys
 import math
 import logging
 import os
-import queue
 import inspect
 import traceback
 from collections import OrderedDict
@@ -43,6 +42,11 @@ from collections import OrderedDict
 import pacman.alpm_events as alpm
 import pacman.pkginfo as pkginfo
 import pacman.pacman_conf as config
+from pacman.package_cache import PackageCache
+from pacman.provider_index import ProviderIndex
+
+import events
+from events import N_
 
 try:
     import pyalpm
@@ -72,6 +76,15 @@ class Pac(object):
 
         self.handle = None
 
+        # Names and provisions of all sync packages (built on demand)
+        self.provider_index = None
+
+        # Package and group lookups (cached until databases change)
+        self.package_cache = None
+
+        # True once sync databases have been refreshed with this handle
+        self.databases_refreshed = False
+
         self.logger = None
         self.setup_logger()
 
@@ -87,7 +100,8 @@ class Pac(object):
         # Store package total download size
         self.total_download_size = 0
 
-        self.last_event = {}
+        self.publisher = None
+        self.set_callback_queue(callback_queue)
 
         if not os.path.exists(conf_path):
             raise pyalpm.error
@@ -100,6 +114,14 @@ class Pac(object):
         else:
             raise pyalpm.error
 
+    def set_callback_queue(self, callback_queue):
+        """ Sets the queue where events are sent to """
+        self.callback_queue = callback_queue
+        if self.callback_queue is not None:
+            self.publisher = events.get_publisher(self.callback_queue)
+        else:
+            self.publisher = None
+
     def get_handle(self):
         """ Return alpm handle """
         return self.handle
@@ -108,6 +130,24 @@ class Pac(object):
         """ Get pacman.conf config """
         return self.config
 
+    def get_provider_index(self):
+        """ Returns the index of names and provisions of all sync packages
+            (it is built the first time it is needed) """
+        if self.provider_index is None:
+            self.provider_index = ProviderIndex(self.handle.get_syncdbs())
+        return self.provider_index
+
+    def get_package_cache(self):
+        """ Returns the package and group lookup cache of the sync
+            databases (it is created the first time it is needed) """
+        if self.package_cache is None:
+            self.package_cache = PackageCache(self.handle.get_syncdbs())
+        return self.package_cache
+
+    def find_satisfier(self, dep):
+        """ Returns the first sync package that satisfies dep or None """
+        return self.get_provider_index().find_satisfier(dep)
+
     def initialize_alpm(self):
         """ Set alpm setup """
         if self.config is not None:
@@ -146,9 +186,15 @@ class Pac(object):
 
     def release(self):
         """ Release alpm handle """
+        self.provider_index = None
+        self.package_cache = None
+        self.databases_refreshed = False
         if self.handle is not None:
             del self.handle
             self.handle = None
+        if self.publisher is not None:
+            # Send last progress events now
+            self.publisher.flush()
 
     @staticmethod
     def finalize_transaction(transaction):
@@ -226,22 +272,37 @@ class Pac(object):
 
         return self.finalize_transaction(transaction)
 
-    def refresh(self):
-        """ Sync databases like pacman -Sy """
+    def refresh(self, force=False):
+        """ Sync databases like pacman -Sy (pacman -Syy if force is True)
+            Unless forced, a database is only downloaded if the server has a
+            newer one (alpm asks for it with an If-Modified-Since header) """
         if self.handle is None:
             logging.error("alpm is not initialised")
             raise pyalpm.error
 
-        force = True
-        res = True
-        for database in self.handle.get_syncdbs():
-            transaction = self.init_transaction()
-            if transaction:
-                database.update(force)
-                transaction.release()
-            else:
-                res = False
-        return res
+        # All databases are refreshed while holding the same lock
+        transaction = self.init_transaction()
+        if not transaction:
+            self.databases_refreshed = False
+            return False
+
+        updated = []
+        try:
+            for database in self.handle.get_syncdbs():
+                if database.update(force):
+                    updated.append(database.name)
+        finally:
+            transaction.release()
+
+        if updated:
+            logging.debug("Downloaded databases: %s", ", ".join(updated))
+            # Databases have changed, rebuild the index when needed
+            self.provider_index = None
+            self.package_cache = None
+        else:
+            logging.debug("All databases are up to date")
+        self.databases_refreshed = True
+        return True
 
     def install(self, pkgs, conflicts=None, options=None):
         """ Install a list of packages like pacman -S """
@@ -263,52 +324,22 @@ class Pac(object):
         # Discard duplicates
         pkgs = list(set(pkgs))
 
-        # `alpm.handle.get_syncdbs()` returns a list (the order is important) so we
-        # have to ensure we don't clobber the priority of the repos.
-        repos = OrderedDict()
-        repo_order = []
-        db_match = [db for db in self.handle.get_syncdbs()
-                    if db.name == 'antergos']
-        antdb = OrderedDict()
-        antdb['antergos'] = db_match[0]
-
-        one_repo_groups_names = ['cinnamon', 'mate', 'mate-extra']
-        one_repo_groups = []
-        for one_repo_group_name in one_repo_groups_names:
-            grp = antdb['antergos'].read_grp(one_repo_group_name)
-            if not grp:
-                grp = ['None', []]
-                #logging.warning(
-                #    "Error reading group '%s' from the antergos repo db",
-                #    one_repo_group_name)
-            one_repo_groups.append(grp)
-
-        one_repo_pkgs = {pkg for one_repo_group in one_repo_groups
-                         for pkg in one_repo_group[1] if one_repo_group}
-
-        for syncdb in self.handle.get_syncdbs():
-            repo_order.append(syncdb)
-            repos[syncdb.name] = syncdb
+        package_cache = self.get_package_cache()
+        logging.debug('REPO DB ORDER IS: %s', package_cache.databases)
 
-        targets = []
-        logging.debug('REPO DB ORDER IS: %s', repo_order)
+        # Package name -> sync package
+        targets = OrderedDict()
 
         for name in pkgs:
-            _repos = repos
-
-            if name in one_repo_pkgs:
-                # pkg should be sourced from the antergos repo only.
-                _repos = antdb
-
-            result_ok, pkg = self.find_sync_package(name, _repos)
+            pkg = package_cache.get_pkg(name)
 
-            if result_ok:
+            if pkg is not None:
                 # Check that added package is not in our conflicts list
                 if pkg.name not in conflicts:
-                    targets.append(pkg.name)
+                    targets[pkg.name] = pkg
             else:
                 # Couldn't find the package, check if it's a group
-                group_pkgs = self.get_group_pkgs(name)
+                group_pkgs = package_cache.get_group(name)
                 if group_pkgs is not None:
                     # It's a group
                     for group_pkg in group_pkgs:
@@ -316,17 +347,24 @@ class Pac(object):
                         # Ex: connman conflicts with netctl(openresolv),
                         # which is installed by default with base group
                         if group_pkg.name not in conflicts:
-                            targets.append(group_pkg.name)
+                            targets[group_pkg.name] = group_pkg
                 else:
-                    # No, it wasn't neither a package nor a group. As we don't
-                    # know if this error is fatal or not, we'll register it and
-                    # we'll allow to continue.
-                    logging.error(
-                        "Can't find a package or group called '%s'", name)
-
-        # Discard duplicates
-        targets = list(set(targets))
-        logging.debug(targets)
+                    # Maybe it's a virtual package provided by another one
+                    provider = self.find_satisfier(name)
+                    if provider is not None:
+                        logging.debug(
+                            "'%s' is provided by package '%s'",
+                            name, provider.name)
+                        if provider.name not in conflicts:
+                            targets[provider.name] = provider
+                    else:
+                        # No, it wasn't neither a package nor a group. As we don't
+                        # know if this error is fatal or not, we'll register it and
+                        # we'll allow to continue.
+                        logging.error(
+                            "Can't find a package or group called '%s'", name)
+
+        logging.debug(list(targets))
 
         if not targets:
             logging.error("No targets found")
@@ -345,12 +383,9 @@ class Pac(object):
             logging.error("Can't initialize alpm transaction")
             return False
 
-        for _index in range(0, num_targets):
-            result_ok, pkg = self.find_sync_package(targets.pop(), repos)
-            if result_ok:
-                transaction.add_pkg(pkg)
-            else:
-                logging.warning(pkg)
+        # Packages have already been found, no need to look for them again
+        for pkg in targets.values():
+            transaction.add_pkg(pkg)
 
         return self.finalize_transaction(transaction)
 
@@ -403,15 +438,11 @@ class Pac(object):
 
     def get_group_pkgs(self, group):
         """ Get group's packages """
-        for repo in self.handle.get_syncdbs():
-            grp = repo.read_grp(group)
-            if grp is not None:
-                _name, pkgs = grp
-                return pkgs
-        return None
-
-    def get_packages_info(self, pkg_names=None):
-        """ Get information about packages like pacman -Si """
+        return self.get_package_cache().get_group(group)
+
+    def get_packages_info(self, pkg_names=None, keys=None):
+        """ Get information about packages like pacman -Si
+            (only keys are read, if given; see pkginfo.get_pkginfo) """
         if not pkg_names:
             pkg_names = []
         packages_info = {}
@@ -422,47 +453,46 @@ class Pac(object):
                     packages_info[pkg.name] = pkginfo.get_pkginfo(
                         pkg,
                         level=2,
-                        style='sync')
+                        style='sync',
+                        keys=keys)
         else:
-            repos = OrderedDict((database.name, database)
-                                for database in self.handle.get_syncdbs())
+            package_cache = self.get_package_cache()
             for pkg_name in pkg_names:
-                result_ok, pkg = self.find_sync_package(pkg_name, repos)
-                if result_ok:
+                pkg = package_cache.get_pkg(pkg_name)
+                if pkg is not None:
                     packages_info[pkg_name] = pkginfo.get_pkginfo(
                         pkg,
                         level=2,
-                        style='sync')
+                        style='sync',
+                        keys=keys)
                 else:
                     packages_info = {}
-                    logging.error(pkg)
+                    logging.error("Package '%s' was not found.", pkg_name)
         return packages_info
 
-    def get_package_info(self, pkg_name):
+    def get_package_info(self, pkg_name, keys=None):
         """ Get information about packages like pacman -Si """
-        repos = OrderedDict((database.name, database)
-                            for database in self.handle.get_syncdbs())
-        result_ok, pkg = self.find_sync_package(pkg_name, repos)
-        if result_ok:
-            info = pkginfo.get_pkginfo(pkg, level=2, style='sync')
+        pkg = self.get_package_cache().get_pkg(pkg_name)
+        if pkg is not None:
+            info = pkginfo.get_pkginfo(pkg, level=2, style='sync', keys=keys)
         else:
-            logging.error(pkg)
+            logging.error("Package '%s' was not found.", pkg_name)
             info = {}
         return info
 
+    def export_packages_info(self, path):
+        """ Writes the info of all sync packages to a json file
+            (see pkginfo.export_pkginfo) """
+        num_packages = pkginfo.export_pkginfo(self.handle.get_syncdbs(), path)
+        logging.debug("Info of %d packages exported to %s", num_packages, path)
+        return num_packages
+
     def queue_event(self, event_type, event_text=""):
         """ Queues events to the event list in the GUI thread """
 
         if event_type == "percent":
             # Limit percent to two decimal
-            event_text = "{0:.2f}".format(event_text)
-
-        if event_type in self.last_event:
-            if self.last_event[event_type] == event_text:
-                # Do not enqueue the same event twice
-                return
-
-        self.last_event[event_type] = event_text
+            event_text = round(float(event_text), 2)
 
         if event_type == "error":
             # Format message to show file, function, and line where the
@@ -484,10 +514,8 @@ class Pac(object):
             else:
                 logging.debug(event_text)
         else:
-            try:
-                self.callback_queue.put_nowait((event_type, event_text))
-            except queue.Full:
-                logging.warning("Callback queue is full")
+            # Repeated events are not sent, progress events are rate limited
+            self.publisher.publish(event_type, event_text)
 
             if event_type == "error":
                 # We've queued a fatal event so we must exit installer_process
@@ -496,6 +524,14 @@ class Pac(object):
                 self.callback_queue.join()
                 sys.exit(1)
 
+    def queue_message(self, event_type, message, *args):
+        """ Queues an event whose message will be translated (and
+            formatted with args) in the GUI thread """
+        if self.callback_queue is None:
+            logging.debug(message.format(*args))
+        else:
+            self.publisher.publish_message(event_type, message, *args)
+
     # Callback functions
 
     @staticmethod
@@ -584,8 +620,8 @@ class Pac(object):
     def cb_progress(self, target, percent, total, current):
         """ Shows install progress """
         if target:
-            msg = _("Installing {0} ({1}/{2})").format(target, current, total)
-            self.queue_event('info', msg)
+            self.queue_message(
+                'info', N_("Installing {0} ({1}/{2})"), target, current, total)
             percent = current / total
             self.queue_event('percent', percent)
         else:
@@ -605,7 +641,7 @@ class Pac(object):
                 ext = ".db"
                 if filename.endswith(ext):
                     filename = filename[:-len(ext)]
-                text = _("Updating {0} database").format(filename)
+                message = N_("Updating {0} database")
             else:
                 ext = ".pkg.tar.xz"
                 if filename.endswith(ext):
@@ -614,9 +650,9 @@ class Pac(object):
                 # i = self.downloaded_packages
                 # n = self.total_packages_to_download
                 # text = _("Downloading {0}... ({1}/{2})").format(filename, i, n)
-                text = _("Downloading {0}...").format(filename)
+                message = N_("Downloading {0}...")
 
-            self.queue_event('info', text)
+            self.queue_message('info', message, filename)
             self.queue_event('percent', 0)
         else:
             # Compute a progress indicator
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  package_cache.py
+#
+#  Copyright © 2013-2018 Antergos
+#
+#  This file is part of Cnchi.
+#
+#  Cnchi is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Cnchi is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  The following additional terms are in effect as per Section 7 of the license:
+#
+#  The preservation of all legal notices and author attributions in
+#  the material or in the Appropriate Legal Notices displayed
+#  by works containing it is required.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Cache of package and group lookups in the sync databases
+
+    Package names are searched in all sync databases (in order) the first
+    time they are needed, and the result is kept until the databases change.
+    Packages of some groups (ONE_REPO_GROUPS) are only taken from the
+    antergos repo. """
+
+# Packages of these groups must be sourced from the antergos repo only
+ONE_REPO = 'antergos'
+ONE_REPO_GROUPS = ['cinnamon', 'mate', 'mate-extra']
+
+
+class PackageCache(object):
+    """ Package (name -> package) and group (name -> packages) lookups
+        over a list of databases """
+
+    def __init__(self, databases):
+        """ databases must be given in priority order """
+        self.databases = list(databases)
+        self.one_repo_db = None
+        for database in self.databases:
+            if database.name == ONE_REPO:
+                self.one_repo_db = database
+                break
+        self.packages = {}
+        self.groups = {}
+        self._one_repo_pkgs = None
+
+    @property
+    def one_repo_pkgs(self):
+        """ Names of the packages that must come from the antergos repo """
+        if self._one_repo_pkgs is None:
+            self._one_repo_pkgs = set()
+            if self.one_repo_db is not None:
+                for group_name in ONE_REPO_GROUPS:
+                    grp = self.one_repo_db.read_grp(group_name)
+                    if grp:
+                        self._one_repo_pkgs.update(pkg.name for pkg in grp[1])
+        return self._one_repo_pkgs
+
+    def get_pkg(self, name):
+        """ Returns the sync package called name or None """
+        if name not in self.packages:
+            if name in self.one_repo_pkgs:
+                databases = [self.one_repo_db]
+            else:
+                databases = self.databases
+            pkg = None
+            for database in databases:
+                pkg = database.get_pkg(name)
+                if pkg is not None:
+                    break
+            self.packages[name] = pkg
+        return self.packages[name]
+
+    def get_group(self, name):
+        """ Returns the packages of the group called name (from the first
+            database that has it) or None if there is no such group """
+        if name not in self.groups:
+            pkgs = None
+            for database in self.databases:
+                grp = database.read_grp(name)
+                if grp is not None:
+                    pkgs = grp[1]
+                    break
+            self.groups[name] = pkgs
+        return self.groups[name]
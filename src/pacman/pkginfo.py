@@ -26,8 +26,15 @@ Package information formatting
 
 This module defines utility function to format package information
 for terminal output.
+
+Package information is stored raw (it is only formatted when it is
+displayed), and only the fields that are asked for are read from alpm.
 """
 
+import collections
+import functools
+import json
+import os
 import sys
 import time
 import textwrap
@@ -58,7 +65,7 @@ def get_term_size():
         return 80
 
 
-def format_attr(attrname, value, attrformat=None):
+def format_attr(attrname, value, attrformat=None, width=None):
     if isinstance(value, list):
         if not value:
             valuestring = 'None'
@@ -71,7 +78,10 @@ def format_attr(attrname, value, attrformat=None):
         else:
             valuestring = str(value)
 
-    return textwrap.fill(valuestring, width=get_term_size(),
+    if width is None:
+        width = get_term_size()
+
+    return textwrap.fill(valuestring, width=width,
                          initial_indent=ATTRNAME_FORMAT % attrname,
                          subsequent_indent=ATTR_INDENT,
                          break_on_hyphens=False,
@@ -99,55 +109,58 @@ def display_pkginfo(pkg, level=1, style='local'):
     if style not in ['local', 'sync', 'file']:
         raise ValueError('Invalid style for package info formatting')
 
+    # Terminal width is only asked once
+    width = get_term_size()
+
     if style == 'sync':
-        print(format_attr('Repository', pkg.db.name))
-
-    print(format_attr('Name', pkg.name))
-    print(format_attr('Version', pkg.version))
-    print(format_attr('URL', pkg.url))
-    print(format_attr('Licenses', pkg.licenses))
-    print(format_attr('Groups', pkg.groups))
-    print(format_attr('Provides', pkg.provides))
-    print(format_attr('Depends On', pkg.depends))
+        print(format_attr('Repository', pkg.db.name, width=width))
+
+    print(format_attr('Name', pkg.name, width=width))
+    print(format_attr('Version', pkg.version, width=width))
+    print(format_attr('URL', pkg.url, width=width))
+    print(format_attr('Licenses', pkg.licenses, width=width))
+    print(format_attr('Groups', pkg.groups, width=width))
+    print(format_attr('Provides', pkg.provides, width=width))
+    print(format_attr('Depends On', pkg.depends, width=width))
     print(format_attr_oneperline('Optional Deps', pkg.optdepends))
 
     if style == 'local' or level == 2:
-        print(format_attr('Required By', pkg.compute_requiredby()))
+        print(format_attr('Required By', pkg.compute_requiredby(), width=width))
 
-    print(format_attr('Conflicts With', pkg.conflicts))
-    print(format_attr('Replaces', pkg.replaces))
+    print(format_attr('Conflicts With', pkg.conflicts, width=width))
+    print(format_attr('Replaces', pkg.replaces, width=width))
 
     if style == 'sync':
-        print(format_attr('Download Size', '%.2f K' % (pkg.size / 1024)))
+        print(format_attr('Download Size', '%.2f K' % (pkg.size / 1024), width=width))
 
     if style == 'file':
-        print(format_attr('Compressed Size', '%.2f K' % (pkg.size / 1024)))
+        print(format_attr('Compressed Size', '%.2f K' % (pkg.size / 1024), width=width))
 
-    print(format_attr('Installed Size', '%.2f K' % (pkg.isize / 1024)))
-    print(format_attr('Packager', pkg.packager))
-    print(format_attr('Architecture', pkg.arch))
-    print(format_attr('Build Date', pkg.builddate, attrformat='time'))
+    print(format_attr('Installed Size', '%.2f K' % (pkg.isize / 1024), width=width))
+    print(format_attr('Packager', pkg.packager, width=width))
+    print(format_attr('Architecture', pkg.arch, width=width))
+    print(format_attr('Build Date', pkg.builddate, attrformat='time', width=width))
 
     if style == 'local':
         # local installation information
-        print(format_attr('Install Date', pkg.installdate, attrformat='time'))
+        print(format_attr('Install Date', pkg.installdate, attrformat='time', width=width))
         if pkg.reason == pyalpm.PKG_REASON_EXPLICIT:
             reason = 'Explicitly installed'
         elif pkg.reason == pyalpm.PKG_REASON_DEPEND:
             reason = 'Installed as a dependency for another package'
         else:
             reason = 'N/A'
-        print(format_attr('Install Reason', reason))
+        print(format_attr('Install Reason', reason, width=width))
 
     if style != 'sync':
-        print(format_attr('Install Script', 'Yes' if pkg.has_scriptlet else 'No'))
+        print(format_attr('Install Script', 'Yes' if pkg.has_scriptlet else 'No', width=width))
 
     if style == 'sync':
-        print(format_attr('MD5 Sum', pkg.md5sum))
-        print(format_attr('SHA256 Sum', pkg.sha256sum))
-        print(format_attr('Signatures', 'Yes' if pkg.base64_sig else 'No'))
+        print(format_attr('MD5 Sum', pkg.md5sum, width=width))
+        print(format_attr('SHA256 Sum', pkg.sha256sum, width=width))
+        print(format_attr('Signatures', 'Yes' if pkg.base64_sig else 'No', width=width))
 
-    print(format_attr('Description', pkg.desc))
+    print(format_attr('Description', pkg.desc, width=width))
 
     if level >= 2 and style == 'local':
         # print backup information
@@ -160,74 +173,123 @@ def display_pkginfo(pkg, level=1, style='local'):
     print('')
 
 
-def get_pkginfo(pkg, level=1, style='local'):
-    """ Stores package info into a dictonary """
+def _get_reason(pkg):
+    """ Returns why a local package was installed """
+    if pkg.reason == pyalpm.PKG_REASON_EXPLICIT:
+        return _('Explicitly installed')
+    if pkg.reason == pyalpm.PKG_REASON_DEPEND:
+        return _('Installed as a dependency for another package')
+    return 'N/A'
+
+
+def _get_backup(pkg):
+    """ Returns the backup files of a local package """
+    if not pkg.backup:
+        return None
+    return [(md5, filename) for (filename, md5) in pkg.backup]
+
+
+@functools.lru_cache(maxsize=None)
+def get_pkginfo_getters(level=1, style='local'):
+    """ Returns a tuple of (key, function) pairs. Each function
+        reads the value of its key from a package. They are only built
+        once for each level and style """
     if style not in ['local', 'sync', 'file']:
         raise ValueError('Invalid style for package info formatting')
 
-    info = {}
+    getters = []
 
     if style == 'sync':
-        info['repository'] = pkg.db.name
-
-    info['name'] = pkg.name
-    info['version'] = pkg.version
-    info['url'] = pkg.url
-    info['licenses'] = pkg.licenses
-    info['groups'] = pkg.groups
-    info['provides'] = pkg.provides
-    info['depends on'] = pkg.depends
-    info['optional deps'] = pkg.optdepends
+        getters.append(('repository', lambda pkg: pkg.db.name))
+
+    getters.extend([
+        ('name', lambda pkg: pkg.name),
+        ('version', lambda pkg: pkg.version),
+        ('url', lambda pkg: pkg.url),
+        ('licenses', lambda pkg: pkg.licenses),
+        ('groups', lambda pkg: pkg.groups),
+        ('provides', lambda pkg: pkg.provides),
+        ('depends on', lambda pkg: pkg.depends),
+        ('optional deps', lambda pkg: pkg.optdepends)])
 
     if style == 'local' or level == 2:
-        info['required by'] = pkg.compute_requiredby()
+        getters.append(('required by', lambda pkg: pkg.compute_requiredby()))
 
-    info['conflicts with'] = pkg.conflicts
-    info['replaces'] = pkg.replaces
+    getters.extend([
+        ('conflicts with', lambda pkg: pkg.conflicts),
+        ('replaces', lambda pkg: pkg.replaces)])
 
     if style == 'sync':
-        info['download size'] = pkg.size / 1024
+        getters.append(('download size', lambda pkg: pkg.size / 1024))
 
     if style == 'file':
-        info['compressed size'] = pkg.size / 1024
+        getters.append(('compressed size', lambda pkg: pkg.size / 1024))
 
-    info['installed size'] = pkg.isize / 1024
-    info['packager'] = pkg.packager
-    info['architecture'] = pkg.arch
-    info['build date'] = pkg.builddate
+    getters.extend([
+        ('installed size', lambda pkg: pkg.isize / 1024),
+        ('packager', lambda pkg: pkg.packager),
+        ('architecture', lambda pkg: pkg.arch),
+        ('build date', lambda pkg: pkg.builddate)])
 
     if style == 'local':
         # local installation information
-        info['install date'] = pkg.installdate
-        if pkg.reason == pyalpm.PKG_REASON_EXPLICIT:
-            reason = _('Explicitly installed')
-        elif pkg.reason == pyalpm.PKG_REASON_DEPEND:
-            reason = _('Installed as a dependency for another package')
-        else:
-            reason = 'N/A'
-        info['install reason'] = reason
+        getters.append(('install date', lambda pkg: pkg.installdate))
+        getters.append(('install reason', _get_reason))
 
     if style != 'sync':
-        if pkg.has_scriptlet:
-            info['install script'] = 'Yes'
-        else:
-            info['install script'] = 'No'
+        getters.append((
+            'install script',
+            lambda pkg: 'Yes' if pkg.has_scriptlet else 'No'))
 
     if style == 'sync':
-        info['md5 sum'] = pkg.md5sum
-        info['sha256 sum'] = pkg.sha256sum
-        if pkg.base64_sig:
-            info['signatures'] = 'Yes'
-        else:
-            info['signatures'] = 'No'
+        getters.extend([
+            ('md5 sum', lambda pkg: pkg.md5sum),
+            ('sha256 sum', lambda pkg: pkg.sha256sum),
+            ('signatures', lambda pkg: 'Yes' if pkg.base64_sig else 'No')])
 
-    info['description'] = pkg.desc
+    getters.append(('description', lambda pkg: pkg.desc))
 
     if level >= 2 and style == 'local':
-        if not pkg.backup:
-            info['backup files'] = None
-        else:
-            info['backup files'] = [(md5, filename)
-                                    for (filename, md5) in pkg.backup]
+        getters.append(('backup files', _get_backup))
 
+    return tuple(getters)
+
+
+def get_pkginfo(pkg, level=1, style='local', keys=None):
+    """ Stores package info into a dictonary. If keys is given, only those
+        keys are read from alpm (unknown keys are ignored). Values are
+        copied, so the dictionary can be used after alpm is released """
+    info = {}
+    for key, getter in get_pkginfo_getters(level, style):
+        if keys is None or key in keys:
+            info[key] = getter(pkg)
     return info
+
+
+# Raw package fields stored by export_pkginfo
+EXPORT_FIELDS = [
+    'name', 'version', 'desc', 'url', 'arch', 'filename', 'size', 'isize',
+    'packager', 'builddate', 'licenses', 'groups', 'provides', 'depends',
+    'optdepends', 'conflicts', 'replaces']
+
+
+def export_pkginfo(databases, path, fields=None):
+    """ Writes the raw info of all packages of databases to a json file.
+        Data is stored by columns (one list per field and repo) to keep the
+        file small. Returns how many packages have been exported """
+    fields = fields or EXPORT_FIELDS
+    data = {'fields': fields, 'repos': collections.OrderedDict()}
+    num_packages = 0
+    for database in databases:
+        columns = collections.OrderedDict((field, []) for field in fields)
+        for pkg in database.pkgcache:
+            for field in fields:
+                columns[field].append(getattr(pkg, field))
+            num_packages += 1
+        data['repos'][database.name] = columns
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as export_file:
+        json.dump(data, export_file, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    return num_packages
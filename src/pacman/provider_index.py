@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  provider_index.py
+#
+#  Copyright © 2013-2018 Antergos
+#
+#  This file is part of Cnchi.
+#
+#  Cnchi is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  Cnchi is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  The following additional terms are in effect as per Section 7 of the license:
+#
+#  The preservation of all legal notices and author attributions in
+#  the material or in the Appropriate Legal Notices displayed
+#  by works containing it is required.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Index of package names and provisions to resolve dependencies
+
+    pyalpm.find_satisfier(db.pkgcache, dep) scans the whole package cache
+    for every dependency. This index maps each package name and each
+    'provides' entry to the packages that have it (keeping the database and
+    package cache order), so satisfiers can be found with a dict lookup. """
+
+import re
+
+try:
+    import pyalpm
+except ImportError as err:
+    # This is already logged elsewhere
+    # logging.error(err)
+    pass
+
+# Dependency string: name, comparison operator and version
+_DEP_RE = re.compile(r'^(?P<name>[^<>=]+)(?:(?P<op><=|>=|<|>|=)(?P<version>.+))?$')
+
+
+def parse_dep(dep):
+    """ Splits a dependency string ('glibc>=2.26') in its name,
+        operator and version ('glibc', '>=', '2.26').
+        Operator and version are None if the dependency has no version """
+    match = _DEP_RE.match(dep.strip())
+    if not match:
+        return dep, None, None
+    return match.group('name'), match.group('op'), match.group('version')
+
+
+def version_satisfies(version, operator, dep_version):
+    """ Checks if version satisfies the operator and dep_version
+        of a dependency (as libalpm does) """
+    if operator is None:
+        return True
+    if version is None:
+        # A provision without version can't satisfy a versioned dependency
+        return False
+    cmp = pyalpm.vercmp(version, dep_version)
+    if operator == '=':
+        return cmp == 0
+    if operator == '>=':
+        return cmp >= 0
+    if operator == '<=':
+        return cmp <= 0
+    if operator == '>':
+        return cmp > 0
+    return cmp < 0
+
+
+class ProviderIndex(object):
+    """ Maps names and provisions to packages of a list of databases """
+
+    def __init__(self, databases):
+        """ databases must be given in priority order """
+        # name -> list of (package, version) in database and cache order
+        self.providers = {}
+        self.satisfiers = {}
+
+        for database in databases:
+            for pkg in database.pkgcache:
+                self._add(pkg.name, pkg, pkg.version)
+                for provision in pkg.provides:
+                    name, _operator, version = parse_dep(provision)
+                    self._add(name, pkg, version)
+
+    def _add(self, name, pkg, version):
+        """ Adds a provider of name """
+        if name not in self.providers:
+            self.providers[name] = []
+        self.providers[name].append((pkg, version))
+
+    def find_satisfier(self, dep):
+        """ Returns the first package that satisfies dep (like
+            pyalpm.find_satisfier does over all databases) or None """
+        if dep not in self.satisfiers:
+            name, operator, dep_version = parse_dep(dep)
+            satisfier = None
+            for pkg, version in self.providers.get(name, []):
+                if version_satisfies(version, operator, dep_version):
+                    satisfier = pkg
+                    break
+            self.satisfiers[dep] = satisfier
+        return self.satisfiers[dep]
+
+    def __contains__(self, name):
+        return name in self.providers
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# session.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Keeps one alpm session (a Pac object) per pacman.conf file
+
+    Package selection, download list creation and package installation run
+    in the same process. Instead of each of them creating its own Pac object
+    (parsing pacman.conf, registering and refreshing the databases again),
+    they all get the same one from here. """
+
+import logging
+import os
+import threading
+
+import pacman.pac as pac
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _get_key(conf_path):
+    """ Sessions can't be shared between processes (each one needs its own
+        alpm handle), so they are stored by process and pacman.conf file """
+    return (os.getpid(), os.path.realpath(conf_path))
+
+
+def get_pac(conf_path="/etc/pacman.conf", callback_queue=None):
+    """ Returns the Pac object of conf_path (it is created the first time) """
+    key = _get_key(conf_path)
+    with _SESSIONS_LOCK:
+        pacman = _SESSIONS.get(key)
+        if pacman is None or pacman.handle is None:
+            pacman = pac.Pac(conf_path, callback_queue)
+            _SESSIONS[key] = pacman
+            logging.debug("New alpm session for %s", conf_path)
+        elif callback_queue is not None and pacman.callback_queue is None:
+            pacman.set_callback_queue(callback_queue)
+        return pacman
+
+
+def is_refreshed(conf_path):
+    """ Checks if the databases of conf_path have been refreshed by this
+        process (and its session is still open) """
+    with _SESSIONS_LOCK:
+        pacman = _SESSIONS.get(_get_key(conf_path))
+        return (pacman is not None and pacman.handle is not None and
+                pacman.databases_refreshed)
+
+
+def release(conf_path):
+    """ Releases the session of conf_path (if any) """
+    with _SESSIONS_LOCK:
+        pacman = _SESSIONS.pop(_get_key(conf_path), None)
+    if pacman is not None:
+        pacman.release()
+
+
+def release_all():
+    """ Releases all sessions of this process """
+    pid = os.getpid()
+    with _SESSIONS_LOCK:
+        keys = [key for key in _SESSIONS if key[0] == pid]
+        sessions = [_SESSIONS.pop(key) for key in keys]
+    for pacman in sessions:
+        pacman.release()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# sync_db.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Seeds the sync databases of the target system with the ones of the
+    live system
+
+    The live system refreshes its sync databases while the package list is
+    created. If the target pacman.conf uses the same repositories (with the
+    same servers), those database files are copied (as cheaply as the
+    filesystems allow, see download.cache_import) instead of being
+    downloaded again. """
+
+import logging
+import os
+import shutil
+
+import download.cache_import as cache_import
+import pacman.pacman_conf as config
+
+SYNC_DB_EXTENSIONS = ('.db', '.db.sig')
+
+
+def get_sync_dir(pacman_config):
+    """ Returns the sync databases directory of a PacmanConfig """
+    return os.path.join(pacman_config.options['DBPath'], 'sync')
+
+
+def copy_file(src, dst):
+    """ Copies src to dst (atomically), keeping its modification time """
+    cache_import.import_file(src, dst)
+    # alpm compares the database mtime with the server one
+    shutil.copystat(src, dst)
+
+
+def seed_sync_dbs(source_conf, target_conf):
+    """ Copies the sync databases (and signatures) of source_conf into the
+        sync directory of target_conf. Only repos with the same servers in
+        both configurations are copied. Returns the names of the repos that
+        have been copied """
+    try:
+        source = config.PacmanConfig(source_conf)
+        target = config.PacmanConfig(target_conf)
+    except (OSError, config.InvalidSyntax) as err:
+        logging.warning("Can't read pacman configuration: %s", err)
+        return []
+
+    if source.options['Architecture'] != target.options['Architecture']:
+        return []
+
+    source_dir = get_sync_dir(source)
+    target_dir = get_sync_dir(target)
+    if os.path.realpath(source_dir) == os.path.realpath(target_dir):
+        return []
+
+    seeded = []
+    for repo, servers in target.repos.items():
+        if source.repos.get(repo) != servers:
+            logging.debug("Repo %s does not match the live system one", repo)
+            continue
+        if not os.path.exists(os.path.join(source_dir, repo + '.db')):
+            continue
+        try:
+            os.makedirs(target_dir, mode=0o755, exist_ok=True)
+            for extension in SYNC_DB_EXTENSIONS:
+                src = os.path.join(source_dir, repo + extension)
+                dst = os.path.join(target_dir, repo + extension)
+                if os.path.exists(src):
+                    copy_file(src, dst)
+                elif os.path.exists(dst):
+                    # Do not keep a signature of an older database
+                    os.remove(dst)
+            seeded.append(repo)
+        except OSError as err:
+            logging.warning("Can't copy %s sync database: %s", repo, err)
+
+    if seeded:
+        logging.debug(
+            "Sync databases copied from the live system: %s", ", ".join(seeded))
+    return seeded
+
+
+def test_module():
+    """ Helper function to test this module """
+    logging.basicConfig(level=logging.DEBUG)
+    print(seed_sync_dbs("/etc/pacman.conf", "/tmp/pacman.conf"))
+
+
+if __name__ == '__main__':
+    test_module()
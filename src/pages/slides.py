@@ -47,6 +47,8 @@ from pages.gtkbasebox import GtkBaseBox
 
 from logging_utils import ContextFilter
 
+import events
+
 # When testing, no _() is available
 try:
     _("")
@@ -54,6 +56,20 @@ except NameError as err:
     def _(message):
         return message
 
+# Events that only update a widget. When many of them are read at once,
+# only the last one of each type is shown
+COALESCED_EVENTS = (
+    'percent', 'downloads_percent', 'progress_bar_show_text', 'info')
+
+# Events that have been signaled but not received yet are read again
+# every EVENT_RETRY milliseconds (at most EVENT_MAX_RETRIES times)
+EVENT_RETRY = 50
+EVENT_MAX_RETRIES = 10
+
+# Safety net: the queue is also read every EVENT_POLL milliseconds, in case
+# the wake up of an event arrived too soon (and all its retries were used)
+EVENT_POLL = 1000
+
 class Slides(GtkBaseBox):
     """ Slides page """
 
@@ -83,7 +99,25 @@ class Slides(GtkBaseBox):
 
         self.web_view_box = self.ui.get_object("scrolledwindow")
 
-        GLib.timeout_add(1000, self.manage_events_from_cb_queue)
+        # Events queued but not read yet
+        self.pending_events = 0
+        self.event_retries = 0
+
+        # Store all received events (to replay them later)
+        events_log = self.settings.get('events_log')
+        if events_log:
+            self.event_recorder = events.EventRecorder(events_log)
+        else:
+            self.event_recorder = None
+
+        if self.callback_queue is not None:
+            # Wake up as soon as the installer queues an event
+            GLib.io_add_watch(
+                self.callback_queue.get_wakeup_fd(),
+                GLib.PRIORITY_DEFAULT,
+                GLib.IO_IN,
+                self.on_events_ready)
+            GLib.timeout_add(EVENT_POLL, self.on_events_poll)
 
     def translate_ui(self):
         """ Translates all ui elements """
@@ -180,122 +214,191 @@ class Slides(GtkBaseBox):
             self.should_pulse = True
             GLib.timeout_add(100, pbar_pulse)
 
-    def manage_events_from_cb_queue(self):
-        """ We should be quick here and do as less as possible """
+    def on_events_ready(self, _fd, _condition):
+        """ Called by GTK main loop as soon as there are events in the
+            callback queue. We should be quick here and do as less as possible """
 
         if self.fatal_error:
             return False
 
-        if self.callback_queue is None:
-            return True
+        self.pending_events += self.callback_queue.take_wakeups()
+        return self.read_events()
 
-        while not self.callback_queue.empty():
+    def read_events(self):
+        """ Reads all queued events at once (without blocking) and
+            manages them """
+        batch = []
+        while True:
             try:
                 event = self.callback_queue.get_nowait()
             except ValueError as queue_error:
-                # Calling get_nowait so many times can issue a ValueError
-                # exception with this error: semaphore or lock released too
-                # many times. Log it anyways to keep an eye on this error
+                # Log it anyways to keep an eye on this error
                 logging.error(queue_error)
-                return True
+                break
             except queue.Empty:
-                # Queue is empty, just quit.
-                return True
-
-            if event[0] == 'percent':
-                self.progress_bar.set_fraction(float(event[1]))
-            elif event[0] == 'downloads_percent':
-                self.downloads_progress_bar.set_fraction(float(event[1]))
-            elif event[0] == 'progress_bar_show_text':
-                if event[1]:
-                    # self.progress_bar.set_show_text(True)
-                    self.progress_bar.set_text(event[1])
-                else:
-                    # self.progress_bar.set_show_text(False)
-                    self.progress_bar.set_text("")
-            elif event[0] == 'progress_bar':
-                if event[1] == 'hide':
-                    self.progress_bar.hide()
-                elif event[1] == 'show':
-                    self.progress_bar.show()
-            elif event[0] == 'downloads_progress_bar':
-                if event[1] == 'hide':
-                    self.downloads_progress_bar.hide()
-                elif event[1] == 'show':
-                    self.downloads_progress_bar.show()
-            elif event[0] == 'pulse':
-                if event[1] == 'stop':
-                    self.stop_pulse()
-                elif event[1] == 'start':
-                    self.start_pulse()
-            elif event[0] == 'finished':
-                logging.info(event[1])
-                log_util = ContextFilter()
-                log_util.send_install_result("True")
-                if (self.settings.get('bootloader_install') and
-                        not self.settings.get('bootloader_installation_successful')):
-                    # Warn user about GRUB and ask if we should open wiki page.
-                    boot_warn = _("IMPORTANT: There may have been a problem "
-                                  "with the bootloader installation which "
-                                  "could prevent your system from booting "
-                                  "properly. Before rebooting, you may want "
-                                  "to verify whether or not the bootloader is "
-                                  "installed and configured.\n\n"
-                                  "The Arch Linux Wiki contains "
-                                  "troubleshooting information:\n"
-                                  "\thttps://wiki.archlinux.org/index.php/GRUB\n\n"
-                                  "Would you like to view the wiki page now?")
-                    response = show.question(self.get_main_window(), boot_warn)
-                    if response == Gtk.ResponseType.YES:
-                        import webbrowser
-                        misc.drop_privileges()
-                        wiki_url = 'https://wiki.archlinux.org/index.php/GRUB'
-                        webbrowser.open(wiki_url)
-
-                install_ok = _("Installation Complete!\n"
-                               "Do you want to restart your system now?")
-                response = show.question(self.get_main_window(), install_ok)
-                misc.remove_temp_files()
-                logging.shutdown()
-                if response == Gtk.ResponseType.YES:
-                    self.reboot()
-                else:
-                    sys.exit(0)
-                return False
-            elif event[0] == 'error':
-                log_util = ContextFilter()
-                log_util.send_install_result("False")
+                break
+            self.pending_events = max(0, self.pending_events - 1)
+            if self.event_recorder:
+                self.event_recorder.record(event)
+            # Messages are translated here, not in the installer process
+            batch.append(events.decode_event(event, _))
+
+        keep_going = self.manage_events(batch)
+
+        if keep_going and self.pending_events > 0 and not self.event_retries:
+            # Some events have been signaled but are still on their way
+            # through the queue pipe. Do not block GTK waiting for them
+            self.event_retries = EVENT_MAX_RETRIES
+            GLib.timeout_add(EVENT_RETRY, self.on_events_retry)
+        return keep_going
+
+    def on_events_retry(self):
+        """ Reads events that were not received on last wake up """
+        if self.fatal_error:
+            self.event_retries = 0
+            return False
+        self.event_retries -= 1
+        if self.event_retries <= 0:
+            # Event has been read before its wake up
+            self.pending_events = 0
+        keep_going = self.read_events()
+        if not keep_going or self.pending_events <= 0:
+            self.event_retries = 0
+            return False
+        return True
+
+    def on_events_poll(self):
+        """ Reads events whose wake up has been missed """
+        if self.fatal_error:
+            return False
+        return self.read_events()
+
+    def manage_events(self, batch):
+        """ Manages a batch of events. Of events that just update the same
+            widget (progress bars, info label) only the last one is shown """
+        last_index = {}
+        for index, event in enumerate(batch):
+            if event[0] in COALESCED_EVENTS:
+                last_index[event[0]] = index
+
+        for index, event in enumerate(batch):
+            if event[0] in COALESCED_EVENTS and last_index[event[0]] != index:
+                if event[0] == 'info':
+                    logging.info(event[1])
                 self.callback_queue.task_done()
-                # A fatal error has been issued. We empty the queue
-                self.empty_queue()
-
-                # Add install id to error message (we can lookup logs on bugsnag by the install id)
-                tpl = _(
-                    'Please reference the following number when reporting this error: ')
-                error_message = '{0}\n{1}{2}'.format(
-                    event[1], tpl, log_util.install_id)
-
-                # Show the error
-                show.fatal_error(self.get_main_window(), error_message)
-            elif event[0] == 'info':
-                logging.info(event[1])
-                if self.should_pulse:
-                    self.progress_bar.set_text(event[1])
-                else:
-                    self.set_message(event[1])
-
-            elif event[0] == 'cache_pkgs_md5_check_failed':
-                logging.debug(
-                    'Adding %s to cache_pkgs_md5_check_failed list',
-                    event[1])
-                self.settings.set('cache_pkgs_md5_check_failed', event[1])
+                continue
 
+            keep_going = self.manage_event(event)
             self.callback_queue.task_done()
+            if not keep_going:
+                return False
+            if event[0] == 'error':
+                # Fatal error, the queue has been emptied. Discard the
+                # events of this batch too
+                for _event in batch[index + 1:]:
+                    self.callback_queue.task_done()
+                break
+
+        return True
+
+    def manage_event(self, event):
+        """ Manages one event. Returns False if no more events
+            must be managed """
+        if event[0] == 'percent':
+            self.progress_bar.set_fraction(float(event[1]))
+        elif event[0] == 'downloads_percent':
+            self.downloads_progress_bar.set_fraction(float(event[1]))
+        elif event[0] == 'progress_bar_show_text':
+            if event[1]:
+                # self.progress_bar.set_show_text(True)
+                self.progress_bar.set_text(event[1])
+            else:
+                # self.progress_bar.set_show_text(False)
+                self.progress_bar.set_text("")
+        elif event[0] == 'progress_bar':
+            if event[1] == 'hide':
+                self.progress_bar.hide()
+            elif event[1] == 'show':
+                self.progress_bar.show()
+        elif event[0] == 'downloads_progress_bar':
+            if event[1] == 'hide':
+                self.downloads_progress_bar.hide()
+            elif event[1] == 'show':
+                self.downloads_progress_bar.show()
+        elif event[0] == 'pulse':
+            if event[1] == 'stop':
+                self.stop_pulse()
+            elif event[1] == 'start':
+                self.start_pulse()
+        elif event[0] == 'finished':
+            logging.info(event[1])
+            log_util = ContextFilter()
+            log_util.send_install_result("True")
+            if (self.settings.get('bootloader_install') and
+                    not self.settings.get('bootloader_installation_successful')):
+                # Warn user about GRUB and ask if we should open wiki page.
+                boot_warn = _("IMPORTANT: There may have been a problem "
+                              "with the bootloader installation which "
+                              "could prevent your system from booting "
+                              "properly. Before rebooting, you may want "
+                              "to verify whether or not the bootloader is "
+                              "installed and configured.\n\n"
+                              "The Arch Linux Wiki contains "
+                              "troubleshooting information:\n"
+                              "\thttps://wiki.archlinux.org/index.php/GRUB\n\n"
+                              "Would you like to view the wiki page now?")
+                response = show.question(self.get_main_window(), boot_warn)
+                if response == Gtk.ResponseType.YES:
+                    import webbrowser
+                    misc.drop_privileges()
+                    wiki_url = 'https://wiki.archlinux.org/index.php/GRUB'
+                    webbrowser.open(wiki_url)
+
+            install_ok = _("Installation Complete!\n"
+                           "Do you want to restart your system now?")
+            response = show.question(self.get_main_window(), install_ok)
+            misc.remove_temp_files()
+            logging.shutdown()
+            if response == Gtk.ResponseType.YES:
+                self.reboot()
+            else:
+                sys.exit(0)
+            return False
+        elif event[0] == 'error':
+            log_util = ContextFilter()
+            log_util.send_install_result("False")
+            # A fatal error has been issued. We empty the queue
+            self.empty_queue()
+
+            # Add install id to error message (we can lookup logs on bugsnag by the install id)
+            tpl = _(
+                'Please reference the following number when reporting this error: ')
+            error_message = '{0}\n{1}{2}'.format(
+                event[1], tpl, log_util.install_id)
+
+            # Show the error
+            show.fatal_error(self.get_main_window(), error_message)
+        elif event[0] == 'info':
+            logging.info(event[1])
+            if self.should_pulse:
+                self.progress_bar.set_text(event[1])
+            else:
+                self.set_message(event[1])
+
+        elif event[0] == 'cache_pkgs_md5_check_failed':
+            logging.debug(
+                'Adding %s to cache_pkgs_md5_check_failed list',
+                event[1])
+            self.settings.set('cache_pkgs_md5_check_failed', event[1])
+
 
         return True
 
     def empty_queue(self):
         """ Empties messages queue """
+        self.callback_queue.take_wakeups()
+        self.pending_events = 0
+        self.event_retries = 0
         while not self.callback_queue.empty():
             try:
                 self.callback_queue.get_nowait()
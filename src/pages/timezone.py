@@ -301,8 +301,9 @@ class AutoTimezoneProcess(multiprocessing.Process):
         # Do not start looking for our timezone until we've reached the
         # language screen (welcome.py sets timezone_start to true when
         # next is clicked)
+        version = self.settings.get_version()
         while not self.settings.get('timezone_start'):
-            time.sleep(2)
+            version = self.settings.wait_for_change(version)
 
         coords = self.use_geoip()
         if not coords:
@@ -30,16 +30,9 @@
 
 """ Creates mirrorlist sorted by both latest updates and fastest connection """
 
-import queue
-import threading
-import urllib.request
-import urllib.error
-import http.client
-import subprocess
 import logging
 import time
 import os
-import tempfile
 import multiprocessing
 
 import requests
@@ -47,6 +40,22 @@ import requests
 import misc.extra as misc
 
 import update_db
+import geoip
+import mirror_cache
+import mirror_probe
+from mirror_probe import PROBE_WORKERS
+
+# Latency tests are cheap, more of them can be run at the same time
+LATENCY_WORKERS = 16
+
+# Mirrors (with the lowest latency) that get a throughput test
+THROUGHPUT_CANDIDATES = 8
+
+# Best mirrors of our own country that always get a throughput test
+COUNTRY_CANDIDATES = 3
+
+# Antergos auto selection url (redirects to one of the mirrors)
+ANTERGOS_AUTOSELECT = "http://mirrors.antergos.com/$repo/$arch"
 
 # When testing, no _() is available
 try:
@@ -55,13 +64,29 @@ except NameError as err:
     def _(message):
         return message
 
+def write_mirrorlist(path, content):
+    """ Replaces a mirrorlist file atomically (a temporary file is written
+        in the same directory and then renamed) """
+    tmp_path = path + ".cnchi-tmp"
+    with misc.raised_privileges() as __:
+        try:
+            with open(tmp_path, 'w') as mirrorlist:
+                mirrorlist.write(content)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except OSError as err:
+            logging.error("Can't write %s: %s", path, err)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        update_db.sync()
+
+
 class AutoRankmirrorsProcess(multiprocessing.Process):
     """ Process class that downloads and sorts the mirrorlist """
 
     def __init__(self, settings, fraction_pipe):
         """ Initialize process class """
         super().__init__()
-        self.rankmirrors_pid = None
         self.json_obj = None
         self.antergos_mirrorlist = "/etc/pacman.d/antergos-mirrorlist"
         self.arch_mirrorlist = "/etc/pacman.d/mirrorlist"
@@ -69,6 +94,8 @@ class AutoRankmirrorsProcess(multiprocessing.Process):
         self.arch_mirrorlist_ranked = []
         self.settings = settings
         self.fraction = fraction_pipe
+        self.country_code = None
+        self.cache = mirror_cache.MirrorCache()
 
     @staticmethod
     def is_good_mirror(my_mirror):
@@ -83,6 +110,11 @@ class AutoRankmirrorsProcess(multiprocessing.Process):
 
         mirrors = []
 
+        if not self.json_obj:
+            self.json_obj = self.cache.get_status()
+            if self.json_obj:
+                logging.debug("Using cached mirror status information")
+
         if not self.json_obj:
             try:
                 req = requests.get(
@@ -90,7 +122,8 @@ class AutoRankmirrorsProcess(multiprocessing.Process):
                     headers={'User-Agent': 'Mozilla/5.0'}
                 )
                 self.json_obj = req.json()
-            except requests.RequestException as err:
+                self.cache.set_status(self.json_obj)
+            except (requests.RequestException, ValueError) as err:
                 logging.debug(
                     'Failed to retrieve mirror status information: %s',
                     err)
@@ -102,214 +135,217 @@ class AutoRankmirrorsProcess(multiprocessing.Process):
             # Filter incomplete mirrors  and mirrors that haven't synced.
             mirrors = [m for m in mirrors if self.is_good_mirror(m)]
             self.json_obj['urls'] = mirrors
-        except KeyError as err:
+        except (KeyError, TypeError) as err:
             logging.debug('Failed to parse retrieved mirror data: %s', err)
 
         return mirrors
 
-    def sort_mirrors_by_speed(self, mirrors=None, threads=5):
-        """ Sorts mirror list """
+    def send_fraction(self, fraction):
+        """ Sends ranking progress through the pipe (if any) """
+        if self.fraction:
+            self.fraction.send(fraction)
+
+    @staticmethod
+    def get_country_code():
+        """ Returns the ISO code of the country we are in (using GeoIP)
+            or None if it can't be found """
+        try:
+            country = geoip.GeoIP().get_country()
+            if country:
+                return country.iso_code
+        except Exception as err:
+            logging.debug("Can't get country code from GeoIP: %s", err)
+        return None
+
+    @staticmethod
+    def select_candidates(mirrors, latency_order, country_code=None):
+        """ Chooses which mirrors will get a throughput test: the ones with
+            the lowest latency and the best ones of our own country """
+        candidates = latency_order[:THROUGHPUT_CANDIDATES]
+        if country_code:
+            local = [url for url in latency_order
+                     if mirrors[url].get('country_code') == country_code]
+            for url in local[:COUNTRY_CANDIDATES]:
+                if url not in candidates:
+                    candidates.append(url)
+        return candidates
+
+    def sort_mirrors_by_speed(self, mirrors=None, max_workers=PROBE_WORKERS):
+        """ Ranks mirrors in two stages. First, all mirrors are asked for
+            the test file headers (cheap, just measures latency). Then, the
+            fastest ones download the whole file to measure their throughput.
+            Returns the mirrors that answered, best ones first """
         # Ensure that "mirrors" is a list and not a generator.
         if not isinstance(mirrors, list):
             mirrors = list(mirrors)
 
-        num_threads = min(threads, len(mirrors))
-        # URL input queue.Queue
-        q_in = queue.Queue()
-        # URL and rate output queue.Queue
-        q_out = queue.Queue()
+        # Package (or database) used to test mirror speed
+        subpath = mirror_probe.get_probe_subpath()
+        test_urls = {mirror['url'] + subpath: mirror for mirror in mirrors}
 
-        rates = {}
-
-        # Check version of cryptsetup pkg (used to test mirror speed)
-        logging.debug('Checking cryptsetup version with pacman...')
-        try:
-            cmd = ["pacman", "-Ss", "cryptsetup"]
-            line = subprocess.check_output(cmd).decode().split()
-            version = line[1]
+        country_code = self.country_code
+        if country_code:
             logging.debug(
-                'cryptsetup version is: %s (used to test mirror speed)', version)
-        except subprocess.CalledProcessError as err:
-            logging.debug(err)
-            version = False
-
-        def worker():
-            """ worker thread. Retrieves data to test mirror speed """
-            while True:
-                if not q_in.empty():
-                    url = q_in.get()
-                    if version:
-                        db_subpath = 'core/os/x86_64/cryptsetup-{0}-x86_64.pkg.tar.xz'
-                        db_subpath = db_subpath.format(version)
-                    else:
-                        db_subpath = 'core/os/x86_64/core.db.tar.gz'
-                    db_url = url + db_subpath
-                    # Leave the rate as 0 if the connection fails.
-                    # TODO: Consider more graceful error handling.
-                    rate = 0
-                    dtime = float('NaN')
-
-                    req = urllib.request.Request(url=db_url)
-                    try:
-                        time0 = time.time()
-                        with urllib.request.urlopen(req, None, 5) as my_file:
-                            size = len(my_file.read())
-                            dtime = time.time() - time0
-                            rate = size / dtime
-                    except (OSError,
-                            urllib.error.HTTPError,
-                            http.client.HTTPException):
-                        pass
-                    q_out.put((url, rate, dtime))
-                    q_in.task_done()
-
-        # Launch threads
-        for _i in range(num_threads):
-            my_thread = threading.Thread(target=worker)
-            my_thread.start()
-
-        # Load the input queue.Queue
-        url_len = 0
-        for mirror in mirrors:
-            url_len = max(url_len, len(mirror['url']))
-            logging.debug("Rating mirror '%s'", mirror['url'])
-            q_in.put(mirror['url'])
-
-        # Wait for queue to empty
-        old_fraction = 0.0
-        while not q_in.empty():
-            fraction = 1.0 - float(q_in.qsize()) / float(len(mirrors))
-            if fraction != old_fraction:
-                self.fraction.send(fraction)
-                old_fraction = fraction
-
-        # Wait for all threads to complete
-        q_in.join()
-
-        # Log some extra data.
-        url_len = str(url_len)
-        fmt = '%-' + url_len + 's  %14s  %9s'
-        logging.debug(fmt, _("Server"), _("Rate"), _("Time"))
-
-        # Loop over the mirrors just to ensure that we get the rate for each.
-        # The value in the loop does not (necessarily) correspond to the mirror.
-        fmt = '%-' + url_len + 's  %8.2f KiB/s  %7.2f s'
-        for mirror in mirrors:
-            url, rate, dtime = q_out.get()
-            kibps = rate / 1024.0
-            logging.debug(fmt, url, kibps, dtime)
-            rates[url] = rate
-            q_out.task_done()
-
-        # Sort by rate.
-        rated_mirrors = [m for m in mirrors if rates[m['url']] > 0]
-        rated_mirrors.sort(key=lambda m: rates[m['url']], reverse=True)
-
-        return rated_mirrors
-
-    def uncomment_antergos_mirrors(self):
-        """ Uncomment Antergos mirrors and comment out auto selection so
-        rankmirrors can find the best mirror. """
-
-        autoselect = "http://mirrors.antergos.com/$repo/$arch"
-        autoselect_on = True
-        autoselect_sf = True
-
-        if os.path.exists(self.antergos_mirrorlist):
-            with open(self.antergos_mirrorlist) as mirrors:
-                lines = [x.strip() for x in mirrors.readlines()]
-
-            for i, line in enumerate(lines):
-                srv_comment = line.startswith("#Server")
-                srv = line.startswith("Server")
-
-                if autoselect_on and srv and autoselect in line:
-                    # Comment out auto selection
-                    lines[i] = "#" + line
-                    autoselect_on = False
-                elif autoselect_sf and srv and 'sourceforge' in line:
-                    # Comment out sourceforge auto selection url
-                    lines[i] = "#" + line
-                    autoselect_sf = False
-                elif srv_comment and autoselect not in line and 'sourceforge' not in line:
-                    # Uncomment Antergos mirror
-                    lines[i] = line.lstrip("#")
-
-            with misc.raised_privileges() as __:
-                # Write new one
-                with open(self.antergos_mirrorlist, 'w') as mirrors:
-                    mirrors.write("\n".join(lines) + "\n")
-                update_db.sync()
+                "Mirrors from %s will be preferred when ranking", country_code)
+
+        # Stage 1: latency of all mirrors (first half of the progress bar)
+        prober = mirror_probe.MirrorProber(
+            max_workers=LATENCY_WORKERS,
+            progress_callback=lambda fraction: self.send_fraction(fraction / 2))
+        latency_order = mirror_probe.sort_by_latency(
+            prober.probe(test_urls.keys(), mirror_probe.probe_latency))
+        logging.debug(
+            "%d of %d mirrors have answered the latency test",
+            len(latency_order), len(mirrors))
+
+        # Stage 2: throughput of the best candidates
+        candidates = self.select_candidates(
+            test_urls, latency_order, country_code)
+        prober = mirror_probe.MirrorProber(
+            max_workers=max_workers,
+            progress_callback=lambda fraction: self.send_fraction(0.5 + fraction / 2))
+        results = prober.probe(candidates)
+        mirror_probe.log_results(results)
+
+        # Sort by rate. Mirrors that have not been tested (or have failed
+        # the throughput test) go after them, sorted by latency.
+        rated = [url for url in candidates if results[url].rate > 0]
+        rated.sort(key=lambda url: results[url].rate, reverse=True)
+        tested = set(rated)
+        rated += [url for url in latency_order if url not in tested]
+
+        return [test_urls[url] for url in rated]
+
+    def get_antergos_mirrors(self):
+        """ Returns all Antergos mirror urls in the mirrorlist (commented
+            or not), except the auto selection ones (they redirect to one
+            of the others, so they are of no use when ranking) """
+        urls = []
+        if not os.path.exists(self.antergos_mirrorlist):
+            return urls
+
+        with open(self.antergos_mirrorlist) as mirrors:
+            for line in mirrors:
+                line = line.strip().lstrip("#").strip()
+                if not line.startswith("Server"):
+                    continue
+                url = line.split("=", 1)[-1].strip()
+                if (url and url not in urls and
+                        ANTERGOS_AUTOSELECT not in url and
+                        'sourceforge' not in url):
+                    urls.append(url)
+        return urls
 
     def run_rankmirrors(self):
-        """ Runs rankmirrors to sort Antergos mirrors """
-        if os.path.exists("/usr/bin/rankmirrors"):
-            self.uncomment_antergos_mirrors()
-            try:
-                # Store rankmirrors output in a temporary file
-                with tempfile.TemporaryFile(mode='w+t') as temp_file:
-                    cmd = [
-                        'rankmirrors',
-                        '-n', '0',
-                        '-r', 'antergos',
-                        self.antergos_mirrorlist]
-                    subprocess.call(cmd, stdout=temp_file)
-                    temp_file.seek(0)
-                    # Copy new mirrorlist to the old one
-                    with misc.raised_privileges() as __:
-                        with open(self.antergos_mirrorlist, 'w') as antergos_mirrorlist_file:
-                            antergos_mirrorlist_file.write(temp_file.read())
-                    update_db.sync()
-            except subprocess.CalledProcessError as why:
-                logging.debug(
-                    'Cannot run rankmirrors on Antergos mirrorlist: %s',
-                    why)
+        """ Sorts Antergos mirrors by speed, downloading the antergos
+            database from all of them at the same time """
+        urls = self.get_antergos_mirrors()
+        if not urls:
+            logging.debug("No Antergos mirrors found to rank")
+            return [], []
+
+        test_urls = {}
+        for url in urls:
+            test_url = url.replace('$repo', 'antergos').replace('$arch', 'x86_64')
+            test_urls[test_url.rstrip('/') + '/antergos.db'] = url
+
+        prober = mirror_probe.MirrorProber()
+        results = prober.probe(test_urls.keys())
+        mirror_probe.log_results(results)
+
+        ranked = [url for url in test_urls if results[url].rate > 0]
+        ranked.sort(key=lambda url: results[url].rate, reverse=True)
+        if not ranked:
+            logging.warning(
+                "No Antergos mirror has answered, its mirrorlist won't be modified")
+            return [], []
+
+        ranked = [test_urls[url] for url in ranked]
+        failed = [url for url in urls if url not in ranked]
+        self.write_antergos_mirrorlist(ranked, failed)
+        return ranked, failed
+
+    def write_antergos_mirrorlist(self, ranked, failed):
+        """ Writes Antergos mirrorlist (mirrors that have failed the
+            ranking are kept, but commented out) """
+        output = '# Antergos mirrorlist generated by Cnchi #\n'
+        for url in ranked:
+            output += "Server = {0}\n".format(url)
+        for url in failed:
+            output += "#Server = {0}\n".format(url)
+        write_mirrorlist(self.antergos_mirrorlist, output)
 
     def filter_and_sort_arch_mirrorlist(self):
         """ Sort Arch mirrorlist """
-        output = '# Arch Linux mirrorlist generated by Cnchi #\n'
         mlist = self.get_mirror_stats()
         logging.debug("Arch mirror stats downloaded.")
         mirrors = self.sort_mirrors_by_speed(mirrors=mlist)
 
-        for mirror in mirrors:
-            self.arch_mirrorlist_ranked.append(mirror['url'])
-            output += "Server = {0}{1}/os/{2}\n".format(
-                mirror['url'],
-                '$repo',
-                '$arch')
-
-        # Write modified Arch mirrorlist
-        with misc.raised_privileges() as __:
-            with open(self.arch_mirrorlist, 'w') as arch_mirrors:
-                arch_mirrors.write(output)
-            update_db.sync()
-
-    def run(self):
-        """ Run process """
+        self.arch_mirrorlist_ranked = [
+            mirror['url'] for mirror in mirrors if mirror['url']]
+        self.write_arch_mirrorlist(self.arch_mirrorlist_ranked)
 
-        # Wait until there is an Internet connection available
-        while not misc.has_connection():
-            time.sleep(2)  # Delay, try again after 2 seconds
+    def write_arch_mirrorlist(self, urls):
+        """ Writes Arch mirrorlist """
+        output = '# Arch Linux mirrorlist generated by Cnchi #\n'
+        for url in urls:
+            output += "Server = {0}{1}/os/{2}\n".format(url, '$repo', '$arch')
+        write_mirrorlist(self.arch_mirrorlist, output)
+
+    def use_cached_ranking(self, ranking):
+        """ Writes both mirrorlists from a cached ranking """
+        self.arch_mirrorlist_ranked = ranking['arch']
+        if ranking['arch']:
+            self.write_arch_mirrorlist(ranking['arch'])
+        if ranking['antergos']:
+            self.write_antergos_mirrorlist(
+                ranking['antergos'], ranking['antergos_failed'])
+        self.settings.set('rankmirrors_result', self.arch_mirrorlist_ranked)
 
+    def rank_all_mirrors(self):
+        """ Ranks both Arch and Antergos mirrors and stores the result """
         logging.debug("Updating both mirrorlists (Arch and Antergos)...")
         update_db.update_mirrorlists()
 
         logging.debug("Filtering and sorting Arch mirrors...")
         self.filter_and_sort_arch_mirrorlist()
-
-        self.arch_mirrorlist_ranked = [
-            x for x in self.arch_mirrorlist_ranked if x]
         self.settings.set('rankmirrors_result', self.arch_mirrorlist_ranked)
 
-        logging.debug(
-            "Running rankmirrors command to sort Antergos mirrors...")
-        self.run_rankmirrors()
+        logging.debug("Sorting Antergos mirrors...")
+        ranked, failed = self.run_rankmirrors()
+
+        if self.arch_mirrorlist_ranked:
+            self.cache.set_ranking(
+                self.country_code, self.arch_mirrorlist_ranked, ranked, failed)
+
+    def run(self):
+        """ Run process """
+
+        # Wait until there is an Internet connection available
+        while not misc.has_connection():
+            time.sleep(2)  # Delay, try again after 2 seconds
+
+        self.country_code = self.get_country_code()
+
+        ranking = self.cache.get_ranking(self.country_code)
+        if ranking:
+            # Fresh ranking from a previous run, nothing else to do
+            logging.debug("Using cached mirror ranking")
+            self.use_cached_ranking(ranking)
+        else:
+            ranking = self.cache.get_ranking(
+                self.country_code, mirror_cache.RANKING_MAX_AGE)
+            if ranking:
+                # Stale ranking. It is used until the new one is ready
+                logging.debug("Using old mirror ranking while ranking mirrors again")
+                self.use_cached_ranking(ranking)
+            self.rank_all_mirrors()
 
         logging.debug("Auto mirror selection has been run successfully.")
 
-        self.fraction.send(1.0)
-        self.fraction.close()
+        if self.fraction:
+            self.fraction.send(1.0)
+            self.fraction.close()
 
 def test_module():
     """ Helper function to test this module """
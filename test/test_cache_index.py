@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_cache_index.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for download.cache_index """
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import download.cache_index as cache_index
+
+
+class VerifiedIndexTest(unittest.TestCase):
+    """ VerifiedIndex load, save and invalidation """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'pkg')
+        self.index_dir = os.path.join(self.tmp_dir, 'index')
+        os.makedirs(self.cache_dir)
+        self.path = os.path.join(self.cache_dir, 'foo.pkg.tar.xz')
+        self.write_package(b'foo' * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_package(self, data):
+        """ Creates (or replaces) the test package """
+        with open(self.path, 'wb') as pkg_file:
+            pkg_file.write(data)
+        return hashlib.sha256(data).hexdigest()
+
+    def new_index(self):
+        """ Returns an index of the test cache dir """
+        return cache_index.VerifiedIndex(self.cache_dir, self.index_dir)
+
+    def test_index_in_cache_dir(self):
+        """ By default, the index travels with its cache directory """
+        index = cache_index.VerifiedIndex(self.cache_dir)
+        index.get_hash(self.path)
+        index.save()
+        self.assertEqual(
+            sorted(os.listdir(self.cache_dir)),
+            [cache_index.INDEX_NAME, 'foo.pkg.tar.xz'])
+
+    def test_index_outside_cache_dir(self):
+        """ Indexes of target caches must not end up in the cache directory """
+        original_index_dir = cache_index.INDEX_DIR
+        cache_index.INDEX_DIR = self.index_dir
+        try:
+            cache_index.keep_index_outside(self.cache_dir)
+            index = cache_index.get_index(self.cache_dir)
+            index.get_hash(self.path)
+            index.save()
+        finally:
+            cache_index.INDEX_DIR = original_index_dir
+        self.assertEqual(os.listdir(self.cache_dir), ['foo.pkg.tar.xz'])
+        self.assertEqual(os.path.dirname(index.path), self.index_dir)
+
+    def test_hash_is_saved_and_loaded(self):
+        """ A saved hash is used again without reading the file """
+        index = self.new_index()
+        digest = index.get_hash(self.path)
+        self.assertEqual(digest, cache_index.compute_hash(self.path))
+        index.save()
+
+        index = self.new_index()
+        self.assertIn('foo.pkg.tar.xz', index.entries)
+        original_compute_hash = cache_index.compute_hash
+        cache_index.compute_hash = None
+        try:
+            self.assertEqual(index.get_hash(self.path), digest)
+        finally:
+            cache_index.compute_hash = original_compute_hash
+
+    def test_modified_file_is_hashed_again(self):
+        """ Changing the file invalidates its entry """
+        index = self.new_index()
+        index.get_hash(self.path)
+        stat = os.stat(self.path)
+        new_digest = self.write_package(b'bar' * 2000)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(index.get_hash(self.path), new_digest)
+
+    def test_add_hash(self):
+        """ Hashes computed while downloading are stored """
+        index = self.new_index()
+        index.add_hash(self.path, 'sha256', 'abc')
+        self.assertTrue(index.modified)
+        self.assertEqual(index.get_hash(self.path), 'abc')
+
+    def test_save_without_changes(self):
+        """ Nothing is written if nothing has changed """
+        index = self.new_index()
+        index.save()
+        self.assertFalse(os.path.exists(index.path))
+
+    def test_corrupt_index_is_ignored(self):
+        """ A broken index file is ignored """
+        index = self.new_index()
+        os.makedirs(self.index_dir)
+        with open(index.path, 'w') as index_file:
+            index_file.write('{broken')
+        self.assertEqual(self.new_index().entries, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_config.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for config.Settings (shared memory settings) """
+
+import multiprocessing
+import os
+import sys
+import unittest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import config
+
+
+def set_in_child(settings):
+    """ Changes settings from another process """
+    settings.set('hostname', 'child')
+    settings.set('xz_cache', ['/child'])
+
+
+class SettingsTest(unittest.TestCase):
+    """ Settings round trip, copies and size limit """
+
+    def setUp(self):
+        self.settings = config.Settings()
+
+    def test_round_trip(self):
+        """ A value that is set is read back """
+        self.settings.set('hostname', 'antergos-test')
+        self.assertEqual(self.settings.get('hostname'), 'antergos-test')
+        self.assertIsNone(self.settings.get('no-such-setting'))
+
+    def test_list_append(self):
+        """ Setting a single value to a non empty list appends it """
+        self.settings.set('xz_cache', ['/a'])
+        self.settings.set('xz_cache', '/b')
+        self.assertEqual(self.settings.get('xz_cache'), ['/a', '/b'])
+
+    def test_values_are_copies(self):
+        """ Changing a returned value (or a nested one) does not change
+            the stored settings """
+        self.settings.set('proxies', {'http': ['proxy1']})
+        proxies = self.settings.get('proxies')
+        proxies['http'].append('proxy2')
+        proxies['https'] = []
+        self.assertEqual(self.settings.get('proxies'), {'http': ['proxy1']})
+        all_settings = self.settings.get_all()
+        all_settings['proxies']['http'].append('proxy3')
+        self.assertEqual(self.settings.get('proxies'), {'http': ['proxy1']})
+
+    def test_version(self):
+        """ Version changes each time a setting changes """
+        version = self.settings.get_version()
+        self.settings.set('hostname', 'other')
+        self.assertGreater(self.settings.get_version(), version)
+
+    def test_too_big(self):
+        """ Values that do not fit in shared memory are not stored """
+        self.assertTrue(self.settings.set('hostname', 'small'))
+        self.assertFalse(
+            self.settings.set('hostname', 'x' * (config.SETTINGS_SIZE + 1)))
+        self.assertEqual(self.settings.get('hostname'), 'small')
+
+    def test_other_process(self):
+        """ Changes made by another process are seen by this one """
+        self.settings.get('hostname')
+        process = multiprocessing.Process(
+            target=set_in_child, args=(self.settings,))
+        process.start()
+        process.join()
+        self.assertEqual(self.settings.get('hostname'), 'child')
+        self.assertEqual(self.settings.get('xz_cache'), ['/child'])
+
+    def test_wait_for_change(self):
+        """ Waiting processes are woken up when a setting changes """
+        version = self.settings.get_version()
+        self.assertEqual(
+            self.settings.wait_for_change(version, timeout=0.01), version)
+        process = multiprocessing.Process(
+            target=set_in_child, args=(self.settings,))
+        process.start()
+        new_version = self.settings.wait_for_change(version, timeout=10)
+        process.join()
+        self.assertNotEqual(new_version, version)
+
+    def test_snapshot(self):
+        """ Snapshots keep their values, but for live keys """
+        self.settings.set('hostname', 'before')
+        snapshot = self.settings.snapshot()
+        self.settings.set('hostname', 'after')
+        self.settings.set('rankmirrors_result', ['http://mirror/'])
+        self.assertEqual(snapshot.hostname, 'before')
+        self.assertEqual(snapshot.get('rankmirrors_result'), ['http://mirror/'])
+        with self.assertRaises(AttributeError):
+            snapshot.hostname = 'other'
+
+
+if __name__ == '__main__':
+    unittest.main()
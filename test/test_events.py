@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_events.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for events.EventPublisher and events.CallbackQueue """
+
+import os
+import queue
+import sys
+import unittest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import events
+from events import EventType
+
+
+def get_all(callback_queue):
+    """ Returns all queued events """
+    result = []
+    while True:
+        try:
+            result.append(callback_queue.get_nowait())
+        except queue.Empty:
+            return result
+
+
+class EventPublisherTest(unittest.TestCase):
+    """ Deduplication and rate limiting of events """
+
+    def setUp(self):
+        self.queue = queue.Queue()
+        # Long interval, so rate limited events are always delayed
+        self.publisher = events.EventPublisher(self.queue, max_rate=1)
+
+    def tearDown(self):
+        if self.publisher.timer is not None:
+            self.publisher.timer.cancel()
+
+    def test_repeated_events(self):
+        """ The same event is not sent twice in a row """
+        self.publisher.publish('info', 'Installing')
+        self.publisher.publish('info', 'Installing')
+        self.publisher.publish('info', 'Done')
+        self.assertEqual(
+            get_all(self.queue),
+            [(int(EventType.INFO), None, 'Installing', None),
+             (int(EventType.INFO), None, 'Done', None)])
+
+    def test_old_style_events(self):
+        """ Events of unknown types are sent as (name, text) """
+        self.publisher.publish('custom', 'text')
+        self.assertEqual(get_all(self.queue), [('custom', 'text')])
+
+    def test_rate_limit(self):
+        """ Superseded progress values are dropped, the last one is kept """
+        for value in (0.1, 0.2, 0.3):
+            self.publisher.publish_value(EventType.PERCENT, value)
+        self.assertEqual(
+            get_all(self.queue), [(int(EventType.PERCENT), 0.1, None, None)])
+        self.publisher.flush()
+        self.assertEqual(
+            get_all(self.queue), [(int(EventType.PERCENT), 0.3, None, None)])
+
+    def test_order(self):
+        """ Pending progress events are sent before other events """
+        self.publisher.publish('percent', '0.1')
+        self.publisher.publish('percent', '0.5')
+        self.publisher.publish_message(EventType.INFO, "Package {0}", 'cnchi')
+        self.assertEqual(
+            get_all(self.queue),
+            [(int(EventType.PERCENT), 0.1, None, None),
+             (int(EventType.PERCENT), 0.5, None, None),
+             (int(EventType.INFO), None, "Package {0}", ('cnchi',))])
+
+    def test_full_queue(self):
+        """ Events are dropped (not blocked on) if the queue is full """
+        full_queue = queue.Queue(1)
+        publisher = events.EventPublisher(full_queue)
+        publisher.publish('info', 'first')
+        publisher.publish('info', 'second')
+        self.assertEqual(get_all(full_queue), [(int(EventType.INFO), None, 'first', None)])
+
+    def test_get_publisher(self):
+        """ Each queue has its own (shared) publisher """
+        other_queue = queue.Queue()
+        publisher = events.get_publisher(self.queue)
+        self.assertIs(events.get_publisher(self.queue), publisher)
+        self.assertIsNot(events.get_publisher(other_queue), publisher)
+
+
+class DecodeEventTest(unittest.TestCase):
+    """ Events as seen by the GUI """
+
+    def test_decode(self):
+        """ Messages are translated and formatted """
+        event = events.make_event(EventType.INFO, "Package {0}", args=('cnchi',))
+        self.assertEqual(
+            events.decode_event(event, translate=str.upper),
+            ('info', "PACKAGE cnchi"))
+        self.assertEqual(
+            events.decode_event(events.make_event('percent', '0.5')),
+            ('percent', 0.5))
+
+
+class CallbackQueueTest(unittest.TestCase):
+    """ Wake ups of the callback queue """
+
+    def test_wakeups(self):
+        """ Each queued event writes a wake up """
+        callback_queue = events.CallbackQueue()
+        for number in range(3):
+            callback_queue.put(('info', str(number)))
+        self.assertEqual(callback_queue.take_wakeups(), 3)
+        self.assertEqual(callback_queue.take_wakeups(), 0)
+        self.assertEqual(callback_queue.get(timeout=5), ('info', '0'))
+
+
+if __name__ == '__main__':
+    unittest.main()
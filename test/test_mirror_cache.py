@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_mirror_cache.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for mirror_cache """
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+try:
+    import mirror_cache
+except ImportError:
+    # misc.extra needs dbus
+    mirror_cache = None
+
+ARCH_MIRROR = "http://mirror.example.com/archlinux/"
+OTHER_MIRROR = "http://other.example.com/archlinux/"
+
+
+@unittest.skipIf(mirror_cache is None, "misc.extra can't be imported")
+class MirrorCacheTest(unittest.TestCase):
+    """ Ranking and status storage """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'mirrors.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_ranking_round_trip(self):
+        """ A stored ranking is read back (from disk too) """
+        cache = mirror_cache.MirrorCache(self.path)
+        cache.set_ranking('ES', [ARCH_MIRROR], ['Server = a'], [])
+        ranking = mirror_cache.MirrorCache(self.path).get_ranking('ES')
+        self.assertEqual(ranking['arch'], [ARCH_MIRROR])
+        self.assertEqual(ranking['antergos'], ['Server = a'])
+        self.assertIsNone(cache.get_ranking('FR'))
+
+    def test_old_ranking(self):
+        """ Rankings older than max_age are not used """
+        cache = mirror_cache.MirrorCache(self.path)
+        cache.set_ranking(None, [ARCH_MIRROR], [], [])
+        cache.data['rankings']['unknown']['timestamp'] -= mirror_cache.RANKING_TTL
+        self.assertIsNone(cache.get_ranking(None))
+        self.assertIsNotNone(
+            cache.get_ranking(None, max_age=mirror_cache.RANKING_MAX_AGE))
+
+    def test_failed_mirror_discards_ranking(self):
+        """ A ranking with a mirror that has failed is not used """
+        cache = mirror_cache.MirrorCache(self.path)
+        cache.set_ranking('ES', [ARCH_MIRROR], [], [])
+        mirror_cache.invalidate_mirrors([OTHER_MIRROR + "core/foo"], self.path)
+        self.assertIsNotNone(mirror_cache.MirrorCache(self.path).get_ranking('ES'))
+        mirror_cache.invalidate_mirrors([ARCH_MIRROR + "core/foo"], self.path)
+        self.assertIsNone(mirror_cache.MirrorCache(self.path).get_ranking('ES'))
+
+    def test_status(self):
+        """ Mirror status is only used while it is fresh """
+        cache = mirror_cache.MirrorCache(self.path)
+        cache.set_status({'urls': []})
+        self.assertEqual(cache.get_status(), {'urls': []})
+        cache.data['status']['timestamp'] -= mirror_cache.STATUS_TTL
+        self.assertIsNone(cache.get_status())
+
+    def test_other_version_is_ignored(self):
+        """ Caches written by another Cnchi version are ignored """
+        with open(self.path, 'w') as cache_file:
+            json.dump({'version': -1, 'rankings': {'ES': {}}}, cache_file)
+        self.assertEqual(mirror_cache.MirrorCache(self.path).data['rankings'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_mirror_health.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for download.mirror_health """
+
+import os
+import sys
+import unittest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from download.mirror_health import MirrorHealth, get_host
+
+URLS = [
+    "http://a.example.com/arch/core/os/x86_64/foo.pkg.tar.xz",
+    "http://b.example.com/arch/core/os/x86_64/foo.pkg.tar.xz",
+    "http://c.example.com/arch/core/os/x86_64/foo.pkg.tar.xz",
+    "http://d.example.com/arch/core/os/x86_64/foo.pkg.tar.xz"]
+
+
+class MirrorHealthTest(unittest.TestCase):
+    """ MirrorHealth url sorting and failure tracking """
+
+    def setUp(self):
+        self.health = MirrorHealth()
+
+    def test_get_host(self):
+        """ Only scheme and host are kept """
+        self.assertEqual(get_host(URLS[0]), "http://a.example.com")
+
+    def test_untested_urls_keep_their_order(self):
+        """ Without stats, urls are not reordered """
+        self.assertEqual(self.health.sort_urls(URLS), URLS)
+
+    def test_fastest_first(self):
+        """ Known healthy mirrors go first, fastest first """
+        self.health.record_success(URLS[2], 0.1, 1000, 1.0)
+        self.health.record_success(URLS[3], 0.1, 5000, 1.0)
+        self.assertEqual(
+            self.health.sort_urls(URLS),
+            [URLS[3], URLS[2], URLS[0], URLS[1]])
+
+    def test_failed_mirrors_go_last(self):
+        """ A failed mirror is quarantined and goes to the end """
+        self.health.record_failure(URLS[0])
+        self.assertTrue(self.health.is_quarantined(URLS[0]))
+        self.assertFalse(self.health.is_quarantined(URLS[1]))
+        self.assertEqual(self.health.sort_urls(URLS)[-1], URLS[0])
+        self.assertEqual(self.health.get_failed_hosts(), [get_host(URLS[0])])
+
+    def test_backoff_grows(self):
+        """ Each consecutive failure doubles the quarantine time """
+        self.health.record_failure(URLS[0])
+        first = self.health.stats[get_host(URLS[0])].quarantined_until
+        self.health.record_failure(URLS[0])
+        stats = self.health.stats[get_host(URLS[0])]
+        self.assertEqual(stats.failures, 2)
+        self.assertGreater(stats.quarantined_until, first)
+
+    def test_failed_before_quarantined(self):
+        """ Mirrors out of quarantine go before quarantined ones """
+        self.health.record_failure(URLS[0])
+        self.health.record_failure(URLS[1])
+        # Quarantine of the first one has expired
+        self.health.stats[get_host(URLS[0])].quarantined_until = 0
+        self.assertEqual(
+            self.health.sort_urls(URLS),
+            [URLS[2], URLS[3], URLS[0], URLS[1]])
+
+    def test_success_resets_failures(self):
+        """ A success takes the mirror out of quarantine """
+        self.health.record_failure(URLS[1])
+        self.health.record_success(URLS[1], 0.1, 1000, 1.0)
+        self.assertFalse(self.health.is_quarantined(URLS[1]))
+        self.assertEqual(self.health.get_failed_hosts(), [])
+
+    def test_no_ranges_is_not_a_failure(self):
+        """ Mirrors without byte ranges are only left out of segments """
+        self.health.record_no_ranges(URLS[2])
+        self.assertFalse(self.health.supports_ranges(URLS[2]))
+        self.assertTrue(self.health.supports_ranges(URLS[0]))
+        self.assertFalse(self.health.is_quarantined(URLS[2]))
+        self.assertEqual(self.health.get_failed_hosts(), [])
+        self.assertEqual(self.health.sort_urls(URLS), URLS)
+
+
+if __name__ == '__main__':
+    unittest.main()
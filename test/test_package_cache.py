@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_package_cache.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for pacman.package_cache.PackageCache """
+
+import os
+import sys
+import unittest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from pacman.package_cache import PackageCache
+
+
+class FakePackage(object):
+    """ Just what PackageCache uses of a pyalpm package """
+
+    def __init__(self, name, db_name):
+        self.name = name
+        self.db_name = db_name
+
+
+class FakeDatabase(object):
+    """ Just what PackageCache uses of a pyalpm database """
+
+    def __init__(self, name, pkg_names, groups=None):
+        self.name = name
+        self.pkgs = {pkg_name: FakePackage(pkg_name, name) for pkg_name in pkg_names}
+        self.groups = groups or {}
+        self.lookups = 0
+
+    def get_pkg(self, name):
+        self.lookups += 1
+        return self.pkgs.get(name)
+
+    def read_grp(self, name):
+        pkg_names = self.groups.get(name)
+        if pkg_names is None:
+            return None
+        return (name, [self.pkgs[pkg_name] for pkg_name in pkg_names])
+
+
+class PackageCacheTest(unittest.TestCase):
+    """ Package and group lookups """
+
+    def setUp(self):
+        self.core = FakeDatabase('core', ['bash', 'mate-panel'])
+        self.extra = FakeDatabase(
+            'extra', ['bash', 'firefox', 'mate-panel', 'caja'],
+            {'mate': ['mate-panel', 'caja'], 'xorg': ['firefox']})
+        self.antergos = FakeDatabase(
+            'antergos', ['mate-panel', 'firefox', 'cnchi'],
+            {'mate': ['mate-panel'], 'xorg': ['firefox']})
+        self.cache = PackageCache([self.core, self.extra, self.antergos])
+
+    def test_priority(self):
+        """ Packages are taken from the first database that has them """
+        self.assertEqual(self.cache.get_pkg('bash').db_name, 'core')
+        self.assertEqual(self.cache.get_pkg('firefox').db_name, 'extra')
+        self.assertEqual(self.cache.get_pkg('cnchi').db_name, 'antergos')
+        self.assertIsNone(self.cache.get_pkg('no-such-package'))
+
+    def test_one_repo_groups(self):
+        """ Packages of the mate group only come from the antergos repo """
+        self.assertEqual(self.cache.get_pkg('mate-panel').db_name, 'antergos')
+        # caja is in the mate group of extra, not in the antergos one
+        self.assertEqual(self.cache.get_pkg('caja').db_name, 'extra')
+
+    def test_no_one_repo_db(self):
+        """ Without the antergos repo all databases are used """
+        cache = PackageCache([self.core, self.extra])
+        self.assertEqual(cache.get_pkg('mate-panel').db_name, 'core')
+
+    def test_cached_lookups(self):
+        """ Databases are only searched the first time """
+        self.cache.get_pkg('firefox')
+        self.cache.get_pkg('no-such-package')
+        lookups = self.core.lookups + self.extra.lookups + self.antergos.lookups
+        self.assertEqual(self.cache.get_pkg('firefox').db_name, 'extra')
+        self.assertIsNone(self.cache.get_pkg('no-such-package'))
+        self.assertEqual(
+            self.core.lookups + self.extra.lookups + self.antergos.lookups,
+            lookups)
+
+    def test_get_group(self):
+        """ Groups are taken from the first database that has them """
+        self.assertEqual(
+            [pkg.db_name for pkg in self.cache.get_group('xorg')], ['extra'])
+        self.assertIsNone(self.cache.get_group('no-such-group'))
+
+
+if __name__ == '__main__':
+    unittest.main()
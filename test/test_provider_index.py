@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_provider_index.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for pacman.provider_index (with fake databases and packages) """
+
+import os
+import sys
+import unittest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from pacman.provider_index import ProviderIndex, parse_dep
+
+try:
+    import pyalpm
+except ImportError:
+    pyalpm = None
+
+
+class FakePackage(object):
+    """ Just the package attributes ProviderIndex uses """
+
+    def __init__(self, name, version='1.0-1', provides=None):
+        self.name = name
+        self.version = version
+        self.provides = provides or []
+
+    def __repr__(self):
+        return self.name
+
+
+class FakeDatabase(object):
+    """ Sync database with a package cache """
+
+    def __init__(self, name, pkgs):
+        self.name = name
+        self.pkgcache = pkgs
+
+
+class ProviderIndexTest(unittest.TestCase):
+    """ ProviderIndex.find_satisfier """
+
+    def setUp(self):
+        self.sh_core = FakePackage('bash', '4.4-1', ['sh'])
+        self.sh_extra = FakePackage('zsh', '5.5-1', ['sh'])
+        self.java = FakePackage('jre8', '8.1-1', ['java-runtime=8'])
+        self.index = ProviderIndex([
+            FakeDatabase('core', [self.sh_core]),
+            FakeDatabase('extra', [self.sh_extra, self.java])])
+
+    def test_parse_dep(self):
+        """ Dependency strings are split in name, operator and version """
+        self.assertEqual(parse_dep('glibc>=2.26'), ('glibc', '>=', '2.26'))
+        self.assertEqual(parse_dep('glibc'), ('glibc', None, None))
+
+    def test_package_name(self):
+        """ A package satisfies its own name """
+        self.assertIs(self.index.find_satisfier('zsh'), self.sh_extra)
+
+    def test_first_database_wins(self):
+        """ Providers are searched in database order """
+        self.assertIs(self.index.find_satisfier('sh'), self.sh_core)
+
+    def test_missing(self):
+        """ Unknown dependencies are not satisfied """
+        self.assertIsNone(self.index.find_satisfier('python'))
+        self.assertNotIn('python', self.index)
+        self.assertIn('sh', self.index)
+
+    def test_unversioned_provision(self):
+        """ A provision without version can't satisfy a versioned dep """
+        self.assertIsNone(self.index.find_satisfier('sh>=1'))
+
+    @unittest.skipIf(pyalpm is None, "pyalpm is needed to compare versions")
+    def test_versioned(self):
+        """ Versions are compared like alpm does """
+        self.assertIs(self.index.find_satisfier('bash>=4.0'), self.sh_core)
+        self.assertIsNone(self.index.find_satisfier('bash>=5.0'))
+        self.assertIs(self.index.find_satisfier('java-runtime=8'), self.java)
+
+
+if __name__ == '__main__':
+    unittest.main()
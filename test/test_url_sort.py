@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# test_url_sort.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests for the mirror url sort of download.download """
+
+import os
+import sys
+import unittest
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+try:
+    from download import download
+except ImportError:
+    # pyalpm and misc.extra (dbus) are needed
+    download = None
+
+RANKED = [
+    "http://fast.example.com/archlinux/$repo/os/$arch",
+    "https://medium.example.com/arch/$repo/os/$arch",
+    "http://fast.example.com/other/$repo/os/$arch",
+    ""]
+
+
+class FakeSettings(object):
+    """ Settings with just the ranked mirrors """
+
+    def __init__(self):
+        self.reads = 0
+
+    def get(self, key):
+        """ Returns the ranked mirrors """
+        self.reads += 1
+        return RANKED if key == 'rankmirrors_result' else None
+
+
+@unittest.skipIf(download is None, "download module can't be imported")
+class UrlSortTest(unittest.TestCase):
+    """ get_mirror_ranks and DownloadPackages.url_sort_helper """
+
+    def test_get_mirror_ranks(self):
+        """ Each host keeps the position of its first url """
+        self.assertEqual(
+            download.get_mirror_ranks(RANKED),
+            {"http://fast.example.com": 0, "https://medium.example.com": 1})
+        self.assertEqual(download.get_mirror_ranks(None), {})
+
+    def test_url_sort_helper(self):
+        """ Urls are sorted by mirror rank, unranked ones last """
+        down = download.DownloadPackages.__new__(download.DownloadPackages)
+        down.settings = FakeSettings()
+        down.mirror_ranks = None
+        urls = [
+            "http://unknown.example.com/core/foo.pkg.tar.xz",
+            "https://medium.example.com/arch/core/os/x86_64/foo.pkg.tar.xz",
+            "",
+            "http://fast.example.com/archlinux/core/os/x86_64/foo.pkg.tar.xz"]
+        self.assertEqual(
+            sorted(urls, key=down.url_sort_helper),
+            [urls[3], urls[1], urls[0], urls[2]])
+        self.assertEqual(down.url_sort_helper(""), download.UNRANKED)
+        # Ranked mirrors are only read from settings once
+        self.assertEqual(down.settings.reads, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
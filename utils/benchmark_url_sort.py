@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# benchmark_url_sort.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Compares the old mirror url sort (a settings lookup and a linear scan
+    of the ranked mirrors for each url) with the host -> rank map used by
+    DownloadPackages.url_sort_helper
+
+    The old sort is run on QueueSettings, which stores settings the way
+    config.Settings used to (a dict passed through a one element
+    multiprocessing queue), so each lookup costs what it used to cost.
+
+    Usage: python utils/benchmark_url_sort.py [packages] [urls per package] """
+
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import config
+from download.download import get_mirror_ranks, UNRANKED
+from download.mirror_health import get_host
+
+NUM_MIRRORS = 150
+
+
+class QueueSettings(object):
+    """ Settings stored in a one element multiprocessing queue (as
+        config.Settings did before using shared memory) """
+
+    def __init__(self, settings):
+        self.settings = multiprocessing.Queue(1)
+        self.settings.put(settings)
+
+    def get(self, key):
+        """ Get one setting value (a copy of all settings is unpickled) """
+        settings = self.settings.get()
+        copy = settings.copy()
+        self.settings.put(settings)
+        return copy.get(key, None)
+
+
+def old_url_sort_helper(settings, url):
+    """ url_sort_helper as it was before the host -> rank map """
+    if not url:
+        return 9999
+    ranked = settings.get('rankmirrors_result')
+    partial = '/'.join(url.split('/')[:3])
+    position = [i for i, s in enumerate(ranked) if partial in s] or [9999]
+    return position[0]
+
+
+def create_download_plan(num_packages, urls_per_package):
+    """ Returns a list of url lists (one per package) """
+    mirrors = ["http://mirror{0}.example.org/archlinux/".format(num)
+               for num in range(NUM_MIRRORS)]
+    plan = []
+    for num in range(num_packages):
+        filename = "package{0}-1.0-1-x86_64.pkg.tar.xz".format(num)
+        urls = [mirror + "core/os/x86_64/" + filename
+                for mirror in random.sample(mirrors, urls_per_package)]
+        plan.append(urls)
+    return mirrors, plan
+
+
+def benchmark():
+    """ Runs both sorts over the same download plan """
+    num_packages = int(sys.argv[1]) if len(sys.argv) > 1 else 1500
+    urls_per_package = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+
+    mirrors, plan = create_download_plan(num_packages, urls_per_package)
+    ranked = list(mirrors)
+    random.shuffle(ranked)
+
+    # All default settings go through the queue, as they used to
+    all_settings = config.Settings().get_all()
+    all_settings['rankmirrors_result'] = ranked
+    settings = QueueSettings(all_settings)
+
+    time0 = time.perf_counter()
+    old_result = [
+        sorted(urls, key=lambda url: old_url_sort_helper(settings, url))
+        for urls in plan]
+    old_time = time.perf_counter() - time0
+
+    time0 = time.perf_counter()
+    ranks = get_mirror_ranks(settings.get('rankmirrors_result'))
+    new_result = [
+        sorted(urls, key=lambda url: ranks.get(get_host(url), UNRANKED))
+        for urls in plan]
+    new_time = time.perf_counter() - time0
+
+    assert old_result == new_result, "Both sorts must give the same result"
+
+    print("{0} packages, {1} urls each, {2} ranked mirrors".format(
+        num_packages, urls_per_package, len(ranked)))
+    print("Linear scan:      {0:8.3f} s".format(old_time))
+    print("Host -> rank map: {0:8.3f} s".format(new_time))
+    print("Speedup:          {0:8.1f}x".format(old_time / new_time))
+
+
+if __name__ == '__main__':
+    benchmark()
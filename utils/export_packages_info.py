@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# export_packages_info.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Exports the info of all packages of the sync databases to a json file
+    (see pacman.pkginfo.export_pkginfo), so tools can read package
+    metadata without using alpm
+
+    Usage: python utils/export_packages_info.py [output file] [pacman.conf] """
+
+import logging
+import os
+import sys
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import pacman.pac as pac
+
+DEFAULT_PATH = "/tmp/cnchi-packages.json"
+
+
+def export():
+    """ Opens an alpm session and exports all sync packages """
+    logging.basicConfig(level=logging.DEBUG)
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH
+    conf_path = sys.argv[2] if len(sys.argv) > 2 else "/etc/pacman.conf"
+
+    pacman = pac.Pac(conf_path)
+    try:
+        num_packages = pacman.export_packages_info(path)
+    finally:
+        pacman.release()
+    print("{0} packages exported to {1}".format(num_packages, path))
+
+
+if __name__ == '__main__':
+    export()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# replay_events.py
+#
+# Copyright © 2013-2018 Antergos
+#
+# This file is part of Cnchi.
+#
+# Cnchi is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# Cnchi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# The following additional terms are in effect as per Section 7 of the license:
+#
+# The preservation of all legal notices and author attributions in
+# the material or in the Appropriate Legal Notices displayed
+# by works containing it is required.
+#
+# You should have received a copy of the GNU General Public License
+# along with Cnchi; If not, see <http://www.gnu.org/licenses/>.
+
+""" Replays the events recorded by Cnchi (cnchi --record-events file),
+    keeping their timing, and prints them as the GUI would show them
+    (translated and formatted). Useful to check the installer event
+    stream without installing anything
+
+    Usage: python utils/replay_events.py events file [speed] """
+
+import gettext
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import events
+
+# Stops the reader once all events have been replayed
+END_OF_EVENTS = None
+
+
+def replay():
+    """ Sends the recorded events to a queue (from another thread)
+        and prints them as they arrive """
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    path = sys.argv[1]
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    if not os.path.exists(path):
+        print("Can't find {0}".format(path))
+        sys.exit(1)
+
+    translation = gettext.translation('cnchi', fallback=True)
+    callback_queue = queue.Queue()
+
+    def sender():
+        """ Replays all events and tells the reader it is done """
+        try:
+            events.replay_events(path, callback_queue, speed)
+        finally:
+            callback_queue.put(END_OF_EVENTS)
+
+    threading.Thread(target=sender, daemon=True).start()
+
+    start = time.monotonic()
+    count = 0
+    event = callback_queue.get()
+    while event is not END_OF_EVENTS:
+        name, text = events.decode_event(event, translation.gettext)
+        print("{0:9.3f}  {1:<24} {2}".format(
+            time.monotonic() - start, name, text))
+        count += 1
+        event = callback_queue.get()
+    print("{0} events replayed".format(count))
+
+
+if __name__ == '__main__':
+    replay()